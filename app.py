@@ -1,37 +1,40 @@
 import sys
 import os
-from typing import Dict, Tuple, List
+import multiprocessing
+from typing import List
 
 from PyQt6.QtWidgets import (
     QApplication, QMainWindow, QPushButton,
-    QVBoxLayout, QHBoxLayout, QWidget
+    QVBoxLayout, QHBoxLayout, QWidget, QLabel
 )
-from PyQt6.QtCore import QThreadPool, pyqtSlot, QThread
+from PyQt6.QtCore import pyqtSlot, QTimer
 from PyQt6.QtGui import QIcon
 
-from google.oauth2.credentials import Credentials
-from google.auth.transport.requests import Request
-
-from ulid import ULID
-
 from widget import (
-    FileSelectDialog, FileListWidget, FileListWidgetItem,
+    FileSelectDialog, FileListWidget,
     InvalidOrNotExistGoogleDriveCredentialMessageBox,
-    GoogleLoginMessageBox, GoogleDriveLinkMessageBox
+    GoogleLoginMessageBox, GoogleDriveLinkMessageBox,
+    BandwidthLimitDialog, BulkIngestDialog,
+    MetricsDialog
 )
 
-from worker import (
-    S3UploadWorker, GoogleDriveUploadWorker,
-    UploadWaiterWorker
-)
-
-from util.api import create_api_upload_worker
-
+from worker import S3_BACKEND, GOOGLE_DRIVE_BACKEND, API_BACKEND
 
-from db import QtDBObject
+from util.pipeline import UploadPipeline
+from util.startup_probe import (
+    get_startup_probe,
+    MAIN_STARTED_MARK, WINDOW_SHOWN_MARK,
+    HISTORY_LOADED_MARK, GOOGLE_DRIVE_CHECKED_MARK
+)
 
 basedir = os.path.dirname(__file__)
 
+BACKEND_LABEL_DICT = {
+    S3_BACKEND: "R2",
+    GOOGLE_DRIVE_BACKEND: "Drive",
+    API_BACKEND: "API"
+}
+
 try:
     from ctypes import windll  # Only exists on Windows.
     myappid = 'com.3dskyfree.uploader.beta1'
@@ -41,11 +44,8 @@ except ImportError:
 
 class MainWindow(QMainWindow):
     
-    def init_db(self):
-        self.db = QtDBObject()
-        
-    def init_threadpool(self):
-        self.upload_threadpool = QThreadPool()
+    def init_pipeline(self):
+        self.pipeline = UploadPipeline()
     
     def init_ui(self):
         self.setWindowTitle("R2 Google Drive Uploader")
@@ -60,7 +60,12 @@ class MainWindow(QMainWindow):
         new_3d_file_btn.clicked.connect(self.upload_new_3d_file)
         google_btn_layout.addWidget(new_3d_file_btn)
 
-        self.google_login_btn = QPushButton("Google Drive Login")
+        bulk_upload_btn = QPushButton("Bulk Upload")
+        bulk_upload_btn.clicked.connect(self.bulk_upload)
+        google_btn_layout.addWidget(bulk_upload_btn)
+
+        # the stored login is checked in the background after the window shows
+        self.google_login_btn = QPushButton("Checking Google Drive Login")
         self.google_login_btn.clicked.connect(self.google_login)
         self.google_login_btn.setEnabled(False)
         google_btn_layout.addWidget(self.google_login_btn)
@@ -70,13 +75,32 @@ class MainWindow(QMainWindow):
         self.google_drive_link_btn.setEnabled(False)
         google_btn_layout.addWidget(self.google_drive_link_btn)
 
+        bandwidth_limit_btn = QPushButton("Bandwidth Limit")
+        bandwidth_limit_btn.clicked.connect(self.set_bandwidth_limit)
+        google_btn_layout.addWidget(bandwidth_limit_btn)
+
+        stats_btn = QPushButton("Stats")
+        stats_btn.clicked.connect(self.show_stats)
+        google_btn_layout.addWidget(stats_btn)
 
         google_btn_widget = QWidget()
         google_btn_widget.setLayout(google_btn_layout)
 
         main_layout.addWidget(google_btn_widget)
+
+        self.scheduler_stats_label = QLabel()
+        main_layout.addWidget(self.scheduler_stats_label)
+        self.scheduler_stats_timer = QTimer(self)
+        self.scheduler_stats_timer.timeout.connect(self.update_scheduler_stats)
+        self.scheduler_stats_timer.start(1000)
         
-        self.file_list = FileListWidget()
+        self.file_list = FileListWidget(self.pipeline.db.list_file_summaries)
+        self.file_list.deleted.connect(self.pipeline.delete_task)
+        self.file_list.prioritized.connect(self.pipeline.upload_scheduler.move_to_top)
+        self.pipeline.progress_aggregator.signals.ui_progress_message.connect(self.file_list.set_progress_message)
+        self.pipeline.signals.created.connect(self.file_list.add_file)
+        self.pipeline.signals.status.connect(self.file_list.set_status)
+        self.pipeline.signals.google_drive_checked.connect(self.handle_google_drive_checked)
         main_layout.addWidget(self.file_list)
         
         main_widget = QWidget()
@@ -85,57 +109,77 @@ class MainWindow(QMainWindow):
         
         self.file_select_dialog = FileSelectDialog()
         self.file_select_dialog.file_selected.connect(self.create_new_upload_task)
+        self.bulk_ingest_dialog = BulkIngestDialog(self.pipeline.create_new_upload_task)
+            
+    def init_file_list(self):
+        # only the first page is read here, the rest is fetched while scrolling
+        self.file_list.file_list_model.fetchMore()
 
-        self.google_drive_folder_config = self.db.get_config('google_drive_folder_config')
-        google_oauth_token = self.db.get_config('google_oauth_token')
-        self.google_oauth_credentials = None
-        if not self.google_drive_folder_config and google_oauth_token:
+    @pyqtSlot()
+    def start(self):
+        probe = get_startup_probe()
+        probe.mark(WINDOW_SHOWN_MARK)
+        self.init_file_list()
+        probe.mark(HISTORY_LOADED_MARK)
+        self.quit_if_probe_done()
+
+    @pyqtSlot(bool)
+    def handle_google_drive_checked(self, is_ready: bool):
+        get_startup_probe().mark(GOOGLE_DRIVE_CHECKED_MARK)
+        if not self.pipeline.google_drive_folder_config and self.pipeline.google_oauth_token:
             self.google_drive_link_btn.setEnabled(True)
             self.google_drive_link_btn.setText("Set Google Drive Link")
-        
-        if not google_oauth_token:
-            self.google_login_btn.setEnabled(True)
-            return
-        
-        self.google_oauth_credentials = Credentials.from_authorized_user_info(google_oauth_token)
-        if self.google_oauth_credentials.valid:
+
+        if is_ready:
             self.google_login_btn.setText("Google Drive Logged In")
-            return
-        
-        if not self.google_oauth_credentials.refresh_token:
+            # a login that was refreshed late no longer asks for a new one
+            self.google_login_btn.setEnabled(False)
+            # tasks cut off by a crash or a quit pick up after their last completed stage
+            self.pipeline.resume_unfinished_tasks()
+        else:
+            self.google_login_btn.setText("Google Drive Login")
             self.google_login_btn.setEnabled(True)
-            return
-        
-        self.google_oauth_credentials.refresh(Request())
-        if self.google_oauth_credentials.valid:
-            self.google_login_btn.setText("Google Drive Logged In")
-            return
-        
-        self.google_login_btn.setEnabled(True)
-            
-    def init_file_list(self):
-        file_list = self.db.list_files()
-        for file_id, name, *_, \
-            status, progress, message in file_list:
-            task_item = FileListWidgetItem(file_id, name, status, progress, message)
-            task_item.signals.deleted.connect(self.db.delete_file)
-            self.file_list.add_item(task_item)
-            if status == "finished":
-                continue
-            
-            if file_id in self.running_task_dict:
-                *_, upload_waiter, _ = self.running_task_dict[file_id]
-                upload_waiter.signals.progress_message.connect(task_item.set_progress_message)
-    
-    def init_running_task_dict(self):
-        self.running_task_dict: Dict[ULID, Tuple[S3UploadWorker, GoogleDriveUploadWorker, UploadWaiterWorker, QThread]] = {}
+        self.quit_if_probe_done()
+
+    def quit_if_probe_done(self):
+        probe = get_startup_probe()
+        if probe.is_done():
+            probe.write()
+            self.close()
     
+    @pyqtSlot()
+    def update_scheduler_stats(self):
+        stats_text_list = []
+        for backend, stats in self.pipeline.upload_scheduler.get_stats().items():
+            stats_text_list.append(
+                f"{BACKEND_LABEL_DICT.get(backend, backend)}: "
+                f"{stats['running']}/{stats['limit']} running, {stats['queued']} queued, "
+                f"wait {stats['average_wait']:.0f}s avg / {stats['oldest_wait']:.0f}s oldest"
+            )
+        stats_text_list.append(f"API: {self.pipeline.api_outbox.pending_count()} pending")
+        self.scheduler_stats_label.setText(" | ".join(stats_text_list))
+
     @pyqtSlot()
     def set_google_link(self):
-        dlg = GoogleDriveLinkMessageBox(self.google_oauth_credentials)
+        dlg = GoogleDriveLinkMessageBox(self.pipeline.google_oauth_credentials)
         dlg.signals.results.connect(self.save_google_drive_folder_info)
         dlg.exec()
 
+    @pyqtSlot()
+    def set_bandwidth_limit(self):
+        dlg = BandwidthLimitDialog(self.pipeline.bandwidth_config)
+        dlg.signals.config.connect(self.save_bandwidth_config)
+        dlg.exec()
+
+    @pyqtSlot()
+    def show_stats(self):
+        dlg = MetricsDialog(self.pipeline.db.list_task_spans, BACKEND_LABEL_DICT)
+        dlg.exec()
+
+    @pyqtSlot(dict)
+    def save_bandwidth_config(self, bandwidth_config: dict):
+        self.pipeline.set_bandwidth_config(bandwidth_config)
+
     @pyqtSlot()
     def google_login(self):
         dlg = GoogleLoginMessageBox()
@@ -144,29 +188,34 @@ class MainWindow(QMainWindow):
 
     @pyqtSlot(dict)
     def save_google_token(self, credentials: dict):
-        self.db.save_config('google_oauth_token', credentials)
-        self.google_oauth_credentials = Credentials.from_authorized_user_info(credentials)
+        self.pipeline.set_google_oauth_token(credentials)
         self.google_login_btn.setText("Google Drive Logged In")
         self.google_login_btn.setEnabled(False)
-        if not self.google_drive_folder_config:
+        if not self.pipeline.google_drive_folder_config:
             self.google_drive_link_btn.setEnabled(True)
             self.google_drive_link_btn.setText("Set Google Drive Link")
     
     @pyqtSlot(tuple)
     def save_google_drive_folder_info(self, results: tuple):
         config_dict, = results
-        self.db.save_config('google_drive_folder_config', config_dict)
-        self.google_drive_folder_config = config_dict
+        self.pipeline.set_google_drive_folder_config(config_dict)
         self.google_drive_link_btn.setText("Google Drive Link Set")
         self.google_drive_link_btn.setEnabled(False)
 
     @pyqtSlot()
     def upload_new_3d_file(self):
-        if not self.google_oauth_credentials or not self.google_oauth_credentials.valid:
+        if not self.pipeline.is_google_drive_ready():
             InvalidOrNotExistGoogleDriveCredentialMessageBox().exec()
             return
         self.file_select_dialog.exec()
 
+    @pyqtSlot()
+    def bulk_upload(self):
+        if not self.pipeline.is_google_drive_ready():
+            InvalidOrNotExistGoogleDriveCredentialMessageBox().exec()
+            return
+        self.bulk_ingest_dialog.exec()
+
     @pyqtSlot(str, str, str, str, str, str, str, list)
     def create_new_upload_task(
         self,
@@ -179,101 +228,40 @@ class MainWindow(QMainWindow):
         render_engine: str,
         image_path_list: List[str]
     ):
-        if not self.google_oauth_credentials or not self.google_oauth_credentials.valid:
+        if not self.pipeline.is_google_drive_ready():
             InvalidOrNotExistGoogleDriveCredentialMessageBox().exec()
             # FIXME: show message box
             return
 
-        file_id = ULID()
-        task_item = FileListWidgetItem(file_id, file_name)
-        task_item.signals.deleted.connect(self.db.delete_file)
-        self.file_list.add_item(task_item)
-        
-        self.db.create_file(
-            file_id, file_name, file_path,
-            [category1, category2, category3],
-            image_path_list,
-            blender_version, render_engine
-        )
-        
-        upload_waiter = UploadWaiterWorker(
-            file_id, file_name,
-            [category1, category2, category3],
-            blender_version, render_engine
-        )
-        upload_waiter_thread = QThread()
-        upload_waiter.moveToThread(upload_waiter_thread)
-        upload_waiter.signals.finished.connect(lambda: self.db.set_file_status(file_id, "running"))
-        upload_waiter.signals.finished.connect(upload_waiter_thread.quit)
-        upload_waiter.signals.finished.connect(upload_waiter_thread.deleteLater)
-        upload_waiter.signals.finished.connect(upload_waiter.deleteLater)
-        
-        s3_upload_worker = S3UploadWorker(
-            file_id, file_path, file_name,
-            [category1, category2, category3],
+        self.pipeline.create_new_upload_task(
+            file_path, file_name,
+            category1, category2, category3,
             blender_version, render_engine,
             image_path_list
         )
-        
-        upload_waiter.signals.progress_message.connect(task_item.set_progress_message)
-        upload_waiter.signals.progress_message.connect(self.db.set_file_progress_message)
-        upload_waiter.signals.finished.connect(lambda: self.running_task_dict.pop(file_id))
-
-        google_drive_upload_worker = GoogleDriveUploadWorker(
-            file_id, file_path, file_name,
-            [category1, category2, category3],
-            blender_version, render_engine,
-            image_path_list,
-            self.google_oauth_credentials,
-            self.google_drive_folder_config
-        )
-        
-        upload_waiter.add_upload_worker("google_drive", google_drive_upload_worker)
-        upload_waiter.add_upload_worker("s3", s3_upload_worker)
-        
-        upload_waiter_thread.start()
-        
-        self.upload_threadpool.start(s3_upload_worker)
-        self.upload_threadpool.start(google_drive_upload_worker)
-        
-        def handle_result(file_id: ULID, result_tuple: Tuple[Dict[str, tuple]]):
-            task_item.set_progress_message(file_id, 99, "Committing to API")
-            result, = result_tuple
-            api_upload_worker = create_api_upload_worker(
-                file_id, file_name,
-                [category1, category2, category3],
-                blender_version, render_engine, result
-            )
-            api_upload_worker.signals.result.connect(lambda: task_item.set_progress_message(file_id, 100, "Finished"))
-            api_upload_worker.signals.result.connect(lambda: self.db.set_file_progress_message(file_id, 100, "Finished"))
-            api_upload_worker.signals.result.connect(lambda: self.db.set_file_status(file_id, "finished"))
-            self.upload_threadpool.start(api_upload_worker)
-
-        upload_waiter.signals.result.connect(handle_result)
-        upload_waiter.signals.result.connect(self.db.set_uploaded_file_attributes)
-        
-        self.running_task_dict[s3_upload_worker.file_id] = (
-            s3_upload_worker, google_drive_upload_worker,
-            upload_waiter, upload_waiter_thread
-        )
 
+    def closeEvent(self, event):
+        self.pipeline.close()
+        super().closeEvent(event)
 
     def __init__(self):
         super().__init__()
         
-        self.init_db()
-        self.init_running_task_dict()
-        self.init_threadpool()
+        self.init_pipeline()
         self.init_ui()
-        self.init_file_list()
         
 def main():
+    get_startup_probe().mark(MAIN_STARTED_MARK)
     app = QApplication(sys.argv)
     app.setWindowIcon(QIcon(os.path.join(basedir, "icon.ico")))
     main_gui = MainWindow()
     main_gui.show()
+    # the history is read once the window is on screen
+    QTimer.singleShot(0, main_gui.start)
     return app.exec()
 
 if __name__ == "__main__":
+    # the image preprocessing pool starts copies of the frozen executable
+    multiprocessing.freeze_support()
     main()
     
\ No newline at end of file
@@ -0,0 +1,408 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import itertools
+import statistics
+import subprocess
+import multiprocessing
+import urllib.request
+from typing import Dict, List, Optional
+
+try:
+    import resource
+except ImportError:
+    # not on Windows, CPU and RSS are reported as null there
+    resource = None
+
+from benchmark.standin import serve_stand_ins, STATS_PATH
+from util.metrics import percentile, summarize_spans
+
+FORMAT_VERSION = 1
+DEFAULT_TASK_COUNT_LIST = [1, 8]
+DEFAULT_FILE_SIZE_LIST = ['4MB', '64MB']
+DEFAULT_IMAGE_COUNT_LIST = [0, 4]
+DEFAULT_IMAGE_SIZE = '256KB'
+DEFAULT_REPEAT = 3
+DEFAULT_TIMEOUT = 600
+DEFAULT_SEED = 1
+WRITE_BLOCK_SIZE = 1024 * 1024
+MIB = 1024 * 1024
+SIZE_UNIT_DICT = {'KB': 1024, 'MB': MIB, 'GB': 1024 * MIB, 'B': 1}
+# metrics summarized as the median of the repeats of a scenario
+SUMMARY_METRIC_LIST = [
+    'wall_time', 'tasks_per_min', 'payload_mib_per_s', 'wire_mib_per_s',
+    'ttfb_p50', 'ttfb_p95', 'latency_p50', 'latency_p95',
+    'cpu_seconds', 'cpu_percent', 'peak_rss_mib'
+]
+BENCH_CATEGORY_LIST = ['bench', 'models', 'set']
+
+
+def parse_size(value: str) -> int:
+    value = value.strip().upper()
+    for unit, factor in SIZE_UNIT_DICT.items():
+        if value.endswith(unit):
+            return int(float(value[:-len(unit)]) * factor)
+    return int(value)
+
+
+def parse_list(value: str, parse=int) -> list:
+    return [parse(x) for x in value.split(',') if x.strip()]
+
+
+def get_peak_rss_mib() -> Optional[float]:
+    if resource is None:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak_rss / (MIB if sys.platform == 'darwin' else 1024)
+
+
+def get_cpu_seconds() -> Optional[float]:
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def get_environment() -> dict:
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'],
+            capture_output=True, text=True, timeout=10,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'commit': commit
+    }
+
+
+def write_random_file(path: str, size: int, rng: random.Random):
+    with open(path, 'wb') as f:
+        remaining = size
+        while remaining > 0:
+            block_size = min(WRITE_BLOCK_SIZE, remaining)
+            f.write(rng.randbytes(block_size))
+            remaining -= block_size
+
+
+def create_input_files(work_dir: str, scenario: dict) -> List[dict]:
+    # seeded content, every run uploads the same bytes and none of it is
+    # deduplicated by the content index
+    rng = random.Random(scenario['seed'])
+    entry_list = []
+    for i in range(scenario['task_count']):
+        name = f'bench-{i:04d}'
+        file_path = os.path.join(work_dir, 'input', f'{name}.zip')
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        write_random_file(file_path, scenario['file_size'], rng)
+        image_path_list = []
+        for j in range(scenario['image_count']):
+            image_path = os.path.join(work_dir, 'input', f'{name}-{j}.png')
+            write_random_file(image_path, scenario['image_size'], rng)
+            image_path_list.append(image_path)
+        entry_list.append({'name': name, 'file_path': file_path, 'image_path_list': image_path_list})
+    return entry_list
+
+
+def set_stand_in_environment(work_dir: str, url_dict: Dict[str, str]):
+    os.environ.update({
+        'AWS_ACCESS_KEY_ID': 'bench',
+        'AWS_SECRET_ACCESS_KEY': 'bench',
+        'AWS_DEFAULT_REGION': 'us-east-1',
+        'AWS_ENDPOINT_URL_S3': url_dict['s3'],
+        # a profile or endpoint of the machine must not leak into the run
+        'AWS_CONFIG_FILE': os.path.join(work_dir, 'aws_config'),
+        'AWS_SHARED_CREDENTIALS_FILE': os.path.join(work_dir, 'aws_credentials'),
+        'AWS_EC2_METADATA_DISABLED': 'true',
+        'AWS_REQUEST_CHECKSUM_CALCULATION': 'when_required',
+        'AWS_RESPONSE_CHECKSUM_VALIDATION': 'when_required',
+        'QT_QPA_PLATFORM': 'offscreen'
+    })
+
+
+def seed_config(url_dict: Dict[str, str], scenario: dict):
+    from db import QtDBObject
+
+    db = QtDBObject()
+    db.save_config('google_oauth_token', {
+        'token': 'bench',
+        'refresh_token': 'bench',
+        'client_id': 'bench',
+        'client_secret': 'bench',
+        'expiry': '2999-01-01T00:00:00Z'
+    })
+    db.save_config('google_drive_folder_config', {'id': 'bench-root'})
+    api_config = {'url': f"{url_dict['api']}/model"}
+    if scenario['api_batch']:
+        api_config['batch_url'] = f"{url_dict['api']}/models"
+    db.save_config('api_config', api_config)
+    for key, value in scenario['config'].items():
+        db.save_config(key, value)
+    db.close()
+
+
+def seed_drive_discovery(drive_url: str):
+    # the bundled discovery document points at googleapis.com, the copy the
+    # workers build their services from points at the stand-in instead
+    from worker import _google_service
+
+    document = _google_service.get_discovery_document('drive', 'v3')
+    if document is None:
+        raise RuntimeError("The Drive v3 discovery document is not bundled with google-api-python-client")
+    with _google_service._discovery_lock:
+        _google_service._discovery_dict[('drive', 'v3')] = {
+            **document,
+            'rootUrl': f'{drive_url}/',
+            'mtlsRootUrl': f'{drive_url}/',
+            'baseUrl': f"{drive_url}/{document['servicePath']}"
+        }
+
+
+def fetch_stats(url: str) -> dict:
+    with urllib.request.urlopen(f'{url}{STATS_PATH}', timeout=10) as resp:
+        return json.loads(resp.read())
+
+
+def run_scenario(scenario: dict) -> dict:
+    work_dir = tempfile.mkdtemp(prefix='qt-uploader-bench-')
+    original_dir = os.getcwd()
+    context = multiprocessing.get_context('spawn')
+    connection, child_connection = context.Pipe()
+    stand_in_process = context.Process(target=serve_stand_ins, args=(child_connection,), daemon=True)
+    stand_in_process.start()
+    try:
+        url_dict = connection.recv()
+        entry_list = create_input_files(work_dir, scenario)
+        set_stand_in_environment(work_dir, url_dict)
+        # db.sqlite3 and the caches of the run live in the scratch folder
+        os.chdir(work_dir)
+
+        from PyQt6.QtCore import QCoreApplication, QEventLoop, QTimer
+
+        app = QCoreApplication.instance() or QCoreApplication(sys.argv[:1])
+        seed_config(url_dict, scenario)
+        seed_drive_discovery(url_dict['google_drive'])
+
+        from util.pipeline import UploadPipeline
+
+        pipeline = UploadPipeline()
+        # the stored token is loaded in the background, tasks are refused
+        # until it is
+        if pipeline.is_google_drive_checking():
+            check_loop = QEventLoop()
+            pipeline.signals.google_drive_checked.connect(check_loop.quit)
+            check_loop.exec()
+        created_at_dict = {}
+        done_at_dict = {}
+        name_dict = {}
+        failed_set = set()
+        loop = QEventLoop()
+
+        def handle_status(file_id, status):
+            if status not in ('finished', 'failed') or file_id in done_at_dict:
+                return
+            done_at_dict[file_id] = time.time()
+            if status == 'failed':
+                failed_set.add(file_id)
+            if len(done_at_dict) == len(entry_list):
+                loop.quit()
+
+        pipeline.signals.status.connect(handle_status)
+
+        cpu_start = get_cpu_seconds()
+        started_at = time.time()
+        for entry in entry_list:
+            created_at = time.time()
+            file_id = pipeline.create_new_upload_task(
+                entry['file_path'], entry['name'],
+                *BENCH_CATEGORY_LIST,
+                '4.2', 'Cycles',
+                entry['image_path_list']
+            )
+            created_at_dict[file_id] = created_at
+            name_dict[file_id] = entry['name']
+
+        timer = QTimer()
+        timer.setSingleShot(True)
+        timer.timeout.connect(loop.quit)
+        timer.start(scenario['timeout'] * 1000)
+        if len(done_at_dict) < len(entry_list):
+            loop.exec()
+        ended_at = max(done_at_dict.values(), default=time.time())
+        cpu_seconds = None if cpu_start is None else get_cpu_seconds() - cpu_start
+        is_timed_out = len(done_at_dict) < len(entry_list)
+
+        stats_dict = {name: fetch_stats(url) for name, url in url_dict.items()}
+        stage_list = summarize_spans(pipeline.db.list_task_spans())
+        pipeline.close()
+        app.processEvents()
+
+        first_byte_dict = {}
+        for stats in (stats_dict['s3'], stats_dict['google_drive']):
+            for name, first_byte_at in stats['first_byte_dict'].items():
+                first_byte_dict[name] = min(first_byte_at, first_byte_dict.get(name, first_byte_at))
+        ttfb_list = [
+            first_byte_dict[name_dict[x]] - created_at_dict[x]
+            for x in created_at_dict if name_dict[x] in first_byte_dict
+        ]
+        latency_list = [
+            done_at_dict[x] - created_at_dict[x]
+            for x in done_at_dict if x not in failed_set
+        ]
+        wall_time = ended_at - started_at
+        finished_count = len(done_at_dict) - len(failed_set)
+        payload_bytes = finished_count * (scenario['file_size'] + scenario['image_count'] * scenario['image_size'])
+        wire_bytes = stats_dict['s3']['received_bytes'] + stats_dict['google_drive']['received_bytes']
+
+        return {
+            **{x: scenario[x] for x in ('task_count', 'file_size', 'image_count', 'image_size', 'api_batch')},
+            'finished_count': finished_count,
+            'failed_count': len(failed_set),
+            'is_timed_out': is_timed_out,
+            'wall_time': wall_time,
+            'tasks_per_min': finished_count / wall_time * 60 if wall_time else None,
+            # the bytes of the models and images, each of them goes to both backends
+            'payload_mib_per_s': payload_bytes / MIB / wall_time if wall_time else None,
+            'wire_mib_per_s': wire_bytes / MIB / wall_time if wall_time else None,
+            'ttfb_p50': percentile(ttfb_list, 50),
+            'ttfb_p95': percentile(ttfb_list, 95),
+            'latency_p50': percentile(latency_list, 50),
+            'latency_p95': percentile(latency_list, 95),
+            'latency_max': max(latency_list, default=None),
+            'cpu_seconds': cpu_seconds,
+            'cpu_percent': cpu_seconds / wall_time * 100 if cpu_seconds is not None and wall_time else None,
+            'peak_rss_mib': get_peak_rss_mib(),
+            'request_count_dict': {name: stats['request_count'] for name, stats in stats_dict.items()},
+            # where the time of a task went, from the pipeline's own spans
+            'stage_list': stage_list
+        }
+    finally:
+        os.chdir(original_dir)
+        connection.send('stop')
+        stand_in_process.join(10)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def run_scenario_process(scenario: dict) -> dict:
+    # a process per run, singletons, pools and the peak RSS start from zero
+    # every time
+    proc = subprocess.run(
+        [sys.executable, '-m', 'benchmark', '--scenario', json.dumps(scenario)],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        stdout=subprocess.PIPE,
+        text=True,
+        timeout=scenario['timeout'] + 120
+    )
+    if proc.returncode != 0 or not proc.stdout.strip():
+        return {**scenario, 'error': f"exit code {proc.returncode}"}
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def summarize(run_list: List[dict]) -> dict:
+    summary = {}
+    for metric in SUMMARY_METRIC_LIST:
+        value_list = [x[metric] for x in run_list if x.get(metric) is not None]
+        summary[metric] = statistics.median(value_list) if value_list else None
+    summary['failed_count'] = sum(x.get('failed_count', 0) for x in run_list)
+    summary['error_count'] = sum(1 for x in run_list if 'error' in x or x.get('is_timed_out'))
+    return summary
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmark',
+        description="Measure upload throughput against local S3, Drive and API stand-ins"
+    )
+    parser.add_argument('--tasks', default=','.join(map(str, DEFAULT_TASK_COUNT_LIST)), help="task counts, comma separated")
+    parser.add_argument('--sizes', default=','.join(DEFAULT_FILE_SIZE_LIST), help="model sizes, comma separated, e.g. 4MB,1GB")
+    parser.add_argument('--images', default=','.join(map(str, DEFAULT_IMAGE_COUNT_LIST)), help="preview images per task, comma separated")
+    parser.add_argument('--image-size', default=DEFAULT_IMAGE_SIZE, help="size of each preview image")
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help="runs of each scenario, the summary is their median")
+    parser.add_argument('--timeout', type=int, default=DEFAULT_TIMEOUT, help="seconds a scenario may take")
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED, help="seed of the generated files")
+    parser.add_argument('--api-batch', action='store_true', help="send API commits to the batch endpoint")
+    parser.add_argument('--config', default='{}', help="JSON object of config keys stored before the run, e.g. {\"s3_upload_config\": {...}}")
+    parser.add_argument('--output', help="write the JSON report here instead of stdout")
+    parser.add_argument('--scenario', help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    if args.scenario:
+        # the workers log to stdout, the result line has to stay alone there
+        result_stream = sys.stdout
+        sys.stdout = sys.stderr
+        result = run_scenario(json.loads(args.scenario))
+        result_stream.write(json.dumps(result) + '\n')
+        result_stream.flush()
+        return 0
+
+    parameter_dict = {
+        'task_count_list': parse_list(args.tasks),
+        'file_size_list': parse_list(args.sizes, parse_size),
+        'image_count_list': parse_list(args.images),
+        'image_size': parse_size(args.image_size),
+        'repeat': args.repeat,
+        'timeout': args.timeout,
+        'seed': args.seed,
+        'api_batch': args.api_batch,
+        'config': json.loads(args.config)
+    }
+    scenario_list = []
+    for task_count, file_size, image_count in itertools.product(
+        parameter_dict['task_count_list'],
+        parameter_dict['file_size_list'],
+        parameter_dict['image_count_list']
+    ):
+        run_list = []
+        for i in range(args.repeat):
+            print(f"tasks={task_count} size={file_size} images={image_count} run {i + 1}/{args.repeat}", file=sys.stderr)
+            run_list.append(run_scenario_process({
+                'task_count': task_count,
+                'file_size': file_size,
+                'image_count': image_count,
+                'image_size': parameter_dict['image_size'],
+                'timeout': args.timeout,
+                'seed': args.seed,
+                'api_batch': args.api_batch,
+                'config': parameter_dict['config']
+            }))
+        scenario_list.append({
+            'task_count': task_count,
+            'file_size': file_size,
+            'image_count': image_count,
+            'summary': summarize(run_list),
+            'run_list': run_list
+        })
+
+    report = json.dumps({
+        'format_version': FORMAT_VERSION,
+        'environment': get_environment(),
+        'parameters': parameter_dict,
+        'scenario_list': scenario_list
+    }, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
+    else:
+        print(report)
+    failed = any(x['summary']['failed_count'] or x['summary']['error_count'] for x in scenario_list)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    sys.exit(main())
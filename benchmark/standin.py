@@ -0,0 +1,459 @@
+import re
+import json
+import base64
+import time
+import uuid
+import email.parser
+import hashlib
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit, parse_qs, unquote
+from xml.sax.saxutils import escape
+
+# every object, file and commit of a benchmark task carries this in its name,
+# it is how the first byte of a task is found
+TASK_NAME_REGEX = re.compile(r'bench-\d+')
+S3_XML_NAMESPACE = 'http://s3.amazonaws.com/doc/2006-03-01/'
+STATS_PATH = '/_bench/stats'
+
+
+class StandInStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.request_count = 0
+        self.received_bytes = 0
+        # task name -> wall clock time the first upload body arrived
+        self.first_byte_dict: Dict[str, float] = {}
+
+    def add_request(self, size: int = 0, name: Optional[str] = None, started_at: Optional[float] = None):
+        match = TASK_NAME_REGEX.search(name or '')
+        with self.lock:
+            self.request_count += 1
+            self.received_bytes += size
+            if match and size:
+                self.first_byte_dict.setdefault(match.group(0), started_at or time.time())
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            return {
+                'request_count': self.request_count,
+                'received_bytes': self.received_bytes,
+                'first_byte_dict': dict(self.first_byte_dict)
+            }
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    # keep-alive and 100-continue, like the real endpoints
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def read_body(self) -> bytes:
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            body = bytearray()
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                if not size:
+                    while self.rfile.readline() not in (b'\r\n', b'\n', b''):
+                        pass
+                    break
+                body += self.rfile.read(size)
+                self.rfile.readline()
+            data = bytes(body)
+        else:
+            data = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if 'aws-chunked' in self.headers.get('Content-Encoding', ''):
+            data = decode_aws_chunked(data)
+        return data
+
+    def send(self, status: int, body: bytes = b'', header_dict: Optional[dict] = None, content_type: str = 'application/json'):
+        self.send_response(status)
+        for key, value in (header_dict or {}).items():
+            self.send_header(key, value)
+        if body or status not in (204, 304):
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body and self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def send_json(self, status: int, value, header_dict: Optional[dict] = None):
+        self.send(status, json.dumps(value).encode(), header_dict)
+
+    def handle_stats(self) -> bool:
+        if self.path != STATS_PATH:
+            return False
+        self.send_json(200, self.server.stats.to_dict())
+        return True
+
+
+def decode_aws_chunked(data: bytes) -> bytes:
+    body = bytearray()
+    offset = 0
+    while True:
+        line_end = data.index(b'\r\n', offset)
+        size = int(data[offset:line_end].split(b';')[0], 16)
+        offset = line_end + 2
+        if not size:
+            return bytes(body)
+        body += data[offset:offset + size]
+        offset += size + 2
+
+
+class S3StandInHandler(_StandInHandler):
+    # the subset of the S3 API boto3 uses for put, head, copy and multipart
+
+    def get_bucket_key(self) -> Tuple[str, str, dict]:
+        url = urlsplit(self.path)
+        bucket, _, key = unquote(url.path).lstrip('/').partition('/')
+        return bucket, key, parse_qs(url.query, keep_blank_values=True)
+
+    def send_xml(self, status: int, tag: str, inner: str, header_dict: Optional[dict] = None):
+        body = f'<?xml version="1.0" encoding="UTF-8"?><{tag} xmlns="{S3_XML_NAMESPACE}">{inner}</{tag}>'
+        self.send(status, body.encode(), header_dict, 'application/xml')
+
+    def send_error_xml(self, status: int, code: str, header_dict: Optional[dict] = None):
+        # S3 errors carry no namespace, botocore does not find their code otherwise
+        body = f'<?xml version="1.0" encoding="UTF-8"?><Error><Code>{code}</Code><Message>{code}</Message></Error>'
+        self.send(status, body.encode(), header_dict, 'application/xml')
+
+    def get_metadata(self) -> dict:
+        return {k.lower(): v for k, v in self.headers.items() if k.lower().startswith('x-amz-meta-')}
+
+    def do_HEAD(self):
+        bucket, key, _ = self.get_bucket_key()
+        self.server.stats.add_request()
+        obj = self.server.object_dict.get((bucket, key))
+        if obj is None:
+            self.send(404, b'', content_type='application/xml')
+            return
+        self.send_response(200)
+        self.send_header('ETag', obj['etag'])
+        self.send_header('Content-Length', str(obj['size']))
+        for name, value in obj.get('metadata', {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+
+    def do_GET(self):
+        if self.handle_stats():
+            return
+        bucket, key, query = self.get_bucket_key()
+        self.server.stats.add_request()
+        if 'uploadId' not in query:
+            self.send_error_xml(501, 'NotImplemented')
+            return
+        upload = self.server.upload_dict.get(query['uploadId'][0])
+        if upload is None:
+            self.send_error_xml(404, 'NoSuchUpload')
+            return
+        part_xml = ''.join(
+            f'<Part><PartNumber>{part_number}</PartNumber><ETag>&quot;{digest.hex()}&quot;</ETag><Size>{size}</Size></Part>'
+            for part_number, (digest, size) in sorted(upload['part_dict'].items())
+        )
+        self.send_xml(
+            200, 'ListPartsResult',
+            f'<Bucket>{escape(bucket)}</Bucket><Key>{escape(key)}</Key>'
+            f'<UploadId>{query["uploadId"][0]}</UploadId><IsTruncated>false</IsTruncated>{part_xml}'
+        )
+
+    def do_PUT(self):
+        started_at = time.time()
+        bucket, key, query = self.get_bucket_key()
+        copy_source = self.headers.get('x-amz-copy-source')
+        body = self.read_body()
+        self.server.stats.add_request(len(body), key, started_at)
+
+        if copy_source:
+            source_bucket, _, source_key = unquote(copy_source).lstrip('/').partition('/')
+            obj = self.server.object_dict.get((source_bucket, source_key))
+            if obj is None:
+                self.send_error_xml(404, 'NoSuchKey')
+                return
+            self.server.object_dict[(bucket, key)] = dict(obj)
+            self.send_xml(200, 'CopyObjectResult', f'<ETag>{escape(obj["etag"])}</ETag>')
+            return
+
+        digest = hashlib.md5(body).digest()
+        content_md5 = self.headers.get('Content-MD5')
+        if content_md5 and content_md5 != base64.b64encode(digest).decode():
+            self.send_error_xml(400, 'BadDigest')
+            return
+
+        if 'uploadId' in query:
+            upload = self.server.upload_dict.get(query['uploadId'][0])
+            if upload is None:
+                self.send_error_xml(404, 'NoSuchUpload')
+                return
+            with self.server.lock:
+                upload['part_dict'][int(query['partNumber'][0])] = (digest, len(body))
+        else:
+            self.server.object_dict[(bucket, key)] = {'etag': f'"{digest.hex()}"', 'size': len(body), 'metadata': self.get_metadata()}
+        self.send(200, b'', {'ETag': f'"{digest.hex()}"'})
+
+    def do_POST(self):
+        bucket, key, query = self.get_bucket_key()
+        self.read_body()
+        self.server.stats.add_request()
+        if 'uploads' in query:
+            upload_id = uuid.uuid4().hex
+            self.server.upload_dict[upload_id] = {'bucket': bucket, 'key': key, 'part_dict': {}, 'metadata': self.get_metadata()}
+            self.send_xml(
+                200, 'InitiateMultipartUploadResult',
+                f'<Bucket>{escape(bucket)}</Bucket><Key>{escape(key)}</Key><UploadId>{upload_id}</UploadId>'
+            )
+            return
+        if 'uploadId' in query:
+            upload = self.server.upload_dict.pop(query['uploadId'][0], None)
+            if upload is None:
+                self.send_error_xml(404, 'NoSuchUpload')
+                return
+            part_list = [upload['part_dict'][x] for x in sorted(upload['part_dict'])]
+            etag = f'"{hashlib.md5(b"".join(x[0] for x in part_list)).hexdigest()}-{len(part_list)}"'
+            self.server.object_dict[(bucket, key)] = {'etag': etag, 'size': sum(x[1] for x in part_list), 'metadata': upload['metadata']}
+            self.send_xml(
+                200, 'CompleteMultipartUploadResult',
+                f'<Bucket>{escape(bucket)}</Bucket><Key>{escape(key)}</Key><ETag>{escape(etag)}</ETag>'
+            )
+            return
+        self.send_error_xml(501, 'NotImplemented')
+
+
+def parse_multipart_related(content_type: str, body: bytes) -> Tuple[dict, bytes]:
+    boundary = re.search(r'boundary="?([^";]+)"?', content_type).group(1).encode()
+    part_list = []
+    for part in body.split(b'--' + boundary)[1:]:
+        if part.startswith(b'--'):
+            break
+        header_end = re.search(rb'\r?\n\r?\n', part)
+        data = part[header_end.end():]
+        # the delimiter owns the line break in front of it
+        if data.endswith(b'\r\n'):
+            data = data[:-2]
+        elif data.endswith(b'\n'):
+            data = data[:-1]
+        part_list.append(data)
+    return json.loads(part_list[0] or b'{}'), part_list[1] if len(part_list) > 1 else b''
+
+
+class DriveStandInHandler(_StandInHandler):
+    # files.list/get/create/copy of Drive v3, with multipart and resumable
+    # media and batches of metadata calls
+
+    def get_path_query(self) -> Tuple[str, dict]:
+        url = urlsplit(self.path)
+        return url.path, {k: v[0] for k, v in parse_qs(url.query).items()}
+
+    def create_file(self, metadata: dict, md5: Optional[str] = None, size: int = 0) -> dict:
+        file_id = uuid.uuid4().hex
+        drive_file = {
+            'id': file_id,
+            'name': metadata.get('name', ''),
+            'parents': metadata.get('parents', []),
+            'mimeType': metadata.get('mimeType', ''),
+            'trashed': False,
+            'size': size
+        }
+        if md5:
+            drive_file['md5Checksum'] = md5
+        with self.server.lock:
+            self.server.file_dict[file_id] = drive_file
+        return drive_file
+
+    def handle_metadata(self, method: str, path: str, query: dict, body: bytes) -> Tuple[int, dict]:
+        # files.list/get and the create of a folder, alone or inside a batch
+        if method == 'POST':
+            return 200, self.create_file(json.loads(body or b'{}'))
+        if path == '/drive/v3/files':
+            name = re.search(r"name='([^']*)'", query.get('q', ''))
+            parent = re.search(r"'([^']*)' in parents", query.get('q', ''))
+            with self.server.lock:
+                file_list = [
+                    x for x in self.server.file_dict.values()
+                    if (not name or x['name'] == name.group(1))
+                    and (not parent or parent.group(1) in x['parents'])
+                    and not x['trashed']
+                ]
+            return 200, {'files': file_list}
+        drive_file = self.server.file_dict.get(path.rpartition('/')[2])
+        if drive_file is None:
+            return 404, {'error': {'code': 404, 'errors': [{'reason': 'notFound'}]}}
+        return 200, drive_file
+
+    def handle_batch(self, body: bytes):
+        # the multipart/mixed body of a batch, each part is a whole request
+        message = email.parser.BytesParser().parsebytes(
+            f"Content-Type: {self.headers.get('Content-Type', '')}\r\n\r\n".encode() + body
+        )
+        boundary = uuid.uuid4().hex
+        response_list = []
+        for part in message.get_payload():
+            request_line, _, rest = part.get_payload().partition('\n')
+            method, target, _ = request_line.split(' ', 2)
+            _, _, part_body = rest.replace('\r\n', '\n').partition('\n\n')
+            url = urlsplit(target)
+            status, value = self.handle_metadata(
+                method, url.path,
+                {k: v[0] for k, v in parse_qs(url.query).items()},
+                part_body.encode()
+            )
+            response_list.append(
+                f"--{boundary}\r\n"
+                "Content-Type: application/http\r\n"
+                f"Content-ID: <response-{part['Content-ID'].strip('<>')}>\r\n\r\n"
+                f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                "Content-Type: application/json\r\n\r\n"
+                f"{json.dumps(value)}\r\n"
+            )
+        response_list.append(f"--{boundary}--\r\n")
+        self.send(200, ''.join(response_list).encode(), content_type=f'multipart/mixed; boundary={boundary}')
+
+    def do_GET(self):
+        if self.handle_stats():
+            return
+        path, query = self.get_path_query()
+        self.server.stats.add_request()
+        self.send_json(*self.handle_metadata('GET', path, query, b''))
+
+    def do_POST(self):
+        started_at = time.time()
+        path, query = self.get_path_query()
+        body = self.read_body()
+
+        if path.endswith('/copy'):
+            self.server.stats.add_request()
+            source = self.server.file_dict.get(path.split('/')[-2])
+            if source is None:
+                self.send_json(404, {'error': {'code': 404, 'errors': [{'reason': 'notFound'}]}})
+                return
+            self.send_json(200, self.create_file({**source, **json.loads(body or b'{}')}, source.get('md5Checksum'), source['size']))
+            return
+
+        if path == '/batch/drive/v3':
+            self.server.stats.add_request()
+            self.handle_batch(body)
+            return
+
+        upload_type = query.get('uploadType')
+        if upload_type == 'resumable':
+            self.server.stats.add_request()
+            upload_id = uuid.uuid4().hex
+            with self.server.lock:
+                self.server.session_dict[upload_id] = {
+                    'metadata': json.loads(body or b'{}'),
+                    'md5': hashlib.md5(),
+                    'received': 0,
+                    'total': int(self.headers.get('X-Upload-Content-Length') or 0)
+                }
+            host = self.headers.get('Host')
+            self.send(200, b'', {'Location': f'http://{host}/upload/drive/v3/files?uploadType=resumable&upload_id={upload_id}'})
+            return
+        if upload_type == 'multipart':
+            metadata, data = parse_multipart_related(self.headers.get('Content-Type', ''), body)
+            self.server.stats.add_request(len(data), metadata.get('name'), started_at)
+            self.send_json(200, self.create_file(metadata, hashlib.md5(data).hexdigest(), len(data)))
+            return
+        # folders are created without media
+        self.server.stats.add_request()
+        self.send_json(*self.handle_metadata('POST', path, query, body))
+
+    def do_PUT(self):
+        started_at = time.time()
+        _, query = self.get_path_query()
+        body = self.read_body()
+        session = self.server.session_dict.get(query.get('upload_id'))
+        if session is None:
+            self.server.stats.add_request()
+            self.send_json(404, {'error': {'code': 404, 'errors': [{'reason': 'notFound'}]}})
+            return
+        self.server.stats.add_request(len(body), session['metadata'].get('name'), started_at)
+
+        content_range = self.headers.get('Content-Range', '')
+        match = re.match(r'bytes (\d+)-(\d+)/(\d+|\*)', content_range)
+        if match:
+            start = int(match.group(1))
+            with self.server.lock:
+                # a chunk sent again after an error only adds what is new
+                if start <= session['received']:
+                    new_data = body[session['received'] - start:]
+                    session['md5'].update(new_data)
+                    session['received'] += len(new_data)
+                if match.group(3) != '*':
+                    session['total'] = int(match.group(3))
+
+        if session['received'] < session['total'] or not session['total']:
+            header_dict = {'Range': f'bytes=0-{session["received"] - 1}'} if session['received'] else {}
+            self.send(308, b'', header_dict)
+            return
+        self.server.session_dict.pop(query.get('upload_id'), None)
+        self.send_json(200, self.create_file(session['metadata'], session['md5'].hexdigest(), session['received']))
+
+
+class APIStandInHandler(_StandInHandler):
+    # the commit endpoint, one model per request or a batch of them
+
+    def do_GET(self):
+        if not self.handle_stats():
+            self.send_json(404, {})
+
+    def commit(self, payload: dict, idempotency_key: Optional[str]) -> str:
+        with self.server.lock:
+            model_id = self.server.commit_dict.get(idempotency_key) if idempotency_key else None
+            if model_id is None:
+                model_id = uuid.uuid4().hex
+                if idempotency_key:
+                    self.server.commit_dict[idempotency_key] = model_id
+        return model_id
+
+    def do_POST(self):
+        started_at = time.time()
+        path = urlsplit(self.path).path
+        body = json.loads(self.read_body() or b'{}')
+        if path == '/models':
+            self.server.stats.add_request()
+            self.send_json(200, {'results': [
+                {'idempotency_key': x.get('idempotency_key'), 'id': self.commit(x, x.get('idempotency_key'))}
+                for x in body.get('models', [])
+            ]})
+            return
+        self.server.stats.add_request(0, body.get('name'), started_at)
+        self.send_json(200, {'id': self.commit(body, self.headers.get('Idempotency-Key'))})
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, handler_class):
+        super().__init__(('127.0.0.1', 0), handler_class)
+        self.lock = threading.Lock()
+        self.stats = StandInStats()
+        self.object_dict: Dict[Tuple[str, str], dict] = {}
+        self.upload_dict: Dict[str, dict] = {}
+        self.file_dict: Dict[str, dict] = {}
+        self.session_dict: Dict[str, dict] = {}
+        self.commit_dict: Dict[str, str] = {}
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.server_port}'
+
+
+def serve_stand_ins(connection):
+    # runs in its own process, the CPU time of the stand-ins is not counted
+    # as the uploader's
+    server_dict = {
+        's3': StandInServer(S3StandInHandler),
+        'google_drive': StandInServer(DriveStandInHandler),
+        'api': StandInServer(APIStandInHandler)
+    }
+    for server in server_dict.values():
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    connection.send({name: server.url for name, server in server_dict.items()})
+    # any message or a closed pipe stops them
+    try:
+        connection.recv()
+    except EOFError:
+        pass
+    for server in server_dict.values():
+        server.shutdown()
@@ -0,0 +1,149 @@
+import os
+import sys
+import json
+import time
+import shlex
+import shutil
+import argparse
+import tempfile
+import statistics
+import subprocess
+from typing import List
+
+from benchmark.__main__ import get_environment
+from util.startup_probe import STARTUP_PROBE_ENV, MARK_LIST
+
+FORMAT_VERSION = 1
+DEFAULT_REPEAT = 5
+DEFAULT_HISTORY_COUNT = 1000
+DEFAULT_TIMEOUT = 120
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app.py')
+
+
+def seed_db(db_dir: str, history_count: int, is_logged_in: bool):
+    from db import QtDBObject
+    from ulid import ULID
+
+    original_dir = os.getcwd()
+    os.chdir(db_dir)
+    try:
+        db = QtDBObject()
+        for i in range(history_count):
+            file_id = ULID()
+            db.create_file(
+                file_id, f'bench-{i:05d}', os.path.join(db_dir, f'bench-{i:05d}.zip'),
+                ['bench', 'models', 'set'], [],
+                '4.2', 'Cycles'
+            )
+            db.writer.execute("UPDATE file SET task_status = 'finished', task_progress = 100 WHERE id = ?", (file_id.bytes,))
+        if is_logged_in:
+            # expired, the app tries a real refresh against Google before
+            # Drive is usable, it fails but takes the network round trips
+            db.save_config('google_oauth_token', {
+                'token': 'bench',
+                'refresh_token': 'bench',
+                'client_id': 'bench',
+                'client_secret': 'bench',
+                'expiry': '2000-01-01T00:00:00Z'
+            })
+            db.save_config('google_drive_folder_config', {'id': 'bench-root'})
+        db.close()
+    finally:
+        os.chdir(original_dir)
+
+
+def run_once(command: List[str], template_dir: str, platform_name: str, timeout: int) -> dict:
+    run_dir = tempfile.mkdtemp(prefix='uploader-startup-')
+    try:
+        for name in os.listdir(template_dir):
+            shutil.copy(os.path.join(template_dir, name), run_dir)
+        probe_path = os.path.join(run_dir, 'startup.json')
+        env = {**os.environ, STARTUP_PROBE_ENV: probe_path}
+        if platform_name:
+            env['QT_QPA_PLATFORM'] = platform_name
+
+        # the clock starts before the process exists, a frozen build pays
+        # for unpacking itself here
+        started_at = time.time()
+        proc = subprocess.run(
+            command, cwd=run_dir, env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+            text=True, timeout=timeout
+        )
+        exited_at = time.time()
+        if not os.path.isfile(probe_path):
+            return {'error': f"exit code {proc.returncode}: {proc.stderr.strip()[-500:]}"}
+        with open(probe_path, encoding='utf-8') as f:
+            mark_dict = json.load(f)
+        return {
+            **{x: mark_dict[x] - started_at for x in MARK_LIST if x in mark_dict},
+            'exit': exited_at - started_at
+        }
+    except subprocess.TimeoutExpired:
+        return {'error': f"no window within {timeout}s"}
+    finally:
+        shutil.rmtree(run_dir, ignore_errors=True)
+
+
+def summarize(run_list: List[dict]) -> dict:
+    summary = {}
+    for metric in [*MARK_LIST, 'exit']:
+        value_list = [x[metric] for x in run_list if x.get(metric) is not None]
+        summary[metric] = statistics.median(value_list) if value_list else None
+    summary['error_count'] = sum(1 for x in run_list if 'error' in x)
+    return summary
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmark.startup',
+        description="Measure the time from launch to the window, the history and the checked Google login"
+    )
+    parser.add_argument('--command', help="the app to start, e.g. dist/app/app.exe for the PyInstaller build, app.py from source by default")
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help="launches, the summary is their median")
+    parser.add_argument('--history', type=int, default=DEFAULT_HISTORY_COUNT, help="finished tasks stored before the launch")
+    parser.add_argument('--login', action='store_true', help="store an expired Google login, the app refreshes it while starting")
+    parser.add_argument('--platform', default='offscreen', help="QT_QPA_PLATFORM of the app, empty for the desktop one")
+    parser.add_argument('--timeout', type=int, default=DEFAULT_TIMEOUT, help="seconds a launch may take")
+    parser.add_argument('--output', help="write the JSON report here instead of stdout")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    command = shlex.split(args.command) if args.command else [sys.executable, APP_PATH]
+
+    template_dir = tempfile.mkdtemp(prefix='uploader-startup-template-')
+    try:
+        seed_db(template_dir, args.history, args.login)
+        run_list = []
+        for i in range(args.repeat):
+            print(f"launch {i + 1}/{args.repeat}", file=sys.stderr)
+            run_list.append(run_once(command, template_dir, args.platform, args.timeout))
+    finally:
+        shutil.rmtree(template_dir, ignore_errors=True)
+
+    report = json.dumps({
+        'format_version': FORMAT_VERSION,
+        'environment': get_environment(),
+        'parameters': {
+            'command': command,
+            'repeat': args.repeat,
+            'history': args.history,
+            'login': args.login,
+            'platform': args.platform
+        },
+        # seconds after the launch, the median of every launch
+        'summary': summarize(run_list),
+        'run_list': run_list
+    }, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(report + '\n')
+    else:
+        print(report)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,16 +1,22 @@
 from sqlite3 import connect
 from contextlib import closing
 import json
-from typing import Any, Generator, Dict, Tuple, List
+from typing import Any, Generator, Dict, Tuple, List, Optional
 import math
 
 from PyQt6.QtCore import pyqtSlot, QObject
 from ulid import ULID
 
+from ._writer import DBWriter
+
+DB_PATH = "db.sqlite3"
+# seconds a read or a status change waits for queued writes
+FLUSH_TIMEOUT = 5.0
+
 class QtDBObject(QObject):
     def __init__(self):
         super().__init__()
-        self.conn = connect("db.sqlite3")
+        self.conn = connect(DB_PATH)
         self.conn.execute("PRAGMA foreign_keys=ON")
         self.conn.execute("PRAGMA journal_mode=WAL")
         self.conn.execute("PRAGMA ignore_check_constraints=OFF")
@@ -41,9 +47,108 @@ class QtDBObject(QObject):
                 value JSON NOT NULL DEFAULT '{}'
             )
         """)
+
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS upload_session (
+                backend TEXT NOT NULL,
+                session_key TEXT NOT NULL,
+                file_id BLOB NOT NULL,
+                file_path TEXT NOT NULL,
+                session JSON NOT NULL DEFAULT '{}',
+                PRIMARY KEY (backend, session_key)
+            )
+        """)
+
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS google_drive_folder (
+                drive_id TEXT NOT NULL DEFAULT '',
+                parent_id TEXT NOT NULL DEFAULT '',
+                name TEXT NOT NULL,
+                folder_id TEXT NOT NULL,
+                PRIMARY KEY (drive_id, parent_id, name)
+            )
+        """)
+
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS remote_object (
+                sha256 TEXT NOT NULL,
+                backend TEXT NOT NULL,
+                remote_id TEXT NOT NULL,
+                PRIMARY KEY (sha256, backend, remote_id)
+            )
+        """)
         
-    def __del__(self):
+        # (file_id, stage) -> result of a completed stage, a restarted task
+        # skips every stage found here
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS task_stage (
+                file_id BLOB NOT NULL,
+                stage TEXT NOT NULL,
+                result JSON NOT NULL DEFAULT '{}',
+                PRIMARY KEY (file_id, stage)
+            )
+        """)
+        
+        # API commits not acknowledged yet, the task ULID is the idempotency key
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS api_outbox (
+                file_id BLOB PRIMARY KEY,
+                payload JSON NOT NULL DEFAULT '{}',
+                attempt_count INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL DEFAULT 0,
+                last_error TEXT NOT NULL DEFAULT ''
+            )
+        """)
+        
+        # retries each backend needed for a task, kept after the task ends
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS task_retry (
+                file_id BLOB NOT NULL,
+                backend TEXT NOT NULL,
+                retry_count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (file_id, backend)
+            )
+        """)
+        
+        # one row per run of a stage, kept after the task is deleted, they
+        # describe the uploader rather than the task
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS task_span (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                file_id BLOB NOT NULL,
+                backend TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                started_at REAL NOT NULL,
+                ended_at REAL NOT NULL,
+                byte_count INTEGER NOT NULL DEFAULT 0,
+                retry_count INTEGER NOT NULL DEFAULT 0,
+                status TEXT NOT NULL
+            )
+        """)
+        self.conn.execute("""
+            CREATE INDEX IF NOT EXISTS task_span_started_at
+            ON task_span (started_at)
+        """)
+        
+        self.writer = DBWriter(DB_PATH)
+        self.writer.start()
+
+    def flush(self, timeout: Optional[float] = FLUSH_TIMEOUT) -> bool:
+        # reads and status changes run on the GUI thread, a stuck writer must
+        # not freeze the window
+        is_flushed = self.writer.flush(timeout)
+        if not is_flushed:
+            print(f"Database writes were not flushed within {timeout}s")
+        return is_flushed
+
+    def close(self):
+        # stopping commits whatever is still queued
+        if self.writer.is_alive():
+            self.writer.stop()
         self.conn.close()
+
+    def __del__(self):
+        self.close()
     
     def list_files(self) -> Generator[tuple[
             ULID, str, str,
@@ -53,6 +158,7 @@ class QtDBObject(QObject):
             str, List[str],
             str, str, str
         ], None, None]:
+        self.flush()
         with closing(self.conn.cursor()) as cur:
             cur.execute("""
                 SELECT
@@ -79,27 +185,99 @@ class QtDBObject(QObject):
                     status, progress, message
                 )
     
-    @pyqtSlot(ULID)
-    def delete_file(self, file_id: ULID):
+    def list_file_summaries(
+            self,
+            before_file_id: Optional[ULID],
+            limit: int
+        ) -> List[Tuple[ULID, str, str, int, str]]:
+        # keyset pagination on the time ordered ULID, newest first
+        with closing(self.conn.cursor()) as cur:
+            if before_file_id is None:
+                cur.execute("""
+                    SELECT id, name, task_status, task_progress, task_message
+                    FROM file
+                    ORDER BY id DESC
+                    LIMIT ?
+                """, (limit,))
+            else:
+                cur.execute("""
+                    SELECT id, name, task_status, task_progress, task_message
+                    FROM file
+                    WHERE id < ?
+                    ORDER BY id DESC
+                    LIMIT ?
+                """, (before_file_id.bytes, limit))
+            return [
+                (ULID(value=file_id), name, status, progress, message)
+                for file_id, name, status, progress, message in cur.fetchall()
+            ]
+
+    def list_file_paths(self, exclude_status_list: List[str] = []) -> List[str]:
+        self.flush()
+        with closing(self.conn.cursor()) as cur:
+            cur.execute(f"""
+                SELECT DISTINCT path FROM file
+                WHERE task_status NOT IN ({', '.join('?' * len(exclude_status_list))})
+            """, exclude_status_list)
+            return [path for path, in cur.fetchall()]
+
+    def list_unfinished_files(self) -> List[Tuple[
+            ULID, str, str,
+            List[str], List[str],
+            str, str
+        ]]:
+        self.flush()
         with closing(self.conn.cursor()) as cur:
             cur.execute("""
-                DELETE FROM file
-                WHERE id = ?
-            """, (file_id.bytes,))
-            self.conn.commit()
+                SELECT
+                    id, name, path,
+                    category_list, image_path_list,
+                    blender_version, render_engine
+                FROM file
+                WHERE task_status IN ('pending', 'running')
+                ORDER BY id
+            """)
+            return [
+                (
+                    ULID(value=file_id), name, path,
+                    json.loads(category_list), json.loads(image_path_list),
+                    blender_version, render_engine
+                )
+                for file_id, name, path, \
+                    category_list, image_path_list, \
+                    blender_version, render_engine in cur.fetchall()
+            ]
+
+    @pyqtSlot(ULID)
+    def delete_file(self, file_id: ULID):
+        self.writer.execute("""
+            DELETE FROM file
+            WHERE id = ?
+        """, (file_id.bytes,))
+        self.writer.execute("""
+            DELETE FROM task_stage
+            WHERE file_id = ?
+        """, (file_id.bytes,))
+        self.writer.execute("""
+            DELETE FROM api_outbox
+            WHERE file_id = ?
+        """, (file_id.bytes,))
+        self.writer.execute("""
+            DELETE FROM task_retry
+            WHERE file_id = ?
+        """, (file_id.bytes,))
     
     @pyqtSlot(str, dict)
     def save_config(self, key: str, value: dict):
-        with closing(self.conn.cursor()) as cur:
-            cur.execute("""
-                INSERT INTO config
-                (key, value)
-                VALUES (?, ?)
-                ON CONFLICT(key) DO UPDATE SET value = ?
-            """, (key, json.dumps(value), json.dumps(value)))
-            self.conn.commit()
+        self.writer.execute("""
+            INSERT INTO config
+            (key, value)
+            VALUES (?, ?)
+            ON CONFLICT(key) DO UPDATE SET value = ?
+        """, (key, json.dumps(value), json.dumps(value)), ('config', key))
     
     def get_config(self, key: str) -> Any:
+        self.flush()
         with closing(self.conn.cursor()) as cur:
             cur.execute("""
                 SELECT value FROM config
@@ -122,53 +300,49 @@ class QtDBObject(QObject):
         blender_version: str,
         render_engine: str,
     ):
-        with closing(self.conn.cursor()) as cur:
-            cur.execute(
-                """
-                INSERT INTO file
-                (
-                    id, name, path,
-                    blender_version, render_engine,
-                    category_list, image_path_list,
-                    task_status, task_progress, task_message
-                )
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """,
-                (
-                    file_id.bytes,
-                    file_name,
-                    file_path,
-                    blender_version,
-                    render_engine,
-                    json.dumps(category_list),
-                    json.dumps(image_path_list),
-                    "pending",
-                    0,
-                    "Pending"
-                )
+        self.writer.execute(
+            """
+            INSERT INTO file
+            (
+                id, name, path,
+                blender_version, render_engine,
+                category_list, image_path_list,
+                task_status, task_progress, task_message
+            )
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                file_id.bytes,
+                file_name,
+                file_path,
+                blender_version,
+                render_engine,
+                json.dumps(category_list),
+                json.dumps(image_path_list),
+                "pending",
+                0,
+                "Pending"
             )
-            self.conn.commit()
+        )
     
     @pyqtSlot(ULID, float, str)
     def set_file_progress_message(self, file_id: ULID, progress: float, message: str):
-        print(f"Setting progress message for {file_id} to {progress}: {message}")
-        with closing(self.conn.cursor()) as cur:
-            cur.execute("""
-                UPDATE file
-                SET task_progress = ?, task_message = ?
-                WHERE id = ?
-            """, (math.ceil(progress), message, file_id.bytes))
-            self.conn.commit()
+        # repeated updates of one row within a tick collapse into the last one
+        self.writer.execute("""
+            UPDATE file
+            SET task_progress = ?, task_message = ?
+            WHERE id = ?
+        """, (math.ceil(progress), message, file_id.bytes), ('progress', file_id.bytes))
     
     @pyqtSlot(ULID, str)
     def set_file_status(self, file_id: ULID, status: str):
-        with closing(self.conn.cursor()) as cur:
-            cur.execute("""
-                UPDATE file
-                SET task_status = ?
-                WHERE id = ?
-            """,(status, file_id.bytes,))
-            self.conn.commit()
+        self.writer.execute("""
+            UPDATE file
+            SET task_status = ?
+            WHERE id = ?
+        """,(status, file_id.bytes,))
+        # status transitions have to survive a crash right after them
+        self.flush()
     
     @pyqtSlot(ULID, tuple)
     def set_uploaded_file_attributes(
@@ -176,19 +350,219 @@ class QtDBObject(QObject):
             file_id: ULID,
             result_tuple: Tuple[Dict[str, tuple]]
         ):
+        result, = result_tuple
+        google_drive_model_path, google_drive_image_path_list = result['google_drive']
+        s3_model_key, s3_image_key_list = result['s3']
+        self.writer.execute("""
+            UPDATE file SET 
+                s3_model_key = ?, s3_image_key_list = ?,
+                google_drive_model_id = ?, google_drive_image_id_list = ?
+            WHERE id = ?
+        """, (
+            s3_model_key, json.dumps(s3_image_key_list),
+            google_drive_model_path, json.dumps(google_drive_image_path_list),
+            file_id.bytes
+        ))
+
+    def get_upload_sessions(self, backend: str, file_path: str) -> Dict[str, dict]:
+        self.flush()
         with closing(self.conn.cursor()) as cur:
-            result, = result_tuple
-            google_drive_model_path, google_drive_image_path_list = result['google_drive']
-            s3_model_key, s3_image_key_list = result['s3']
             cur.execute("""
-                UPDATE file SET 
-                    s3_model_key = ?, s3_image_key_list = ?,
-                    google_drive_model_id = ?, google_drive_image_id_list = ?
-                WHERE id = ?
+                SELECT session_key, session FROM upload_session
+                WHERE backend = ? AND file_path = ?
+            """, (backend, file_path))
+            return {
+                session_key: json.loads(session)
+                for session_key, session in cur.fetchall()
+            }
+
+    @pyqtSlot(ULID, str, str, dict)
+    def save_upload_session(self, file_id: ULID, backend: str, session_key: str, session: dict):
+        merge_key = ('upload_session', backend, session_key)
+        if not session:
+            self.writer.execute("""
+                DELETE FROM upload_session
+                WHERE backend = ? AND session_key = ?
+            """, (backend, session_key), merge_key)
+        else:
+            self.writer.execute("""
+                INSERT INTO upload_session
+                (backend, session_key, file_id, file_path, session)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(backend, session_key) DO UPDATE SET
+                    file_id = excluded.file_id,
+                    file_path = excluded.file_path,
+                    session = excluded.session
             """, (
-                s3_model_key, json.dumps(s3_image_key_list),
-                google_drive_model_path, json.dumps(google_drive_image_path_list),
-                file_id.bytes
-            ))
-            
-            self.conn.commit()
\ No newline at end of file
+                backend, session_key, file_id.bytes,
+                session['file_path'], json.dumps(session)
+            ), merge_key)
+
+    def list_google_drive_folders(self) -> Dict[Tuple[str, str, str], str]:
+        self.flush()
+        with closing(self.conn.cursor()) as cur:
+            cur.execute("""
+                SELECT drive_id, parent_id, name, folder_id
+                FROM google_drive_folder
+            """)
+            return {
+                (drive_id, parent_id, name): folder_id
+                for drive_id, parent_id, name, folder_id in cur.fetchall()
+            }
+
+    @pyqtSlot(str, str, str, str)
+    def save_google_drive_folder(self, drive_id: str, parent_id: str, name: str, folder_id: str):
+        self.writer.execute("""
+            INSERT INTO google_drive_folder
+            (drive_id, parent_id, name, folder_id)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(drive_id, parent_id, name) DO UPDATE SET folder_id = excluded.folder_id
+        """, (drive_id, parent_id, name, folder_id))
+
+    @pyqtSlot(str, str, str)
+    def delete_google_drive_folder(self, drive_id: str, parent_id: str, name: str):
+        self.writer.execute("""
+            DELETE FROM google_drive_folder
+            WHERE drive_id = ? AND parent_id = ? AND name = ?
+        """, (drive_id, parent_id, name))
+
+    def list_remote_objects(self) -> List[Tuple[str, str, str]]:
+        self.flush()
+        with closing(self.conn.cursor()) as cur:
+            cur.execute("""
+                SELECT sha256, backend, remote_id
+                FROM remote_object
+            """)
+            return cur.fetchall()
+
+    @pyqtSlot(str, str, str)
+    def save_remote_object(self, sha256: str, backend: str, remote_id: str):
+        self.writer.execute("""
+            INSERT OR IGNORE INTO remote_object
+            (sha256, backend, remote_id)
+            VALUES (?, ?, ?)
+        """, (sha256, backend, remote_id))
+
+    @pyqtSlot(str, str, str)
+    def delete_remote_object(self, sha256: str, backend: str, remote_id: str):
+        self.writer.execute("""
+            DELETE FROM remote_object
+            WHERE sha256 = ? AND backend = ? AND remote_id = ?
+        """, (sha256, backend, remote_id))
+
+    def list_task_stages(self, file_id: ULID) -> Dict[str, dict]:
+        self.flush()
+        with closing(self.conn.cursor()) as cur:
+            cur.execute("""
+                SELECT stage, result FROM task_stage
+                WHERE file_id = ?
+            """, (file_id.bytes,))
+            return {
+                stage: json.loads(result)
+                for stage, result in cur.fetchall()
+            }
+
+    @pyqtSlot(ULID, str, dict)
+    def save_task_stage(self, file_id: ULID, stage: str, result: dict):
+        self.writer.execute("""
+            INSERT INTO task_stage
+            (file_id, stage, result)
+            VALUES (?, ?, ?)
+            ON CONFLICT(file_id, stage) DO UPDATE SET result = excluded.result
+        """, (file_id.bytes, stage, json.dumps(result)))
+
+
+    def list_api_outbox(self) -> List[Tuple[ULID, dict, int, float]]:
+        self.flush()
+        with closing(self.conn.cursor()) as cur:
+            cur.execute("""
+                SELECT file_id, payload, attempt_count, next_attempt_at
+                FROM api_outbox
+                ORDER BY file_id
+            """)
+            return [
+                (ULID(value=file_id), json.loads(payload), attempt_count, next_attempt_at)
+                for file_id, payload, attempt_count, next_attempt_at in cur.fetchall()
+            ]
+
+    @pyqtSlot(ULID, dict)
+    def save_api_outbox(self, file_id: ULID, payload: dict):
+        self.writer.execute("""
+            INSERT INTO api_outbox
+            (file_id, payload)
+            VALUES (?, ?)
+            ON CONFLICT(file_id) DO UPDATE SET
+                payload = excluded.payload,
+                attempt_count = 0,
+                next_attempt_at = 0,
+                last_error = ''
+        """, (file_id.bytes, json.dumps(payload)), ('api_outbox', file_id.bytes))
+        # the commit has to outlive a crash before it is sent
+        self.flush()
+
+    @pyqtSlot(ULID, int, float, str)
+    def set_api_outbox_attempt(self, file_id: ULID, attempt_count: int, next_attempt_at: float, last_error: str):
+        self.writer.execute("""
+            UPDATE api_outbox
+            SET attempt_count = ?, next_attempt_at = ?, last_error = ?
+            WHERE file_id = ?
+        """, (attempt_count, next_attempt_at, last_error, file_id.bytes))
+
+    @pyqtSlot(ULID)
+    def delete_api_outbox(self, file_id: ULID):
+        self.writer.execute("""
+            DELETE FROM api_outbox
+            WHERE file_id = ?
+        """, (file_id.bytes,), ('api_outbox', file_id.bytes))
+
+    @pyqtSlot(ULID, str)
+    def add_task_retry(self, file_id: ULID, backend: str):
+        # one row per backend, counted over every run of the task
+        self.writer.execute("""
+            INSERT INTO task_retry
+            (file_id, backend, retry_count)
+            VALUES (?, ?, 1)
+            ON CONFLICT(file_id, backend) DO UPDATE SET
+                retry_count = retry_count + 1
+        """, (file_id.bytes, backend))
+
+    @pyqtSlot(ULID, str, str, float, float, int, int, str)
+    def save_task_span(
+        self,
+        file_id: ULID,
+        backend: str,
+        stage: str,
+        started_at: float,
+        ended_at: float,
+        byte_count: int,
+        retry_count: int,
+        status: str
+    ):
+        self.writer.execute("""
+            INSERT INTO task_span
+            (file_id, backend, stage, started_at, ended_at, byte_count, retry_count, status)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, (file_id.bytes, backend, stage, started_at, ended_at, byte_count, retry_count, status))
+
+    def list_task_spans(self, since: Optional[float] = None) -> List[Tuple[ULID, str, str, float, float, int, int, str]]:
+        self.flush()
+        with closing(self.conn.cursor()) as cur:
+            cur.execute("""
+                SELECT
+                    file_id, backend, stage,
+                    started_at, ended_at,
+                    byte_count, retry_count, status
+                FROM task_span
+                WHERE started_at >= ?
+                ORDER BY started_at
+            """, (since or 0,))
+            return [
+                (ULID(value=file_id), *span)
+                for file_id, *span in cur.fetchall()
+            ]
+
+    def delete_task_spans(self, before: float):
+        self.writer.execute("""
+            DELETE FROM task_span
+            WHERE started_at < ?
+        """, (before,))
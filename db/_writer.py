@@ -0,0 +1,115 @@
+import time
+import queue
+import threading
+import traceback
+from sqlite3 import connect
+from typing import Hashable, List, Optional, Sequence, Tuple
+
+TICK_INTERVAL = 0.05
+
+# (sql, params, merge_key)
+_Mutation = Tuple[str, Sequence, Optional[Hashable]]
+
+
+class DBWriter(threading.Thread):
+    def __init__(self, db_path: str, tick_interval: float = TICK_INTERVAL):
+        super().__init__(name='db-writer', daemon=True)
+        self.db_path = db_path
+        self.tick_interval = tick_interval
+        self.queue: "queue.Queue" = queue.Queue()
+        self.commit_count = 0
+
+    def execute(self, sql: str, params: Sequence = (), merge_key: Optional[Hashable] = None):
+        self.queue.put((sql, params, merge_key))
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        # nothing would ever set the event of a writer that is gone
+        if not self.is_alive():
+            return False
+        event = threading.Event()
+        self.queue.put(event)
+        return event.wait(timeout)
+
+    def stop(self):
+        if not self.is_alive():
+            return
+        self.queue.put(None)
+        self.join()
+
+    def collect_batch(self) -> Tuple[List[_Mutation], List[threading.Event], bool]:
+        mutation_list = []
+        event_list = []
+        is_stopping = False
+
+        item = self.queue.get()
+        deadline = time.monotonic() + self.tick_interval
+        while True:
+            if item is None:
+                is_stopping = True
+            elif isinstance(item, threading.Event):
+                event_list.append(item)
+            else:
+                mutation_list.append(item)
+
+            # a waiting flush or a stop ends the tick early
+            if is_stopping or event_list:
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                continue
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self.queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+        return mutation_list, event_list, is_stopping
+
+    def merge(self, mutation_list: List[_Mutation]) -> List[_Mutation]:
+        # only the last of several mutations with the same merge key is kept,
+        # at the position of that last one
+        last_index_dict = {}
+        for i, (_, _, merge_key) in enumerate(mutation_list):
+            if merge_key is not None:
+                last_index_dict[merge_key] = i
+        return [
+            mutation
+            for i, mutation in enumerate(mutation_list)
+            if mutation[2] is None or last_index_dict[mutation[2]] == i
+        ]
+
+    def run(self):
+        conn = connect(self.db_path)
+        conn.execute("PRAGMA foreign_keys=ON")
+        conn.execute("PRAGMA synchronous=OFF")
+        try:
+            while True:
+                mutation_list, event_list, is_stopping = self.collect_batch()
+                try:
+                    if mutation_list:
+                        with conn:
+                            for sql, params, _ in self.merge(mutation_list):
+                                # one bad statement must not drop the rest of the tick
+                                try:
+                                    conn.execute(sql, params)
+                                except Exception:
+                                    traceback.print_exc()
+                        self.commit_count += 1
+                except Exception:
+                    # a failed commit (disk full, I/O error) loses this tick,
+                    # the writer keeps going for the next one
+                    traceback.print_exc()
+                    try:
+                        conn.rollback()
+                    except Exception:
+                        traceback.print_exc()
+                finally:
+                    for event in event_list:
+                        event.set()
+                if is_stopping:
+                    return
+        finally:
+            conn.close()
@@ -0,0 +1,272 @@
+import os
+import sys
+import json
+import time
+import signal
+import csv
+import argparse
+import multiprocessing
+from typing import Dict, Iterator, Optional, Set, TextIO, Tuple
+
+from PyQt6.QtCore import QCoreApplication, QObject, QTimer, pyqtSlot
+from ulid import ULID
+
+from util.catalog import BLENDER_VERSION_LIST, RENDER_ENGINE_LIST
+from util.manifest import iter_manifest_entries, read_manifest, normalize_entry, validate_entry
+from util.pipeline import UploadPipeline
+
+# entries handled per event loop turn, progress keeps flowing during a large
+# manifest
+INGEST_BATCH_SIZE = 10
+DEFAULT_WATCH_INTERVAL = 10
+DEFAULT_METRICS_INTERVAL = 60
+# lets the interpreter run the Ctrl+C handler while Qt holds the loop
+SIGNAL_CHECK_INTERVAL_MS = 500
+
+
+class HeadlessRunner(QObject):
+    def __init__(
+            self,
+            pipeline: UploadPipeline,
+            event_stream: TextIO,
+            default_dict: Dict[str, str],
+            manifest_path: Optional[str] = None,
+            watch_path: Optional[str] = None,
+            watch_interval: int = DEFAULT_WATCH_INTERVAL,
+            parent: Optional[QObject] = None
+        ):
+        super().__init__(parent)
+        self.pipeline = pipeline
+        self.event_stream = event_stream
+        self.default_dict = default_dict
+        self.manifest_path = manifest_path
+        self.watch_path = watch_path
+
+        self.active_file_id_set: Set[ULID] = set()
+        self.failed_count = 0
+        self.entry_iterator: Optional[Iterator] = None
+
+        # model path -> signature of the model and its images at the last scan
+        self.watch_signature_dict: Dict[str, Tuple] = {}
+        self.watch_reported_dict: Dict[str, Tuple] = {}
+        self.watch_queued_set: Set[str] = set()
+
+        self.pipeline.signals.created.connect(self.handle_created)
+        self.pipeline.signals.resumed.connect(self.handle_resumed)
+        self.pipeline.signals.status.connect(self.handle_status)
+        self.pipeline.signals.retried.connect(self.handle_retried)
+        self.pipeline.signals.google_drive_checked.connect(self.handle_google_drive_checked)
+        self.pipeline.progress_aggregator.signals.db_progress_message.connect(self.handle_progress_message)
+
+        self.ingest_timer = QTimer(self)
+        self.ingest_timer.setInterval(0)
+        self.ingest_timer.timeout.connect(self.ingest_batch)
+        self.watch_timer = QTimer(self)
+        self.watch_timer.setInterval(watch_interval * 1000)
+        self.watch_timer.timeout.connect(self.scan_watch_path)
+
+    def emit_event(self, event: str, **kwargs):
+        self.event_stream.write(json.dumps({'event': event, 'time': time.time(), **kwargs}) + '\n')
+        self.event_stream.flush()
+
+    @pyqtSlot(bool)
+    def handle_google_drive_checked(self, is_ready: bool):
+        # the stored token is refreshed in the background, nothing is queued
+        # before it is known to work
+        if not is_ready and self.pipeline.is_google_drive_refreshing():
+            print("The Google Drive login could not be refreshed yet, waiting for it")
+            return
+        if not is_ready:
+            print("No valid Google Drive login is stored, log in once with the desktop app")
+            QCoreApplication.exit(2)
+            return
+        self.start()
+
+    def start(self):
+        self.pipeline.resume_unfinished_tasks()
+        if self.manifest_path:
+            self.entry_iterator = iter_manifest_entries(self.manifest_path, self.default_dict)
+            self.ingest_timer.start()
+        if self.watch_path:
+            # models queued by an earlier run are not uploaded again
+            self.watch_queued_set.update(self.pipeline.db.list_file_paths(['failed']))
+            self.emit_event('watching', path=self.watch_path)
+            self.scan_watch_path()
+            self.watch_timer.start()
+
+    def queue_entry(self, entry: dict) -> Optional[ULID]:
+        return self.pipeline.create_new_upload_task(
+            entry['file_path'],
+            entry['file_name'],
+            entry['category1'],
+            entry['category2'],
+            entry['category3'],
+            entry['blender_version'],
+            entry['render_engine'],
+            entry['image_path_list']
+        )
+
+    @pyqtSlot()
+    def ingest_batch(self):
+        try:
+            for _ in range(INGEST_BATCH_SIZE):
+                location, entry, error_list = next(self.entry_iterator)
+                if entry is None:
+                    self.emit_event('invalid', location=location, errors=error_list)
+                    continue
+                self.queue_entry(entry)
+        except StopIteration:
+            self.ingest_timer.stop()
+            self.entry_iterator = None
+            self.emit_event('manifest_done', path=self.manifest_path)
+            self.quit_if_done()
+        except (OSError, ValueError, csv.Error) as error:
+            self.ingest_timer.stop()
+            self.entry_iterator = None
+            self.emit_event('manifest_error', path=self.manifest_path, error=str(error))
+            self.quit_if_done()
+
+    def get_signature(self, entry: dict) -> Optional[Tuple]:
+        signature = []
+        for path in [entry['file_path'], *entry['image_path_list']]:
+            try:
+                file_stat = os.stat(path)
+            except OSError:
+                return None
+            signature.append((path, file_stat.st_size, file_stat.st_mtime_ns))
+        return tuple(signature)
+
+    @pyqtSlot()
+    def scan_watch_path(self):
+        signature_dict = {}
+        try:
+            row_list = list(read_manifest(self.watch_path))
+        except (OSError, ValueError, csv.Error) as error:
+            self.emit_event('watch_error', path=self.watch_path, error=str(error))
+            return
+
+        for location, row in row_list:
+            entry = normalize_entry(row, self.watch_path, self.default_dict)
+            file_path = entry['file_path']
+            if file_path in self.watch_queued_set:
+                continue
+            signature = self.get_signature(entry)
+            if signature is None:
+                continue
+            signature_dict[file_path] = signature
+            # a model is taken once it and its images stopped changing for a
+            # whole interval, render nodes may still be writing them
+            if self.watch_signature_dict.get(file_path) != signature:
+                continue
+            error_list = validate_entry(entry)
+            if error_list:
+                if self.watch_reported_dict.get(file_path) != signature:
+                    self.watch_reported_dict[file_path] = signature
+                    self.emit_event('invalid', location=location, errors=error_list)
+                continue
+            if self.queue_entry(entry):
+                self.watch_queued_set.add(file_path)
+                self.watch_reported_dict.pop(file_path, None)
+        self.watch_signature_dict = signature_dict
+
+    @pyqtSlot(ULID, str)
+    def handle_created(self, file_id: ULID, name: str):
+        self.active_file_id_set.add(file_id)
+        self.emit_event('created', file_id=str(file_id), name=name)
+
+    @pyqtSlot(ULID, str)
+    def handle_resumed(self, file_id: ULID, name: str):
+        self.active_file_id_set.add(file_id)
+        self.emit_event('resumed', file_id=str(file_id), name=name)
+
+    @pyqtSlot(ULID, str)
+    def handle_status(self, file_id: ULID, status: str):
+        self.emit_event('status', file_id=str(file_id), status=status)
+        # a task fails once per failed backend, it is only counted once
+        if status not in ('finished', 'failed') or file_id not in self.active_file_id_set:
+            return
+        if status == 'failed':
+            self.failed_count += 1
+        self.active_file_id_set.discard(file_id)
+        self.quit_if_done()
+
+    @pyqtSlot(ULID, str, int, str)
+    def handle_retried(self, file_id: ULID, backend: str, retry_count: int, message: str):
+        self.emit_event('retry', file_id=str(file_id), backend=backend, retry_count=retry_count, message=message)
+
+    @pyqtSlot(ULID, float, str)
+    def handle_progress_message(self, file_id: ULID, progress: float, message: str):
+        self.emit_event('progress', file_id=str(file_id), progress=progress, message=message)
+
+    def quit_if_done(self):
+        if self.watch_path or self.entry_iterator or self.active_file_id_set:
+            return
+        self.emit_event('done', failed=self.failed_count)
+        QCoreApplication.exit(1 if self.failed_count else 0)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Upload models to R2 and Google Drive without a desktop session")
+    parser.add_argument('--manifest', help="a folder of models or a CSV/JSONL manifest, the process exits once it is uploaded")
+    parser.add_argument('--watch', help="a hot folder to poll for new models, the process keeps running")
+    parser.add_argument('--watch-interval', type=int, default=DEFAULT_WATCH_INTERVAL, help="seconds between scans of the hot folder")
+    parser.add_argument('--metrics', help="write stage metrics here, JSON for a .json path and Prometheus text otherwise")
+    parser.add_argument('--metrics-interval', type=int, default=DEFAULT_METRICS_INTERVAL, help="seconds between metrics writes")
+    parser.add_argument('--blender-version', choices=BLENDER_VERSION_LIST, default=BLENDER_VERSION_LIST[-1], help="used for rows without one")
+    parser.add_argument('--render-engine', choices=RENDER_ENGINE_LIST, default=RENDER_ENGINE_LIST[0], help="used for rows without one")
+    args = parser.parse_args(argv)
+    if not args.manifest and not args.watch:
+        parser.error("one of --manifest or --watch is required")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    app = QCoreApplication(sys.argv)
+
+    # events go to stdout as JSON lines, the workers' logs go to stderr
+    event_stream = sys.stdout
+    sys.stdout = sys.stderr
+
+    pipeline = UploadPipeline()
+    if not pipeline.google_drive_folder_config:
+        print("No Google Drive folder is set, set it once with the desktop app")
+        pipeline.close()
+        return 2
+
+    # owned by the app, it lives as long as the event loop
+    HeadlessRunner(
+        pipeline, event_stream,
+        {'blender_version': args.blender_version, 'render_engine': args.render_engine},
+        manifest_path=args.manifest,
+        watch_path=args.watch,
+        watch_interval=args.watch_interval,
+        parent=app
+    )
+
+    signal.signal(signal.SIGINT, lambda *_: app.exit(130))
+    signal.signal(signal.SIGTERM, lambda *_: app.exit(143))
+    signal_check_timer = QTimer()
+    signal_check_timer.timeout.connect(lambda: None)
+    signal_check_timer.start(SIGNAL_CHECK_INTERVAL_MS)
+
+    metrics_timer = QTimer()
+    if args.metrics:
+        # a textfile collector picks the file up between writes
+        metrics_timer.timeout.connect(lambda: pipeline.export_metrics(args.metrics))
+        metrics_timer.start(args.metrics_interval * 1000)
+
+    exit_code = app.exec()
+    # a second signal while closing stops the process at once
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    metrics_timer.stop()
+    if args.metrics:
+        pipeline.export_metrics(args.metrics)
+    pipeline.close()
+    return exit_code
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -0,0 +1,72 @@
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark.standin import (
+    StandInServer, S3StandInHandler, DriveStandInHandler, APIStandInHandler
+)
+
+
+def start_stand_in(handler_class) -> StandInServer:
+    server = StandInServer(handler_class)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+@pytest.fixture(scope='session')
+def qt_app():
+    from PyQt6.QtCore import QCoreApplication
+    return QCoreApplication.instance() or QCoreApplication(sys.argv[:1])
+
+
+@pytest.fixture
+def s3_stand_in(monkeypatch, tmp_path):
+    server = start_stand_in(S3StandInHandler)
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'test')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'test')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    monkeypatch.setenv('AWS_ENDPOINT_URL_S3', server.url)
+    monkeypatch.setenv('AWS_CONFIG_FILE', str(tmp_path / 'aws_config'))
+    monkeypatch.setenv('AWS_SHARED_CREDENTIALS_FILE', str(tmp_path / 'aws_credentials'))
+    monkeypatch.setenv('AWS_EC2_METADATA_DISABLED', 'true')
+    monkeypatch.setenv('AWS_REQUEST_CHECKSUM_CALCULATION', 'when_required')
+    monkeypatch.setenv('AWS_RESPONSE_CHECKSUM_VALIDATION', 'when_required')
+    # the engine is a singleton, each test gets one built for its stand-in
+    from worker import _s3_transfer
+    monkeypatch.setattr(_s3_transfer, '_engine', None)
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture
+def drive_stand_in(monkeypatch):
+    server = start_stand_in(DriveStandInHandler)
+    from benchmark.__main__ import seed_drive_discovery
+    from worker import _google_service
+    monkeypatch.setattr(_google_service, '_discovery_dict', {})
+    seed_drive_discovery(server.url)
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture
+def google_credentials():
+    from worker import create_google_credentials
+    return create_google_credentials({
+        'token': 'test',
+        'refresh_token': 'test',
+        'client_id': 'test',
+        'client_secret': 'test',
+        'expiry': '2999-01-01T00:00:00Z'
+    })
+
+
+@pytest.fixture
+def api_stand_in():
+    server = start_stand_in(APIStandInHandler)
+    yield server
+    server.shutdown()
@@ -0,0 +1,126 @@
+import time
+import threading
+
+from PyQt6.QtCore import QCoreApplication
+from ulid import ULID
+
+from benchmark.standin import APIStandInHandler
+from worker.api_update import APIOutbox
+
+from conftest import start_stand_in
+
+
+class FlakyAPIStandInHandler(APIStandInHandler):
+    # answers with the queued statuses first, a commit is held until the
+    # test releases it
+
+    def do_POST(self):
+        self.server.received_event.set()
+        self.server.release_event.wait(10)
+        with self.server.lock:
+            status = self.server.status_list.pop(0) if self.server.status_list else None
+        if status is None:
+            super().do_POST()
+            return
+        self.read_body()
+        self.send_json(status, {'error': 'unavailable'}, {'Retry-After': '0'})
+
+
+def start_flaky_stand_in(status_list, is_held=False):
+    server = start_stand_in(FlakyAPIStandInHandler)
+    server.status_list = list(status_list)
+    server.received_event = threading.Event()
+    server.release_event = threading.Event()
+    if not is_held:
+        server.release_event.set()
+    return server
+
+
+class OutboxRecorder:
+    def __init__(self, api_outbox: APIOutbox):
+        self.event_list = []
+        self.done_dict = {}
+        self.lock = threading.Lock()
+        api_outbox.signals.committed.connect(lambda file_id, model_id: self.add('committed', file_id, model_id))
+        api_outbox.signals.failed.connect(lambda file_id, error: self.add('failed', file_id, error))
+        api_outbox.signals.retried.connect(lambda file_id, attempt_count, *_: self.add('retried', file_id, attempt_count))
+
+    def add(self, kind, file_id, value):
+        self.event_list.append((kind, file_id, value))
+        if kind != 'retried':
+            self.get_done_event(file_id).set()
+
+    def get_done_event(self, file_id) -> threading.Event:
+        with self.lock:
+            return self.done_dict.setdefault(file_id, threading.Event())
+
+    def kind_list(self, file_id):
+        return [x[0] for x in self.event_list if x[1] == file_id]
+
+
+def wait_for_signal(event: threading.Event, timeout: float = 10) -> bool:
+    # the signals of the outbox thread are delivered by this thread's loop
+    deadline = time.time() + timeout
+    while not event.is_set() and time.time() < deadline:
+        QCoreApplication.processEvents()
+        time.sleep(0.01)
+    return event.is_set()
+
+
+def run_outbox(server, file_id_list, before_release=None, wait_file_id_list=None):
+    api_outbox = APIOutbox({'url': f'{server.url}/model'})
+    recorder = OutboxRecorder(api_outbox)
+    api_outbox.start()
+    try:
+        for file_id in file_id_list:
+            api_outbox.put(file_id, {'name': 'model'})
+        if before_release:
+            assert server.received_event.wait(10)
+            before_release(api_outbox)
+            server.release_event.set()
+        for file_id in wait_file_id_list or file_id_list:
+            assert wait_for_signal(recorder.get_done_event(file_id))
+    finally:
+        api_outbox.stop(timeout=5)
+        server.shutdown()
+    return api_outbox, recorder
+
+
+def test_retried_commit_is_committed_once(qt_app):
+    server = start_flaky_stand_in([503, 503])
+    file_id = ULID()
+    api_outbox, recorder = run_outbox(server, [file_id])
+
+    assert recorder.kind_list(file_id) == ['retried', 'retried', 'committed']
+    assert recorder.event_list[-1][2] == server.commit_dict[str(file_id)]
+    assert api_outbox.pending_count() == 0
+
+
+def test_rejected_commit_is_not_retried(qt_app):
+    server = start_flaky_stand_in([400])
+    file_id = ULID()
+    api_outbox, recorder = run_outbox(server, [file_id])
+
+    assert recorder.kind_list(file_id) == ['failed']
+    assert server.commit_dict == {}
+    assert api_outbox.pending_count() == 0
+
+
+def test_commit_discarded_while_sent_is_dropped(qt_app):
+    # the task is deleted while the server holds its commit, whether the
+    # answer is a retryable error or a success
+    for status_list in ([503], []):
+        server = start_flaky_stand_in(status_list, is_held=True)
+        deleted_file_id = ULID()
+        file_id = ULID()
+
+        def delete(api_outbox: APIOutbox):
+            # the next commit only goes out once the held answer is settled
+            api_outbox.discard(deleted_file_id)
+            api_outbox.put(file_id, {'name': 'model'})
+
+        api_outbox, recorder = run_outbox(server, [deleted_file_id], delete, [file_id])
+        assert recorder.kind_list(deleted_file_id) == []
+        assert recorder.kind_list(file_id) == ['committed']
+        assert not api_outbox.is_pending(deleted_file_id)
+        assert api_outbox.discarded_set == set()
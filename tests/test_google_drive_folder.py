@@ -0,0 +1,70 @@
+import time
+import threading
+
+from worker import GoogleDriveFolderResolver
+from worker._google_service import get_google_service
+
+
+def resolve_in_thread(credentials, folder_resolver: GoogleDriveFolderResolver, name_list):
+    result_list = []
+
+    def resolve():
+        try:
+            result_list.append(folder_resolver.resolve(
+                get_google_service('drive', 'v3', credentials), None, None, name_list
+            ))
+        except Exception as error:
+            result_list.append(error)
+
+    thread = threading.Thread(target=resolve)
+    thread.start()
+    return thread, result_list
+
+
+def test_failed_prefetch_is_resolved_by_the_waiting_task(drive_stand_in, google_credentials):
+    folder_resolver = GoogleDriveFolderResolver()
+    is_claimed = threading.Event()
+    is_released = threading.Event()
+
+    # the batch of the prefetcher is throttled until it gives up
+    def find_or_create_folders(drive_service, key_list, retrier):
+        is_claimed.set()
+        is_released.wait(10)
+        raise RuntimeError("rateLimitExceeded")
+
+    folder_resolver.find_or_create_folders = find_or_create_folders
+    prefetch_thread = threading.Thread(target=folder_resolver.prefetch, args=(
+        get_google_service('drive', 'v3', google_credentials), None, None, [['models', 'set']]
+    ))
+    prefetch_thread.start()
+    assert is_claimed.wait(10)
+
+    # the task finds the folder in flight and waits for the prefetcher
+    thread, result_list = resolve_in_thread(google_credentials, folder_resolver, ['models', 'set'])
+    time.sleep(0.2)
+    is_released.set()
+    prefetch_thread.join(10)
+    thread.join(10)
+
+    folder_id = result_list[0]
+    assert isinstance(folder_id, str), folder_id
+    folder = drive_stand_in.file_dict[folder_id]
+    assert folder['name'] == 'set'
+    assert drive_stand_in.file_dict[folder['parents'][0]]['name'] == 'models'
+    assert folder_resolver.inflight_dict == {}
+
+
+def test_prefetched_folders_are_reused(drive_stand_in, google_credentials):
+    folder_resolver = GoogleDriveFolderResolver()
+    folder_resolver.prefetch(
+        get_google_service('drive', 'v3', google_credentials), None, None,
+        [['models', 'a'], ['models', 'b']]
+    )
+    assert folder_resolver.is_cached(None, None, ['models', 'a'])
+    assert folder_resolver.is_cached(None, None, ['models', 'b'])
+    file_count = len(drive_stand_in.file_dict)
+
+    thread, result_list = resolve_in_thread(google_credentials, folder_resolver, ['models', 'b'])
+    thread.join(10)
+    assert drive_stand_in.file_dict[result_list[0]]['name'] == 'b'
+    assert len(drive_stand_in.file_dict) == file_count == 3
@@ -0,0 +1,68 @@
+import os
+
+from ulid import ULID
+
+from worker import S3UploadWorker, ContentIndex, S3_BACKEND
+from worker._upload_base import UPLOADED_MODELS_BUCKET_NAME
+from worker.s3_upload import SHA256_METADATA_KEY
+
+CATEGORY_LIST = ['dedup', 'models', 'set']
+
+
+def write_model(path, content: bytes) -> str:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(content)
+    return str(path)
+
+
+def run_worker(content_index: ContentIndex, file_path: str):
+    worker = S3UploadWorker(
+        ULID(), file_path, 'model',
+        CATEGORY_LIST, '4.2', 'Cycles', [],
+        content_index
+    )
+    result_list = []
+    error_list = []
+    worker.signals.result.connect(lambda _, result: result_list.append(result))
+    worker.signals.error.connect(lambda _, error: error_list.append(error))
+    worker.run()
+    assert not error_list, error_list[0][2]
+    return result_list[0][0]
+
+
+def get_stored_sha256(server, key: str) -> str:
+    obj = server.object_dict[(UPLOADED_MODELS_BUCKET_NAME, key)]
+    return obj['metadata'][f'x-amz-meta-{SHA256_METADATA_KEY}']
+
+
+def test_overwritten_key_is_not_reused(s3_stand_in, tmp_path):
+    content_index = ContentIndex()
+    old_path = write_model(tmp_path / 'old' / 'model.blend', b'old' * 1000)
+    new_path = write_model(tmp_path / 'new' / 'model.blend', b'new' * 1000)
+    old_sha256 = content_index.hash_file(old_path)
+    new_sha256 = content_index.hash_file(new_path)
+
+    key = run_worker(content_index, old_path)
+    # the same name and categories write the same key with other bytes
+    assert run_worker(content_index, new_path) == key
+    assert content_index.lookup(S3_BACKEND, old_sha256) == []
+    assert content_index.lookup(S3_BACKEND, new_sha256) == [key]
+
+    assert run_worker(content_index, old_path) == key
+    assert get_stored_sha256(s3_stand_in, key) == old_sha256
+
+
+def test_stale_mapping_is_checked_against_the_object(s3_stand_in, tmp_path):
+    content_index = ContentIndex()
+    old_path = write_model(tmp_path / 'old' / 'model.blend', b'old' * 1000)
+    new_path = write_model(tmp_path / 'new' / 'model.blend', b'new' * 1000)
+    old_sha256 = content_index.hash_file(old_path)
+
+    key = run_worker(content_index, new_path)
+    # an index written before keys were tracked may still map old content
+    # to the key
+    content_index.remote_object_dict[(S3_BACKEND, old_sha256)] = [key]
+
+    assert run_worker(content_index, old_path) == key
+    assert get_stored_sha256(s3_stand_in, key) == old_sha256
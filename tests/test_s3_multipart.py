@@ -0,0 +1,221 @@
+import io
+import os
+import time
+import threading
+
+import pytest
+
+from benchmark.standin import S3StandInHandler
+from worker._s3_transfer import S3TransferEngine
+from worker._retry import Retrier, TaskCancelledError
+from worker._bandwidth import configure_bandwidth_limiter
+from worker._s3_multipart import S3MultipartUpload, MIN_PART_SIZE
+
+BUCKET_NAME = 'models'
+KEY = 'set/model.blend'
+
+
+class FlakyS3StandInHandler(S3StandInHandler):
+    # a part can be throttled and the answer of a complete can be lost, the
+    # test sets what happens on the server
+
+    def do_PUT(self):
+        _, _, query = self.get_bucket_key()
+        if 'partNumber' in query:
+            with self.server.lock:
+                self.server.part_number_list.append(int(query['partNumber'][0]))
+                is_throttled = int(query['partNumber'][0]) in self.server.throttled_part_set
+                self.server.throttled_part_set.discard(int(query['partNumber'][0]))
+            if is_throttled:
+                self.read_body()
+                self.send_error_xml(503, 'SlowDown', {'Retry-After': '1'})
+                return
+        super().do_PUT()
+
+    def do_POST(self):
+        _, _, query = self.get_bucket_key()
+        if 'uploadId' in query and self.server.lost_complete_count:
+            self.server.lost_complete_count -= 1
+            # the upload is completed, only the answer never arrives
+            wfile = self.wfile
+            self.wfile = io.BytesIO()
+            super().do_POST()
+            self.wfile = wfile
+            self.close_connection = True
+            return
+        super().do_POST()
+
+
+@pytest.fixture
+def flaky_s3_stand_in(s3_stand_in):
+    s3_stand_in.RequestHandlerClass = FlakyS3StandInHandler
+    s3_stand_in.part_number_list = []
+    s3_stand_in.throttled_part_set = set()
+    s3_stand_in.lost_complete_count = 0
+    return s3_stand_in
+
+
+def write_model(tmp_path, part_count: int) -> str:
+    path = tmp_path / 'model.blend'
+    with open(path, 'wb') as f:
+        for i in range(part_count):
+            f.write(bytes([i]) * MIN_PART_SIZE)
+    return str(path)
+
+
+def create_upload(engine: S3TransferEngine, file_path: str, session=None, session_list=None, retrier=None) -> S3MultipartUpload:
+    return S3MultipartUpload(
+        engine, BUCKET_NAME, KEY, file_path,
+        part_size=MIN_PART_SIZE,
+        session=session,
+        on_checkpoint=session_list.append if session_list is not None else None,
+        retrier=retrier
+    )
+
+
+def test_upload_resumes_from_the_uploaded_parts(flaky_s3_stand_in, tmp_path):
+    engine = S3TransferEngine()
+    file_path = write_model(tmp_path, 3)
+
+    # the app stopped after the first part
+    multipart_upload = create_upload(engine, file_path)
+    multipart_upload.start()
+    multipart_upload.part_dict[1], multipart_upload.part_digest_dict[1] = multipart_upload.upload_part(1)
+    session = multipart_upload.to_session()
+
+    session_list = []
+    create_upload(engine, file_path, session, session_list).upload()
+
+    assert flaky_s3_stand_in.part_number_list.count(1) == 1
+    assert sorted(flaky_s3_stand_in.part_number_list) == [1, 2, 3]
+    obj = flaky_s3_stand_in.object_dict[(BUCKET_NAME, KEY)]
+    assert obj['size'] == os.path.getsize(file_path)
+    assert session_list[-1]['upload_id'] == session['upload_id']
+
+
+def test_changed_file_starts_a_new_upload(flaky_s3_stand_in, tmp_path):
+    engine = S3TransferEngine()
+    file_path = write_model(tmp_path, 2)
+    multipart_upload = create_upload(engine, file_path)
+    multipart_upload.start()
+    session = multipart_upload.to_session()
+
+    file_path = write_model(tmp_path, 3)
+    session_list = []
+    create_upload(engine, file_path, session, session_list).upload()
+
+    assert session_list[0]['upload_id'] != session['upload_id']
+    assert flaky_s3_stand_in.object_dict[(BUCKET_NAME, KEY)]['size'] == os.path.getsize(file_path)
+
+
+def test_throttled_part_does_not_hold_an_engine_thread(flaky_s3_stand_in, tmp_path):
+    engine = S3TransferEngine(max_concurrency=1)
+    file_path = write_model(tmp_path, 2)
+    flaky_s3_stand_in.throttled_part_set = {1, 2}
+    multipart_upload = create_upload(engine, file_path)
+    thread = threading.Thread(target=multipart_upload.upload)
+    thread.start()
+    deadline = time.time() + 5
+    while len(flaky_s3_stand_in.part_number_list) < 2 and time.time() < deadline:
+        time.sleep(0.01)
+
+    # the only engine thread stays free for other tasks while both parts
+    # wait out their backoff
+    started_at = time.time()
+    assert engine.submit(time.time).result(timeout=5) - started_at < 0.5
+    thread.join(10)
+
+    assert sorted(flaky_s3_stand_in.part_number_list) == [1, 1, 2, 2]
+    assert flaky_s3_stand_in.object_dict[(BUCKET_NAME, KEY)]['size'] == os.path.getsize(file_path)
+
+
+def test_backoff_of_every_part_is_waited_out_idle(flaky_s3_stand_in, tmp_path):
+    engine = S3TransferEngine()
+    file_path = write_model(tmp_path, 2)
+    flaky_s3_stand_in.throttled_part_set = {1, 2}
+
+    started_at = time.time()
+    cpu_started_at = time.thread_time()
+    create_upload(engine, file_path).upload()
+
+    assert time.time() - started_at >= 1.0
+    assert time.thread_time() - cpu_started_at < 0.5
+
+
+def test_cancel_ends_the_backoff(flaky_s3_stand_in, tmp_path):
+    engine = S3TransferEngine()
+    file_path = write_model(tmp_path, 2)
+    flaky_s3_stand_in.throttled_part_set = {1, 2}
+    cancel_event = threading.Event()
+    retrier = Retrier('s3', cancel_event=cancel_event)
+    threading.Timer(0.3, cancel_event.set).start()
+
+    started_at = time.time()
+    with pytest.raises(TaskCancelledError):
+        create_upload(engine, file_path, retrier=retrier).upload()
+    assert time.time() - started_at < 0.9
+    assert sorted(flaky_s3_stand_in.part_number_list) == [1, 2]
+
+
+def test_cancel_ends_the_backoff_of_a_call():
+    cancel_event = threading.Event()
+    retrier = Retrier('s3', cancel_event=cancel_event)
+    call_list = []
+
+    def throttled():
+        from botocore.exceptions import ClientError
+        call_list.append(time.time())
+        raise ClientError({'Error': {'Code': 'SlowDown'}, 'ResponseMetadata': {'HTTPHeaders': {'retry-after': '60'}}}, 'PutObject')
+
+    threading.Timer(0.3, cancel_event.set).start()
+    started_at = time.time()
+    with pytest.raises(TaskCancelledError):
+        retrier.call(throttled, description="Throttled call")
+    assert time.time() - started_at < 5
+    assert len(call_list) == 1
+
+
+def test_cancel_ends_a_throttled_part(flaky_s3_stand_in, tmp_path):
+    engine = S3TransferEngine()
+    file_path = write_model(tmp_path, 2)
+    # both parts together take ten seconds at this rate
+    configure_bandwidth_limiter({'s3_limit': MIN_PART_SIZE // 5})
+    cancel_event = threading.Event()
+    retrier = Retrier('s3', cancel_event=cancel_event)
+    threading.Timer(0.5, cancel_event.set).start()
+
+    started_at = time.time()
+    try:
+        with pytest.raises(TaskCancelledError):
+            create_upload(engine, file_path, retrier=retrier).upload()
+    finally:
+        configure_bandwidth_limiter({})
+    assert time.time() - started_at < 3
+    assert (BUCKET_NAME, KEY) not in flaky_s3_stand_in.object_dict
+
+
+def test_complete_with_a_lost_answer_is_not_failed(flaky_s3_stand_in, tmp_path):
+    engine = S3TransferEngine()
+    file_path = write_model(tmp_path, 2)
+    flaky_s3_stand_in.lost_complete_count = 1
+
+    create_upload(engine, file_path).upload()
+
+    assert flaky_s3_stand_in.upload_dict == {}
+    assert flaky_s3_stand_in.object_dict[(BUCKET_NAME, KEY)]['size'] == os.path.getsize(file_path)
+
+
+def test_complete_of_an_aborted_upload_fails(flaky_s3_stand_in, tmp_path):
+    from botocore.exceptions import ClientError
+    engine = S3TransferEngine()
+    file_path = write_model(tmp_path, 2)
+    multipart_upload = create_upload(engine, file_path)
+    multipart_upload.start()
+    for part_number in (1, 2):
+        multipart_upload.part_dict[part_number], multipart_upload.part_digest_dict[part_number] = multipart_upload.upload_part(part_number)
+
+    # another object is at the key and the upload is gone
+    flaky_s3_stand_in.upload_dict.clear()
+    flaky_s3_stand_in.object_dict[(BUCKET_NAME, KEY)] = {'etag': '"0123456789abcdef0123456789abcdef-2"', 'size': 0, 'metadata': {}}
+    with pytest.raises(ClientError, match='NoSuchUpload'):
+        multipart_upload.complete()
@@ -0,0 +1,41 @@
+import time
+
+from PyQt6.QtCore import QObject, QRunnable, pyqtSignal
+from ulid import ULID
+
+from worker.upload_scheduler import UploadScheduler
+
+
+class StubSignals(QObject):
+    finished = pyqtSignal()
+
+
+class StubRunnable(QRunnable):
+    def __init__(self):
+        super().__init__()
+        self.signals = StubSignals()
+
+    def run(self):
+        self.signals.finished.emit()
+
+
+def next_entry(scheduler: UploadScheduler):
+    now = time.monotonic()
+    return min(scheduler.queue_dict['s3'], key=lambda x: scheduler.sort_key(x, now))
+
+
+def test_overdue_entry_is_admitted_before_smaller_ones(qt_app):
+    # nothing is started, the queue only gets ordered
+    scheduler = UploadScheduler({'limits': {'s3': 0, 'google_drive': 0}, 'max_wait': 60})
+    large_file_id = ULID()
+    scheduler.submit('s3', large_file_id, StubRunnable(), 100)
+    scheduler.submit('s3', ULID(), StubRunnable(), 1)
+    assert next_entry(scheduler).size == 1
+
+    scheduler.queue_dict['s3'][0].enqueued_at -= 61
+    assert next_entry(scheduler).file_id == large_file_id
+
+    # a task the user moved to the top still goes first
+    small_file_id = scheduler.queue_dict['s3'][1].file_id
+    scheduler.move_to_top(small_file_id)
+    assert next_entry(scheduler).file_id == small_file_id
@@ -0,0 +1,163 @@
+import os
+import csv
+import json
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from util.catalog import BLENDER_VERSION_LIST, RENDER_ENGINE_LIST, CATEGORY_DICTIONARY
+
+MODEL_EXTENSION_LIST = ['.zip', '.rar']
+IMAGE_EXTENSION_LIST = ['.png', '.jpg', '.jpeg', '.webp']
+MIN_IMAGE_COUNT = 3
+MAX_IMAGE_COUNT = 5
+IMAGE_SEPARATOR_LIST = [';', '|']
+
+# (location, raw entry) where location points at the row for error reports
+RawEntry = Tuple[str, dict]
+
+
+def read_csv_manifest(manifest_path: str) -> Iterator[RawEntry]:
+    with open(manifest_path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.DictReader(f)
+        for row in reader:
+            yield f'{os.path.basename(manifest_path)}:{reader.line_num}', row
+
+
+def read_jsonl_manifest(manifest_path: str) -> Iterator[RawEntry]:
+    with open(manifest_path, encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            location = f'{os.path.basename(manifest_path)}:{line_number}'
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError as error:
+                yield location, {'_error': f'Invalid JSON: {error}'}
+                continue
+            if not isinstance(row, dict):
+                yield location, {'_error': 'Each line must be a JSON object'}
+                continue
+            yield location, row
+
+
+def scan_directory(directory_path: str) -> Iterator[RawEntry]:
+    # <category1>/<category2>/<category3>/<model>.zip with the preview images
+    # next to it, named after the model when a folder holds several models
+    directory_path = os.path.abspath(directory_path)
+    for dir_path, dir_name_list, file_name_list in os.walk(directory_path):
+        dir_name_list.sort()
+        model_name_list = sorted(
+            x for x in file_name_list
+            if os.path.splitext(x)[1].lower() in MODEL_EXTENSION_LIST
+        )
+        image_name_list = sorted(
+            x for x in file_name_list
+            if os.path.splitext(x)[1].lower() in IMAGE_EXTENSION_LIST
+        )
+        category_list = os.path.relpath(dir_path, directory_path).split(os.sep)
+        if category_list == ['.']:
+            category_list = []
+        for model_name in model_name_list:
+            model_stem = os.path.splitext(model_name)[0]
+            if len(model_name_list) > 1:
+                model_image_name_list = [x for x in image_name_list if x.startswith(model_stem)]
+            else:
+                model_image_name_list = image_name_list
+            row = {
+                'file_path': os.path.join(dir_path, model_name),
+                'name': model_stem,
+                'images': [os.path.join(dir_path, x) for x in model_image_name_list]
+            }
+            for i, category in enumerate(category_list[:3]):
+                row[f'category{i + 1}'] = category
+            yield os.path.relpath(row['file_path'], directory_path), row
+
+
+def read_manifest(manifest_path: str) -> Iterator[RawEntry]:
+    if os.path.isdir(manifest_path):
+        return scan_directory(manifest_path)
+    ext = os.path.splitext(manifest_path)[1].lower()
+    if ext == '.csv':
+        return read_csv_manifest(manifest_path)
+    if ext in ('.jsonl', '.ndjson'):
+        return read_jsonl_manifest(manifest_path)
+    raise ValueError(f"Unsupported manifest {manifest_path}, use a folder, a .csv or a .jsonl file")
+
+
+def normalize_entry(row: dict, base_dir: str, default_dict: Dict[str, str]) -> dict:
+    def get_field(key: str) -> str:
+        value = row.get(key)
+        if value is None or value == '':
+            value = default_dict.get(key, '')
+        return str(value).strip()
+
+    def resolve_path(path: str) -> str:
+        return os.path.normpath(os.path.join(base_dir, os.path.expanduser(path)))
+
+    image_list = row.get('images') or []
+    if isinstance(image_list, str):
+        for separator in IMAGE_SEPARATOR_LIST:
+            image_list = image_list.replace(separator, '\n')
+        image_list = image_list.splitlines()
+
+    file_path = get_field('file_path')
+    return {
+        'file_path': resolve_path(file_path) if file_path else '',
+        'file_name': get_field('name') or os.path.splitext(os.path.basename(file_path))[0],
+        'category1': get_field('category1'),
+        'category2': get_field('category2'),
+        'category3': get_field('category3'),
+        'blender_version': get_field('blender_version'),
+        'render_engine': get_field('render_engine'),
+        'image_path_list': [resolve_path(x.strip()) for x in image_list if x.strip()]
+    }
+
+
+def validate_entry(entry: dict) -> List[str]:
+    # the same rules as FileSelectDialog.check_and_accept
+    error_list = []
+    if not entry['file_path']:
+        error_list.append("missing file_path")
+    elif not os.path.isfile(entry['file_path']):
+        error_list.append(f"file {entry['file_path']} does not exist")
+    if not entry['file_name']:
+        error_list.append("missing name")
+
+    category_2_dict = CATEGORY_DICTIONARY.get(entry['category1'])
+    category_3_list = (category_2_dict or {}).get(entry['category2'])
+    if category_2_dict is None:
+        error_list.append(f"unknown category1 '{entry['category1']}'")
+    elif category_3_list is None:
+        error_list.append(f"unknown category2 '{entry['category2']}' in {entry['category1']}")
+    elif entry['category3'] not in category_3_list:
+        error_list.append(f"unknown category3 '{entry['category3']}' in {entry['category1']}/{entry['category2']}")
+
+    if entry['blender_version'] not in BLENDER_VERSION_LIST:
+        error_list.append(f"unknown blender_version '{entry['blender_version']}'")
+    if entry['render_engine'] not in RENDER_ENGINE_LIST:
+        error_list.append(f"unknown render_engine '{entry['render_engine']}'")
+
+    image_count = len(entry['image_path_list'])
+    if not MIN_IMAGE_COUNT <= image_count <= MAX_IMAGE_COUNT:
+        error_list.append(f"needs {MIN_IMAGE_COUNT} to {MAX_IMAGE_COUNT} images, got {image_count}")
+    error_list.extend(
+        f"image {x} does not exist"
+        for x in entry['image_path_list']
+        if not os.path.isfile(x)
+    )
+    return error_list
+
+
+def iter_manifest_entries(
+        manifest_path: str,
+        default_dict: Optional[Dict[str, str]] = None
+    ) -> Iterator[Tuple[str, Optional[dict], List[str]]]:
+    # rows are read and checked one at a time, a bad row is reported and the
+    # rest of the batch goes on
+    base_dir = manifest_path if os.path.isdir(manifest_path) else os.path.dirname(os.path.abspath(manifest_path))
+    for location, row in read_manifest(manifest_path):
+        if '_error' in row:
+            yield location, None, [row['_error']]
+            continue
+        entry = normalize_entry(row, base_dir, default_dict or {})
+        error_list = validate_entry(entry)
+        yield location, (None if error_list else entry), error_list
@@ -0,0 +1,180 @@
+import os
+import json
+import math
+import time
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from ulid import ULID
+
+from worker import SPAN_ERROR
+
+# (file_id, backend, stage, started_at, ended_at, byte_count, retry_count, status)
+Span = Tuple[ULID, str, str, float, float, int, int, str]
+
+# the row of a backend that covers whole tasks instead of one stage
+ALL_STAGE = 'all'
+QUANTILE_LIST = [0.5, 0.95, 0.99]
+METRIC_PREFIX = 'qt_uploader'
+DEFAULT_RETENTION_DAYS = 30
+PROMETHEUS_EXTENSION = '.prom'
+JSON_EXTENSION = '.json'
+
+
+def percentile(value_list: List[float], p: float) -> Optional[float]:
+    # nearest rank, the same sample set always gives the same answer
+    if not value_list:
+        return None
+    value_list = sorted(value_list)
+    return value_list[max(math.ceil(p / 100 * len(value_list)), 1) - 1]
+
+
+def summarize_durations(
+        backend: str,
+        stage: str,
+        duration_list: List[float],
+        byte_count: int,
+        retry_count: int,
+        error_count: int
+    ) -> dict:
+    busy_seconds = sum(duration_list)
+    return {
+        'backend': backend,
+        'stage': stage,
+        'count': len(duration_list),
+        'error_count': error_count,
+        'retry_count': retry_count,
+        'byte_count': byte_count,
+        'busy_seconds': busy_seconds,
+        # bytes per second while the stage was running, idle time in the
+        # queue does not count
+        'throughput': byte_count / busy_seconds if byte_count and busy_seconds > 0 else None,
+        'duration_quantile_dict': {
+            str(x): percentile(duration_list, x * 100)
+            for x in QUANTILE_LIST
+        },
+        'duration_max': max(duration_list, default=None)
+    }
+
+
+def summarize_spans(span_list: Iterable[Span]) -> List[dict]:
+    stage_dict: Dict[Tuple[str, str], list] = defaultdict(list)
+    # (backend, file_id) -> [started_at, ended_at, byte_count, retry_count, is_failed]
+    task_dict: Dict[Tuple[str, ULID], list] = {}
+    for file_id, backend, stage, started_at, ended_at, byte_count, retry_count, status in span_list:
+        stage_dict[(backend, stage)].append((ended_at - started_at, byte_count, retry_count, status))
+        task = task_dict.setdefault((backend, file_id), [started_at, ended_at, 0, 0, False])
+        task[0] = min(task[0], started_at)
+        task[1] = max(task[1], ended_at)
+        task[2] += byte_count
+        task[3] += retry_count
+        task[4] = task[4] or status == SPAN_ERROR
+
+    summary_list = []
+    for (backend, stage), item_list in stage_dict.items():
+        summary_list.append(summarize_durations(
+            backend, stage,
+            [x[0] for x in item_list],
+            sum(x[1] for x in item_list),
+            sum(x[2] for x in item_list),
+            sum(1 for x in item_list if x[3] == SPAN_ERROR)
+        ))
+
+    # a task spends more than the sum of its stages in a backend, the
+    # first start to the last end is what the user waits for
+    backend_task_dict: Dict[str, list] = defaultdict(list)
+    for (backend, _), task in task_dict.items():
+        backend_task_dict[backend].append(task)
+    for backend, task_list in backend_task_dict.items():
+        summary_list.append(summarize_durations(
+            backend, ALL_STAGE,
+            [x[1] - x[0] for x in task_list],
+            sum(x[2] for x in task_list),
+            sum(x[3] for x in task_list),
+            sum(1 for x in task_list if x[4])
+        ))
+    return sorted(summary_list, key=lambda x: (x['backend'], x['stage'] == ALL_STAGE, x['stage']))
+
+
+def escape_label_value(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_prometheus(summary_list: List[dict]) -> str:
+    # every retained span is counted, the totals only drop when old spans
+    # are pruned
+    line_list = []
+
+    def add_metric(name: str, metric_type: str, help_text: str, sample_list: List[Tuple[str, dict, float]]):
+        line_list.append(f'# HELP {METRIC_PREFIX}_{name} {help_text}')
+        line_list.append(f'# TYPE {METRIC_PREFIX}_{name} {metric_type}')
+        for suffix, label_dict, value in sample_list:
+            label_text = ','.join(f'{k}="{escape_label_value(str(v))}"' for k, v in label_dict.items())
+            line_list.append(f'{METRIC_PREFIX}_{name}{suffix}{{{label_text}}} {value}')
+
+    def get_label_dict(summary: dict) -> dict:
+        return {'backend': summary['backend'], 'stage': summary['stage']}
+
+    duration_sample_list = []
+    for summary in summary_list:
+        label_dict = get_label_dict(summary)
+        for quantile, value in summary['duration_quantile_dict'].items():
+            if value is not None:
+                duration_sample_list.append(('', {**label_dict, 'quantile': quantile}, value))
+        duration_sample_list.append(('_sum', label_dict, summary['busy_seconds']))
+        duration_sample_list.append(('_count', label_dict, summary['count']))
+    add_metric(
+        'stage_duration_seconds', 'summary',
+        f'Time spent in a stage, stage="{ALL_STAGE}" is the whole task on a backend',
+        duration_sample_list
+    )
+    add_metric(
+        'stage_bytes_total', 'counter', 'Bytes sent by a stage',
+        [('', get_label_dict(x), x['byte_count']) for x in summary_list]
+    )
+    add_metric(
+        'stage_retries_total', 'counter', 'Remote calls retried during a stage',
+        [('', get_label_dict(x), x['retry_count']) for x in summary_list]
+    )
+    add_metric(
+        'stage_errors_total', 'counter', 'Stages that ended with an error',
+        [('', get_label_dict(x), x['error_count']) for x in summary_list]
+    )
+    return '\n'.join(line_list) + '\n'
+
+
+def format_json(summary_list: List[dict], since: Optional[float] = None, span_list: Optional[List[Span]] = None) -> str:
+    metrics = {
+        'generated_at': time.time(),
+        'since': since,
+        'summary_list': summary_list
+    }
+    if span_list is not None:
+        metrics['span_list'] = [
+            {
+                'file_id': str(file_id),
+                'backend': backend,
+                'stage': stage,
+                'started_at': started_at,
+                'ended_at': ended_at,
+                'byte_count': byte_count,
+                'retry_count': retry_count,
+                'status': status
+            }
+            for file_id, backend, stage, started_at, ended_at, byte_count, retry_count, status in span_list
+        ]
+    return json.dumps(metrics, indent=2)
+
+
+def write_metrics(path: str, span_list: List[Span], since: Optional[float] = None):
+    # the format follows the extension, anything but .json is Prometheus text
+    summary_list = summarize_spans(span_list)
+    if os.path.splitext(path)[1].lower() == JSON_EXTENSION:
+        text = format_json(summary_list, since, span_list)
+    else:
+        text = format_prometheus(summary_list)
+    # a collector reading the file never sees half of it
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(temp_path, path)
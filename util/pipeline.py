@@ -0,0 +1,503 @@
+import os
+import time
+from typing import Dict, Tuple, List, Optional, Set
+
+from PyQt6.QtCore import QObject, QThread, QThreadPool, QTimer, pyqtSignal, pyqtSlot
+
+from ulid import ULID
+
+from worker import (
+    S3UploadWorker, GoogleDriveUploadWorker,
+    UploadWaiterWorker, S3_BACKEND,
+    GOOGLE_DRIVE_BACKEND, GoogleDriveFolderResolver, GoogleDriveFolderPrefetcher,
+    configure_s3_transfer_engine, shutdown_s3_transfer_engine, UploadScheduler,
+    configure_bandwidth_limiter, APIOutbox,
+    ProgressAggregator, ContentIndex,
+    ImagePreprocessor, API_COMMIT_STAGE,
+    configure_retry, API_BACKEND,
+    GoogleCredentialsLoader, create_google_credential_manager,
+    TaskCancelledError, shutdown_image_executors
+)
+
+from util.api import create_api_payload
+from util.metrics import write_metrics, DEFAULT_RETENTION_DAYS
+
+from db import QtDBObject
+
+# folders of the tasks queued within this window are resolved in one batch
+GOOGLE_DRIVE_FOLDER_PREFETCH_DELAY_MS = 200
+# how long close() waits for the cancelled workers to stop
+CLOSE_TIMEOUT = 10.0
+
+
+class UploadPipelineSignals(QObject):
+    # file_id, name
+    created = pyqtSignal(ULID, str)
+    resumed = pyqtSignal(ULID, str)
+    # file_id, status
+    status = pyqtSignal(ULID, str)
+    # file_id, backend, retry_count, message
+    retried = pyqtSignal(ULID, str, int, str)
+    # is_ready, once the stored Google login was loaded after the start
+    google_drive_checked = pyqtSignal(bool)
+
+
+class UploadPipeline(QObject):
+    # everything a task needs from creation to the API commit, without any
+    # widget, so the window and the headless runner drive the same code
+
+    def init_db(self):
+        self.db = QtDBObject()
+
+    def init_google_drive_folder_resolver(self):
+        self.google_drive_folder_resolver = GoogleDriveFolderResolver(self.db.list_google_drive_folders())
+        self.google_drive_folder_resolver.signals.saved.connect(self.db.save_google_drive_folder)
+        self.google_drive_folder_resolver.signals.invalidated.connect(self.db.delete_google_drive_folder)
+
+    def init_google_drive_folder_prefetch(self):
+        self.google_drive_folder_prefetch_set = set()
+        self.google_drive_folder_prefetch_timer = QTimer(self)
+        self.google_drive_folder_prefetch_timer.setSingleShot(True)
+        self.google_drive_folder_prefetch_timer.setInterval(GOOGLE_DRIVE_FOLDER_PREFETCH_DELAY_MS)
+        self.google_drive_folder_prefetch_timer.timeout.connect(self.prefetch_google_drive_folders)
+
+    def queue_google_drive_folder_prefetch(self, category_list: List[str]):
+        folder_config = self.google_drive_folder_config or {}
+        if self.google_drive_folder_resolver.is_cached(folder_config.get('drive_id'), folder_config.get('id'), category_list):
+            return
+        self.google_drive_folder_prefetch_set.add(tuple(category_list))
+        # started once, not pushed back, a long ingest still gets its folders
+        if not self.google_drive_folder_prefetch_timer.isActive():
+            self.google_drive_folder_prefetch_timer.start()
+
+    @pyqtSlot()
+    def prefetch_google_drive_folders(self):
+        name_list_list = [list(x) for x in self.google_drive_folder_prefetch_set]
+        self.google_drive_folder_prefetch_set.clear()
+        if not name_list_list or not self.is_google_drive_ready():
+            return
+        QThreadPool.globalInstance().start(GoogleDriveFolderPrefetcher(
+            self.google_oauth_credentials,
+            self.google_drive_folder_resolver,
+            self.google_drive_folder_config,
+            name_list_list
+        ))
+
+    def init_content_index(self):
+        self.content_index = ContentIndex(self.db.list_remote_objects())
+        self.content_index.signals.saved.connect(self.db.save_remote_object)
+        self.content_index.signals.invalidated.connect(self.db.delete_remote_object)
+
+    def init_running_task_dict(self):
+        self.running_task_dict: Dict[ULID, Tuple[S3UploadWorker, GoogleDriveUploadWorker, UploadWaiterWorker, QThread]] = {}
+        # deleted while running, whatever the task still reports is dropped
+        self.cancelled_file_id_set: Set[ULID] = set()
+
+    def init_upload_scheduler(self):
+        self.upload_scheduler = UploadScheduler(self.db.get_config('scheduler_config'))
+
+    def init_image_preprocessor(self):
+        self.image_preprocessor = ImagePreprocessor(self.db.get_config('image_preprocess_config'))
+
+    def init_progress_aggregator(self):
+        self.progress_aggregator = ProgressAggregator()
+        self.progress_aggregator.signals.db_progress_message.connect(self.db.set_file_progress_message)
+
+    def init_api_outbox(self):
+        self.api_outbox = APIOutbox(self.db.get_config('api_config'))
+        self.api_outbox.signals.committed.connect(self.handle_api_committed)
+        self.api_outbox.signals.failed.connect(self.handle_api_failed)
+        self.api_outbox.signals.retried.connect(self.handle_api_retried)
+        self.api_outbox.signals.span.connect(self.db.save_task_span)
+        # commits left by the last run are sent before anything new
+        for file_id, payload, attempt_count, next_attempt_at in self.db.list_api_outbox():
+            self.api_outbox.put(file_id, payload, attempt_count, next_attempt_at)
+        self.api_outbox.start()
+
+    def init_config(self):
+        self.google_drive_folder_config = self.db.get_config('google_drive_folder_config')
+        self.s3_upload_config = self.db.get_config('s3_upload_config') or {}
+        configure_s3_transfer_engine(self.s3_upload_config)
+        self.bandwidth_config = self.db.get_config('bandwidth_config') or {}
+        configure_bandwidth_limiter(self.bandwidth_config)
+        self.google_drive_upload_config = self.db.get_config('google_drive_upload_config') or {}
+        configure_retry(self.db.get_config('retry_config'))
+        self.metrics_config = self.db.get_config('metrics_config') or {}
+
+    def init_metrics(self):
+        retention_days = self.metrics_config.get('retention_days', DEFAULT_RETENTION_DAYS)
+        self.db.delete_task_spans(time.time() - retention_days * 24 * 3600)
+
+    def init_google_oauth_credentials(self):
+        self.google_oauth_token = self.db.get_config('google_oauth_token')
+        self.google_credential_manager = None
+        self.is_google_drive_reported_ready = False
+        # the token is refreshed in the background, google_drive_checked
+        # tells when it is done, even without a stored token
+        self.google_credentials_loader = GoogleCredentialsLoader(self.google_oauth_token)
+        self.google_credentials_loader.signals.loaded.connect(self.handle_google_oauth_credentials_loaded)
+        QThreadPool.globalInstance().start(self.google_credentials_loader)
+
+    def is_google_drive_checking(self) -> bool:
+        return self.google_credentials_loader is not None
+
+    @property
+    def google_oauth_credentials(self):
+        # one object shared by every Drive worker, the manager keeps it valid
+        if self.google_credential_manager is None:
+            return None
+        return self.google_credential_manager.credentials
+
+    def start_google_credential_manager(self, manager):
+        if self.google_credential_manager is not None:
+            # a refresh it is still doing must not replace the new login
+            self.google_credential_manager.signals.refreshed.disconnect()
+            self.google_credential_manager.stop(timeout=0)
+        self.google_credential_manager = manager
+        manager.signals.refreshed.connect(self.handle_google_oauth_token_refreshed)
+        manager.start()
+
+    @pyqtSlot(object)
+    def handle_google_oauth_credentials_loaded(self, manager):
+        self.google_credentials_loader = None
+        # a login finished while loading is newer than the stored token
+        if self.google_credential_manager is None and manager is not None:
+            # the loader may have refreshed it before anything was connected
+            if manager.credentials.token != self.google_oauth_token.get('token'):
+                self.handle_google_oauth_token_refreshed(manager.credentials.to_token())
+            self.start_google_credential_manager(manager)
+        self.is_google_drive_reported_ready = self.is_google_drive_ready()
+        self.signals.google_drive_checked.emit(self.is_google_drive_reported_ready)
+
+    @pyqtSlot(dict)
+    def handle_google_oauth_token_refreshed(self, google_oauth_token: dict):
+        self.db.save_config('google_oauth_token', google_oauth_token)
+        self.google_oauth_token = google_oauth_token
+        # a refresh that failed at startup (e.g. offline) is retried by the
+        # manager, its first success is reported like the startup check
+        if self.google_credentials_loader is None and not self.is_google_drive_reported_ready and self.is_google_drive_ready():
+            self.is_google_drive_reported_ready = True
+            self.signals.google_drive_checked.emit(True)
+
+    def is_google_drive_ready(self) -> bool:
+        return bool(self.google_credential_manager and self.google_credential_manager.is_valid())
+
+    def is_google_drive_refreshing(self) -> bool:
+        # the stored login could not be refreshed yet, the manager keeps trying
+        return bool(self.google_credential_manager and self.google_credential_manager.needs_refresh())
+
+    def set_bandwidth_config(self, bandwidth_config: dict):
+        self.db.save_config('bandwidth_config', bandwidth_config)
+        self.bandwidth_config = bandwidth_config
+        configure_bandwidth_limiter(bandwidth_config)
+
+    def set_google_oauth_token(self, google_oauth_token: dict):
+        self.db.save_config('google_oauth_token', google_oauth_token)
+        self.google_oauth_token = google_oauth_token
+        self.start_google_credential_manager(create_google_credential_manager(google_oauth_token))
+
+    def set_google_drive_folder_config(self, google_drive_folder_config: dict):
+        self.db.save_config('google_drive_folder_config', google_drive_folder_config)
+        self.google_drive_folder_config = google_drive_folder_config
+
+    def set_file_status(self, file_id: ULID, status: str):
+        if file_id in self.cancelled_file_id_set:
+            return
+        self.db.set_file_status(file_id, status)
+        self.signals.status.emit(file_id, status)
+
+    @pyqtSlot(ULID, float, str)
+    def update_progress(self, file_id: ULID, progress: float, message: str):
+        if file_id not in self.cancelled_file_id_set:
+            self.progress_aggregator.update(file_id, progress, message)
+
+    @pyqtSlot(ULID, str, dict)
+    def save_task_stage(self, file_id: ULID, stage: str, result: dict):
+        if file_id not in self.cancelled_file_id_set:
+            self.db.save_task_stage(file_id, stage, result)
+
+    def cancel_task(self, file_id: ULID):
+        cancelled_list = self.upload_scheduler.cancel(file_id)
+        task = self.running_task_dict.get(file_id)
+        # an answer of the outbox may already be queued for this thread
+        if task or self.api_outbox.is_pending(file_id):
+            self.cancelled_file_id_set.add(file_id)
+        if task:
+            s3_upload_worker, google_drive_upload_worker, *_ = task
+            s3_upload_worker.cancel()
+            google_drive_upload_worker.cancel()
+            # the waiter lets the task go once every worker reported, one the
+            # scheduler never started reports here as if it had failed
+            for runnable in cancelled_list:
+                error = TaskCancelledError(f"Task {file_id} was cancelled")
+                runnable.signals.error.emit(file_id, (TaskCancelledError, error, ''))
+                runnable.signals.finished.emit()
+
+    @pyqtSlot(ULID)
+    def delete_task(self, file_id: ULID):
+        self.cancel_task(file_id)
+        self.api_outbox.discard(file_id)
+        self.db.delete_file(file_id)
+
+    @pyqtSlot(ULID, str)
+    def handle_api_committed(self, file_id: ULID, model_id: str):
+        if file_id in self.cancelled_file_id_set:
+            return
+        self.db.save_task_stage(file_id, API_COMMIT_STAGE, {'model_id': model_id})
+        self.db.delete_api_outbox(file_id)
+        self.progress_aggregator.update(file_id, 100, "Finished")
+        self.progress_aggregator.flush(file_id)
+        self.set_file_status(file_id, "finished")
+
+    @pyqtSlot(ULID, str)
+    def handle_api_failed(self, file_id: ULID, error: str):
+        if file_id in self.cancelled_file_id_set:
+            return
+        self.db.delete_api_outbox(file_id)
+        self.progress_aggregator.update(file_id, 99, f"Failed to commit to API: {error}")
+        self.progress_aggregator.flush(file_id)
+        self.set_file_status(file_id, "failed")
+
+    @pyqtSlot(ULID, int, float, str)
+    def handle_api_retried(self, file_id: ULID, attempt_count: int, next_attempt_at: float, error: str):
+        if file_id in self.cancelled_file_id_set:
+            return
+        self.db.set_api_outbox_attempt(file_id, attempt_count, next_attempt_at, error)
+        message = f"API commit failed {attempt_count} time(s), retrying"
+        self.progress_aggregator.update(file_id, 99, message)
+        self.handle_retry(file_id, API_BACKEND, attempt_count, message)
+
+    @pyqtSlot(ULID, str, int, str)
+    def handle_retry(self, file_id: ULID, backend: str, retry_count: int, message: str):
+        if file_id in self.cancelled_file_id_set:
+            return
+        self.db.add_task_retry(file_id, backend)
+        self.signals.retried.emit(file_id, backend, retry_count, message)
+
+    @pyqtSlot(str, str, str, str, str, str, str, list)
+    def create_new_upload_task(
+        self,
+        file_path: str,
+        file_name: str,
+        category1: str,
+        category2: str,
+        category3: str,
+        blender_version: str,
+        render_engine: str,
+        image_path_list: List[str]
+    ) -> Optional[ULID]:
+        if not self.is_google_drive_ready():
+            print(f"Google Drive credential does not exist or is invalid, {file_path} is not queued")
+            return None
+
+        # the size is read before the row and the workers exist, a file that
+        # is already gone leaves a failed row instead of a half started task
+        try:
+            file_size = os.path.getsize(file_path)
+        except OSError as error:
+            print(f"{file_path} cannot be read, it is not uploaded: {error}")
+            file_size = None
+
+        file_id = ULID()
+        self.signals.created.emit(file_id, file_name)
+
+        self.db.create_file(
+            file_id, file_name, file_path,
+            [category1, category2, category3],
+            image_path_list,
+            blender_version, render_engine
+        )
+        if file_size is None:
+            self.set_file_status(file_id, "failed")
+            return file_id
+        self.start_upload_task(
+            file_id, file_path, file_size, file_name,
+            category1, category2, category3,
+            blender_version, render_engine,
+            image_path_list
+        )
+        return file_id
+
+    def resume_unfinished_tasks(self):
+        if not self.is_google_drive_ready():
+            print("Google Drive credential does not exist or is invalid, unfinished tasks are not resumed")
+            return
+        for file_id, file_name, file_path, \
+            category_list, image_path_list, \
+            blender_version, render_engine in self.db.list_unfinished_files():
+            if file_id in self.running_task_dict:
+                continue
+            if self.api_outbox.is_pending(file_id):
+                # only the API commit is left, the outbox already resends it
+                self.signals.resumed.emit(file_id, file_name)
+                continue
+            try:
+                file_size = os.path.getsize(file_path)
+            except OSError:
+                print(f"{file_path} is gone, {file_id} cannot be resumed")
+                self.set_file_status(file_id, "failed")
+                continue
+            stage_dict = self.db.list_task_stages(file_id)
+            print(f"Resuming {file_id} with completed stages: {', '.join(stage_dict) or 'none'}")
+            self.signals.resumed.emit(file_id, file_name)
+            self.progress_aggregator.update(file_id, 0, "Resuming")
+            self.start_upload_task(
+                file_id, file_path, file_size, file_name,
+                *category_list,
+                blender_version, render_engine,
+                image_path_list,
+                stage_dict
+            )
+
+    def start_upload_task(
+        self,
+        file_id: ULID,
+        file_path: str,
+        file_size: int,
+        file_name: str,
+        category1: str,
+        category2: str,
+        category3: str,
+        blender_version: str,
+        render_engine: str,
+        image_path_list: List[str],
+        stage_dict: Optional[Dict[str, dict]] = None
+    ):
+        stage_dict = stage_dict or {}
+        upload_waiter = UploadWaiterWorker(
+            file_id, file_name,
+            [category1, category2, category3],
+            blender_version, render_engine
+        )
+        upload_waiter_thread = QThread()
+        upload_waiter.moveToThread(upload_waiter_thread)
+        upload_waiter.signals.finished.connect(upload_waiter_thread.quit)
+        upload_waiter.signals.finished.connect(upload_waiter.deleteLater)
+
+        s3_upload_worker = S3UploadWorker(
+            file_id, file_path, file_name,
+            [category1, category2, category3],
+            blender_version, render_engine,
+            image_path_list,
+            self.content_index,
+            self.s3_upload_config,
+            self.db.get_upload_sessions(S3_BACKEND, file_path),
+            self.image_preprocessor,
+            stage_dict
+        )
+        s3_upload_worker.signals.upload_session.connect(self.db.save_upload_session)
+        s3_upload_worker.signals.stage.connect(self.save_task_stage)
+        s3_upload_worker.signals.span.connect(self.db.save_task_span)
+
+        upload_waiter.signals.progress_message.connect(self.update_progress)
+        upload_waiter.signals.finished.connect(lambda: self.progress_aggregator.flush(file_id))
+        upload_waiter.signals.finished.connect(lambda: self.release_task(file_id))
+        upload_waiter.signals.error.connect(lambda: self.set_file_status(file_id, "failed"))
+        upload_waiter.signals.retry.connect(self.handle_retry)
+
+        google_drive_upload_worker = GoogleDriveUploadWorker(
+            file_id, file_path, file_name,
+            [category1, category2, category3],
+            blender_version, render_engine,
+            image_path_list,
+            self.google_oauth_credentials,
+            self.google_drive_folder_resolver,
+            self.content_index,
+            self.google_drive_folder_config,
+            self.google_drive_upload_config,
+            self.db.get_upload_sessions(GOOGLE_DRIVE_BACKEND, file_path),
+            self.image_preprocessor,
+            stage_dict
+        )
+        google_drive_upload_worker.signals.upload_session.connect(self.db.save_upload_session)
+        google_drive_upload_worker.signals.stage.connect(self.save_task_stage)
+        google_drive_upload_worker.signals.span.connect(self.db.save_task_span)
+
+        upload_waiter.add_upload_worker("google_drive", google_drive_upload_worker)
+        upload_waiter.add_upload_worker("s3", s3_upload_worker)
+
+        upload_waiter_thread.start()
+
+        # images are processed while the model uploads
+        self.image_preprocessor.prefetch(image_path_list)
+        self.queue_google_drive_folder_prefetch([category1, category2, category3])
+        self.upload_scheduler.submit(S3_BACKEND, file_id, s3_upload_worker, file_size)
+        self.upload_scheduler.submit(GOOGLE_DRIVE_BACKEND, file_id, google_drive_upload_worker, file_size)
+
+        def handle_result(file_id: ULID, result_tuple: Tuple[Dict[str, tuple]]):
+            if API_COMMIT_STAGE in stage_dict:
+                # committed before the restart, only the status was lost
+                self.progress_aggregator.update(file_id, 100, "Finished")
+                self.progress_aggregator.flush(file_id)
+                self.set_file_status(file_id, "finished")
+                return
+            self.set_file_status(file_id, "running")
+            self.progress_aggregator.update(file_id, 99, "Committing to API")
+            result, = result_tuple
+            payload = create_api_payload(
+                file_name,
+                [category1, category2, category3],
+                blender_version, render_engine, result
+            )
+            self.db.save_api_outbox(file_id, payload)
+            self.api_outbox.put(file_id, payload)
+
+        upload_waiter.signals.result.connect(handle_result)
+        upload_waiter.signals.result.connect(self.db.set_uploaded_file_attributes)
+
+        self.running_task_dict[s3_upload_worker.file_id] = (
+            s3_upload_worker, google_drive_upload_worker,
+            upload_waiter, upload_waiter_thread
+        )
+
+    def release_task(self, file_id: ULID):
+        task = self.running_task_dict.pop(file_id, None)
+        # close() may have let the task go before its finished signal arrived
+        if task is None:
+            return
+        *_, upload_waiter_thread = task
+        # the thread may still be stopping, dropping the last reference to a
+        # running QThread aborts the process
+        upload_waiter_thread.quit()
+        upload_waiter_thread.wait()
+
+    def export_metrics(self, path: str, since: Optional[float] = None):
+        write_metrics(path, self.db.list_task_spans(since), since)
+
+    def close(self, timeout: float = CLOSE_TIMEOUT):
+        # running tasks stop at their next remote call, their rows keep their
+        # status and the tasks are resumed on the next start
+        for file_id in list(self.running_task_dict):
+            self.cancel_task(file_id)
+        if not self.upload_scheduler.threadpool.waitForDone(int(timeout * 1000)):
+            print(f"Upload workers still running after {timeout:.0f}s, closing anyway")
+        # the event loop is gone, the waiters are let go here instead of by
+        # their finished signal
+        for file_id in list(self.running_task_dict):
+            self.release_task(file_id)
+        shutdown_s3_transfer_engine()
+        shutdown_image_executors()
+        # a commit still in flight is sent again on the next start
+        self.api_outbox.stop(timeout=1)
+        if self.google_credential_manager is not None:
+            self.google_credential_manager.stop(timeout=1)
+        self.progress_aggregator.flush_all()
+        self.image_preprocessor.shutdown()
+        self.db.close()
+
+    def __init__(self):
+        super().__init__()
+        self.signals = UploadPipelineSignals()
+
+        self.init_db()
+        self.init_google_drive_folder_resolver()
+        self.init_google_drive_folder_prefetch()
+        self.init_content_index()
+        self.init_running_task_dict()
+        self.init_upload_scheduler()
+        self.init_image_preprocessor()
+        self.init_progress_aggregator()
+        self.init_api_outbox()
+        self.init_config()
+        self.init_metrics()
+        self.init_google_oauth_credentials()
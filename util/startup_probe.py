@@ -0,0 +1,41 @@
+import os
+import json
+import time
+from typing import Dict, Optional
+
+# set to a file path, the app records when each startup milestone is reached,
+# writes them there and quits, see benchmark/startup.py
+STARTUP_PROBE_ENV = 'UPLOADER_STARTUP_PROBE'
+MAIN_STARTED_MARK = 'main_started'
+WINDOW_SHOWN_MARK = 'window_shown'
+HISTORY_LOADED_MARK = 'history_loaded'
+GOOGLE_DRIVE_CHECKED_MARK = 'google_drive_checked'
+MARK_LIST = [MAIN_STARTED_MARK, WINDOW_SHOWN_MARK, HISTORY_LOADED_MARK, GOOGLE_DRIVE_CHECKED_MARK]
+
+
+class StartupProbe:
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.mark_dict: Dict[str, float] = {}
+
+    @property
+    def is_enabled(self) -> bool:
+        return bool(self.path)
+
+    def mark(self, name: str):
+        if self.is_enabled and name not in self.mark_dict:
+            self.mark_dict[name] = time.time()
+
+    def is_done(self) -> bool:
+        return self.is_enabled and all(x in self.mark_dict for x in MARK_LIST)
+
+    def write(self):
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump(self.mark_dict, f)
+
+
+_probe = StartupProbe(os.environ.get(STARTUP_PROBE_ENV))
+
+
+def get_startup_probe() -> StartupProbe:
+    return _probe
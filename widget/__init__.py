@@ -1,4 +1,7 @@
 from .file_select import FileSelectDialog, InvalidOrNotExistGoogleDriveCredentialMessageBox
-from .file_list import FileListWidgetItem, FileListWidget
+from .file_list import FileListWidget
 from .google_login import GoogleLoginMessageBox, GoogleLoginSignal
-from .google_drive_link import GoogleDriveLinkMessageBox
\ No newline at end of file
+from .google_drive_link import GoogleDriveLinkMessageBox
+from .bandwidth_limit import BandwidthLimitDialog
+from .bulk_ingest import BulkIngestDialog
+from .metrics_view import MetricsDialog
@@ -0,0 +1,117 @@
+import os
+import json
+import hashlib
+from threading import Lock
+from typing import Optional
+
+from PyQt6.QtCore import Qt, QObject, QRunnable, QSize, pyqtSignal, pyqtSlot
+from PyQt6.QtGui import QImage, QImageReader
+
+THUMBNAIL_HEIGHT = 200
+THUMBNAIL_CACHE_DIR = "thumbnail_cache"
+THUMBNAIL_CACHE_MAX_SIZE = 64 * 1024 * 1024
+
+
+class ThumbnailCache:
+    def __init__(self, cache_dir: str = THUMBNAIL_CACHE_DIR, max_size: int = THUMBNAIL_CACHE_MAX_SIZE):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.lock = Lock()
+
+    def get_cache_path(self, file_path: str, height: int) -> str:
+        file_stat = os.stat(file_path)
+        cache_key = json.dumps([os.path.abspath(file_path), file_stat.st_size, file_stat.st_mtime_ns, height])
+        return os.path.join(self.cache_dir, f'{hashlib.sha256(cache_key.encode()).hexdigest()}.png')
+
+    def load(self, file_path: str, height: int) -> Optional[QImage]:
+        cache_path = self.get_cache_path(file_path, height)
+        image = QImage(cache_path)
+        if image.isNull():
+            return None
+        # the mtime of an entry is its last use, eviction goes by it
+        try:
+            os.utime(cache_path)
+        except OSError:
+            pass
+        return image
+
+    def save(self, file_path: str, height: int, image: QImage):
+        cache_path = self.get_cache_path(file_path, height)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = f'{cache_path}.{id(image)}.tmp'
+        if not image.save(tmp_path, "PNG"):
+            return
+        os.replace(tmp_path, cache_path)
+        self.evict()
+
+    def evict(self):
+        with self.lock:
+            entry_list = []
+            for entry in os.scandir(self.cache_dir):
+                if entry.is_file() and entry.name.endswith('.png'):
+                    entry_stat = entry.stat()
+                    entry_list.append((entry_stat.st_mtime, entry_stat.st_size, entry.path))
+            total_size = sum(x[1] for x in entry_list)
+            for _, size, path in sorted(entry_list):
+                if total_size <= self.max_size:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total_size -= size
+
+
+_cache: Optional[ThumbnailCache] = None
+_cache_lock = Lock()
+
+
+def get_thumbnail_cache() -> ThumbnailCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ThumbnailCache()
+        return _cache
+
+
+class ThumbnailLoaderSignals(QObject):
+    # an image that could not be read comes back as a null QImage
+    loaded = pyqtSignal(QImage)
+
+
+class ThumbnailLoader(QRunnable):
+    def __init__(self, file_path: str, height: int = THUMBNAIL_HEIGHT):
+        super().__init__()
+        self.file_path = file_path
+        self.height = height
+        self.signals = ThumbnailLoaderSignals()
+
+    def read_scaled(self) -> QImage:
+        reader = QImageReader(self.file_path)
+        reader.setAutoTransform(True)
+        size = reader.size()
+        # decoders that support it (e.g. JPEG) never build the full size image
+        if size.isValid() and size.height() > self.height:
+            reader.setScaledSize(QSize(max(round(size.width() * self.height / size.height()), 1), self.height))
+        image = reader.read()
+        if not image.isNull() and image.height() != self.height:
+            image = image.scaledToHeight(self.height, Qt.TransformationMode.SmoothTransformation)
+        return image
+
+    @pyqtSlot()
+    def run(self):
+        cache = get_thumbnail_cache()
+        try:
+            image = cache.load(self.file_path, self.height)
+        except OSError as error:
+            print(f"Failed to load thumbnail of {self.file_path}: {error}")
+            self.signals.loaded.emit(QImage())
+            return
+        if image is None:
+            image = self.read_scaled()
+            if not image.isNull():
+                try:
+                    cache.save(self.file_path, self.height, image)
+                except OSError as error:
+                    print(f"Failed to cache thumbnail of {self.file_path}: {error}")
+        self.signals.loaded.emit(image)
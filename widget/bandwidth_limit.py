@@ -0,0 +1,94 @@
+from PyQt6.QtWidgets import (
+    QDialog, QDialogButtonBox, QVBoxLayout, QHBoxLayout,
+    QLabel, QSpinBox, QCheckBox, QTimeEdit, QWidget
+)
+from PyQt6.QtCore import QObject, QTime, pyqtSlot, pyqtSignal
+
+KIB = 1024
+MAX_LIMIT_KIB = 10 * 1024 * 1024
+
+
+class BandwidthLimitSignals(QObject):
+    config = pyqtSignal(dict)
+
+
+class BandwidthLimitDialog(QDialog):
+    def __init__(self, bandwidth_config: dict):
+        super().__init__()
+        bandwidth_config = bandwidth_config or {}
+
+        self.signals = BandwidthLimitSignals()
+
+        self.setWindowTitle("Upload Bandwidth Limit")
+        self.setMinimumWidth(360)
+        main_layout = QVBoxLayout()
+        main_layout.addWidget(QLabel("Upload limits in KiB/s, 0 means unlimited"))
+
+        def create_limit_spin_box(label: str, key: str) -> QSpinBox:
+            spin_box = QSpinBox()
+            spin_box.setRange(0, MAX_LIMIT_KIB)
+            spin_box.setSuffix(" KiB/s")
+            spin_box.setValue(bandwidth_config.get(key, 0) // KIB)
+            limit_layout = QHBoxLayout()
+            limit_layout.setContentsMargins(0, 0, 0, 0)
+            limit_layout.addWidget(QLabel(label))
+            limit_layout.addWidget(spin_box)
+            limit_widget = QWidget()
+            limit_widget.setLayout(limit_layout)
+            main_layout.addWidget(limit_widget)
+            return spin_box
+
+        self.limit_spin_box = create_limit_spin_box("Total", 'limit')
+        self.s3_limit_spin_box = create_limit_spin_box("R2", 's3_limit')
+        self.google_drive_limit_spin_box = create_limit_spin_box("Google Drive", 'google_drive_limit')
+
+        schedule_list = bandwidth_config.get('schedule', [])
+        off_peak_schedule = schedule_list[0] if schedule_list else {}
+
+        self.off_peak_check_box = QCheckBox("Unlimited between")
+        self.off_peak_check_box.setChecked(bool(off_peak_schedule))
+        self.off_peak_start_time_edit = QTimeEdit(
+            QTime.fromString(off_peak_schedule.get('start', '22:00'), 'HH:mm')
+        )
+        self.off_peak_start_time_edit.setDisplayFormat('HH:mm')
+        self.off_peak_end_time_edit = QTimeEdit(
+            QTime.fromString(off_peak_schedule.get('end', '07:00'), 'HH:mm')
+        )
+        self.off_peak_end_time_edit.setDisplayFormat('HH:mm')
+
+        off_peak_layout = QHBoxLayout()
+        off_peak_layout.setContentsMargins(0, 0, 0, 0)
+        off_peak_layout.addWidget(self.off_peak_check_box)
+        off_peak_layout.addWidget(self.off_peak_start_time_edit)
+        off_peak_layout.addWidget(QLabel("and"))
+        off_peak_layout.addWidget(self.off_peak_end_time_edit)
+        off_peak_widget = QWidget()
+        off_peak_widget.setLayout(off_peak_layout)
+        main_layout.addWidget(off_peak_widget)
+
+        button_box_flag = QDialogButtonBox.StandardButton.Ok | QDialogButtonBox.StandardButton.Cancel
+        self.button_box_widget = QDialogButtonBox(button_box_flag)
+        self.button_box_widget.accepted.connect(self.check_and_accept)
+        self.button_box_widget.rejected.connect(self.reject)
+        main_layout.addWidget(self.button_box_widget)
+
+        self.setLayout(main_layout)
+
+    @pyqtSlot()
+    def check_and_accept(self):
+        bandwidth_config = {
+            'limit': self.limit_spin_box.value() * KIB,
+            's3_limit': self.s3_limit_spin_box.value() * KIB,
+            'google_drive_limit': self.google_drive_limit_spin_box.value() * KIB,
+            'schedule': []
+        }
+        if self.off_peak_check_box.isChecked():
+            bandwidth_config['schedule'].append({
+                'start': self.off_peak_start_time_edit.time().toString('HH:mm'),
+                'end': self.off_peak_end_time_edit.time().toString('HH:mm'),
+                'limit': 0,
+                's3_limit': 0,
+                'google_drive_limit': 0
+            })
+        self.signals.config.emit(bandwidth_config)
+        self.accept()
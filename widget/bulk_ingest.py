@@ -0,0 +1,162 @@
+import csv
+from typing import Callable, Iterator, Optional
+
+from PyQt6.QtWidgets import (
+    QDialog, QFileDialog, QDialogButtonBox,
+    QVBoxLayout, QHBoxLayout, QComboBox,
+    QLabel, QPushButton, QLineEdit, QPlainTextEdit, QWidget
+)
+from PyQt6.QtCore import QTimer, pyqtSlot, QDir
+from ulid import ULID
+
+from util.manifest import iter_manifest_entries
+from util.catalog import BLENDER_VERSION_LIST, RENDER_ENGINE_LIST
+
+# entries handled per event loop turn, the dialog stays responsive on
+# manifests with thousands of rows
+INGEST_BATCH_SIZE = 10
+
+
+class BulkIngestDialog(QDialog):
+
+    # create_upload_task(filepath, file_name, category1, category2, category3,
+    # blender_version, render_engine, image_list) returns None for a row the
+    # pipeline did not queue
+    def __init__(self, create_upload_task: Callable[..., Optional[ULID]]):
+        super().__init__()
+        self.create_upload_task = create_upload_task
+        self.setMinimumWidth(600)
+        self.setWindowTitle("Bulk Upload")
+
+        self.entry_iterator: Optional[Iterator] = None
+        self.queued_count = 0
+        self.invalid_count = 0
+        self.ingest_timer = QTimer(self)
+        self.ingest_timer.setInterval(0)
+        self.ingest_timer.timeout.connect(self.ingest_batch)
+
+        main_layout = QVBoxLayout()
+
+        path_layout = QHBoxLayout()
+        path_layout.setContentsMargins(0, 0, 0, 0)
+        self.path_line_edit = QLineEdit()
+        self.path_line_edit.setReadOnly(True)
+        self.path_line_edit.setPlaceholderText("A folder of models or a CSV/JSONL manifest")
+        select_folder_button = QPushButton("Select Folder")
+        select_folder_button.clicked.connect(self.select_folder)
+        select_manifest_button = QPushButton("Select Manifest")
+        select_manifest_button.clicked.connect(self.select_manifest)
+        path_layout.addWidget(self.path_line_edit)
+        path_layout.addWidget(select_folder_button)
+        path_layout.addWidget(select_manifest_button)
+        path_widget = QWidget()
+        path_widget.setLayout(path_layout)
+        main_layout.addWidget(path_widget)
+
+        default_layout = QHBoxLayout()
+        default_layout.setContentsMargins(0, 0, 0, 0)
+        self.blender_version_drop_down = QComboBox()
+        self.blender_version_drop_down.addItems(BLENDER_VERSION_LIST)
+        self.render_engine_drop_down = QComboBox()
+        self.render_engine_drop_down.addItems(RENDER_ENGINE_LIST)
+        default_layout.addWidget(QLabel("Default Blender Version"))
+        default_layout.addWidget(self.blender_version_drop_down)
+        default_layout.addWidget(QLabel("Default Render Engine"))
+        default_layout.addWidget(self.render_engine_drop_down)
+        default_widget = QWidget()
+        default_widget.setLayout(default_layout)
+        main_layout.addWidget(default_widget)
+
+        self.status_label = QLabel("Rows without a version or engine use the defaults above")
+        main_layout.addWidget(self.status_label)
+
+        self.report_text_edit = QPlainTextEdit()
+        self.report_text_edit.setReadOnly(True)
+        self.report_text_edit.setPlaceholderText("Invalid rows are listed here")
+        main_layout.addWidget(self.report_text_edit)
+
+        self.button_box_widget = QDialogButtonBox(QDialogButtonBox.StandardButton.Close)
+        self.start_button = self.button_box_widget.addButton("Start", QDialogButtonBox.ButtonRole.ActionRole)
+        self.start_button.setEnabled(False)
+        self.start_button.clicked.connect(self.start_ingest)
+        self.button_box_widget.rejected.connect(self.reject)
+        main_layout.addWidget(self.button_box_widget)
+
+        self.setLayout(main_layout)
+
+    def set_path(self, path: str):
+        if not path:
+            return
+        self.path_line_edit.setText(QDir.toNativeSeparators(path))
+        self.start_button.setEnabled(self.entry_iterator is None)
+
+    @pyqtSlot()
+    def select_folder(self):
+        self.set_path(QFileDialog.getExistingDirectory(self, "Select Model Folder"))
+
+    @pyqtSlot()
+    def select_manifest(self):
+        manifest_path, _ = QFileDialog.getOpenFileName(
+            self, "Select Manifest", "", "Manifest (*.csv *.jsonl *.ndjson);;Any File (*)"
+        )
+        self.set_path(manifest_path)
+
+    @pyqtSlot()
+    def start_ingest(self):
+        self.queued_count = 0
+        self.invalid_count = 0
+        self.report_text_edit.clear()
+        self.entry_iterator = iter_manifest_entries(
+            self.path_line_edit.text(),
+            {
+                'blender_version': self.blender_version_drop_down.currentText(),
+                'render_engine': self.render_engine_drop_down.currentText()
+            }
+        )
+        self.start_button.setEnabled(False)
+        self.ingest_timer.start()
+
+    def finish_ingest(self, message: str):
+        self.ingest_timer.stop()
+        self.entry_iterator = None
+        self.start_button.setEnabled(True)
+        self.status_label.setText(message)
+
+    @pyqtSlot()
+    def ingest_batch(self):
+        try:
+            for _ in range(INGEST_BATCH_SIZE):
+                location, entry, error_list = next(self.entry_iterator)
+                if entry is None:
+                    self.invalid_count += 1
+                    self.report_text_edit.appendPlainText(f"{location}: {'; '.join(error_list)}")
+                    continue
+                file_id = self.create_upload_task(
+                    entry['file_path'],
+                    entry['file_name'],
+                    entry['category1'],
+                    entry['category2'],
+                    entry['category3'],
+                    entry['blender_version'],
+                    entry['render_engine'],
+                    entry['image_path_list']
+                )
+                # the pipeline refuses every row once the Google Drive login
+                # is gone, the rest of the batch is not tried
+                if file_id is None:
+                    self.finish_ingest(f"Stopped after {self.queued_count} queued: the Google Drive login is no longer valid")
+                    return
+                self.queued_count += 1
+        except StopIteration:
+            self.finish_ingest(f"Done: {self.queued_count} queued, {self.invalid_count} invalid")
+            return
+        except (OSError, ValueError, csv.Error) as error:
+            self.finish_ingest(f"Stopped after {self.queued_count} queued: {error}")
+            return
+        self.status_label.setText(f"Queued {self.queued_count}, invalid {self.invalid_count}...")
+
+    def reject(self):
+        # closing the dialog stops what is left of the batch, queued tasks keep going
+        self.ingest_timer.stop()
+        self.entry_iterator = None
+        super().reject()
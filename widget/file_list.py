@@ -1,15 +1,16 @@
 import math
+from typing import Callable, Dict, List, Optional, Tuple
 
 from PyQt6.QtWidgets import (
-    QListWidget, QHBoxLayout, QVBoxLayout,
-    QLabel, QWidget, QPushButton,
-    QListWidgetItem, QProgressBar,
-    QMessageBox
+    QListView, QMessageBox, QStyledItemDelegate,
+    QStyle, QStyleOptionViewItem, QStyleOptionProgressBar,
+    QStyleOptionButton, QApplication
 )
 from PyQt6.QtCore import (
-    Qt, pyqtSlot,
-    QObject, pyqtSignal
+    Qt, pyqtSlot, pyqtSignal,
+    QAbstractListModel, QModelIndex, QRect, QSize, QEvent
 )
+from PyQt6.QtGui import QColor, QPainter
 from ulid import ULID
 
 STATUS_TO_COLOR = {
@@ -19,6 +20,25 @@ STATUS_TO_COLOR = {
     'failed': 'red'
 }
 
+FILE_ID_ROLE = Qt.ItemDataRole.UserRole + 1
+STATUS_ROLE = Qt.ItemDataRole.UserRole + 2
+PROGRESS_ROLE = Qt.ItemDataRole.UserRole + 3
+MESSAGE_ROLE = Qt.ItemDataRole.UserRole + 4
+
+FETCH_PAGE_SIZE = 200
+ROW_HEIGHT = 56
+ROW_MARGIN = 8
+ROW_SPACING = 10
+PROGRESS_BAR_WIDTH = 150
+TOP_BUTTON_WIDTH = 40
+DELETE_BUTTON_WIDTH = 60
+
+# (file_id, name, status, progress, message)
+FileRow = List
+# fetch_page(before_file_id, limit) -> rows, newest first
+FetchPage = Callable[[Optional[ULID], int], List[Tuple[ULID, str, str, int, str]]]
+
+
 class FileListWidgetDeleteMessageBox(QMessageBox):
     def __init__(self):
         super().__init__()
@@ -27,89 +47,233 @@ class FileListWidgetDeleteMessageBox(QMessageBox):
         self.setStandardButtons(QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No)
         self.setDefaultButton(QMessageBox.StandardButton.No)
 
-class FileListWidgetItemSignals(QObject):
+
+class FileListModel(QAbstractListModel):
+    def __init__(self, fetch_page: FetchPage):
+        super().__init__()
+        self.fetch_page = fetch_page
+        # rows added in this session are kept apart so adding one on top
+        # does not shift the index of every fetched row
+        self.new_row_list: List[FileRow] = []
+        self.fetched_row_list: List[FileRow] = []
+        self.row_index_dict: Dict[ULID, Tuple[bool, int]] = {}
+        # the last row read from the database, pages go on from it even when
+        # every row of one was already listed or a row was removed since
+        self.fetch_cursor: Optional[ULID] = None
+        self.is_exhausted = False
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        if parent.isValid():
+            return 0
+        return len(self.new_row_list) + len(self.fetched_row_list)
+
+    def get_row(self, row: int) -> FileRow:
+        new_row_count = len(self.new_row_list)
+        if row < new_row_count:
+            return self.new_row_list[new_row_count - 1 - row]
+        return self.fetched_row_list[row - new_row_count]
+
+    def find_row(self, file_id: ULID) -> int:
+        position = self.row_index_dict.get(file_id)
+        if position is None:
+            return -1
+        is_new, i = position
+        if is_new:
+            return len(self.new_row_list) - 1 - i
+        return len(self.new_row_list) + i
+
+    def data(self, index: QModelIndex, role: int = Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        file_id, name, status, progress, message = self.get_row(index.row())
+        if role == Qt.ItemDataRole.DisplayRole:
+            return name
+        if role == FILE_ID_ROLE:
+            return file_id
+        if role == STATUS_ROLE:
+            return status
+        if role == PROGRESS_ROLE:
+            return progress
+        if role == MESSAGE_ROLE:
+            return message
+        return None
+
+    def canFetchMore(self, parent: QModelIndex = QModelIndex()) -> bool:
+        return not parent.isValid() and not self.is_exhausted
+
+    def fetchMore(self, parent: QModelIndex = QModelIndex()):
+        if parent.isValid() or self.is_exhausted:
+            return
+        raw_page = self.fetch_page(self.fetch_cursor, FETCH_PAGE_SIZE)
+        # a short page is the end, rows added in this session are filtered
+        # out below and would end the list early
+        if len(raw_page) < FETCH_PAGE_SIZE:
+            self.is_exhausted = True
+        if raw_page:
+            self.fetch_cursor = raw_page[-1][0]
+        page = [
+            [file_id, name, status, progress, message]
+            for file_id, name, status, progress, message in raw_page
+            if file_id not in self.row_index_dict
+        ]
+        if not page:
+            return
+        first_row = self.rowCount()
+        self.beginInsertRows(QModelIndex(), first_row, first_row + len(page) - 1)
+        for row in page:
+            self.row_index_dict[row[0]] = (False, len(self.fetched_row_list))
+            self.fetched_row_list.append(row)
+        self.endInsertRows()
+
+    def add_file(self, file_id: ULID, name: str, status: str = 'pending', progress: int = 0, message: str = "Pending"):
+        self.beginInsertRows(QModelIndex(), 0, 0)
+        self.row_index_dict[file_id] = (True, len(self.new_row_list))
+        self.new_row_list.append([file_id, name, status, progress, message])
+        self.endInsertRows()
+
+    def remove_file(self, file_id: ULID):
+        row = self.find_row(file_id)
+        if row < 0:
+            return
+        is_new, i = self.row_index_dict.pop(file_id)
+        row_list = self.new_row_list if is_new else self.fetched_row_list
+        self.beginRemoveRows(QModelIndex(), row, row)
+        del row_list[i]
+        # only the rows after the removed one move
+        for j in range(i, len(row_list)):
+            self.row_index_dict[row_list[j][0]] = (is_new, j)
+        self.endRemoveRows()
+
+    def update_file(self, file_id: ULID, **kwargs):
+        row = self.find_row(file_id)
+        if row < 0:
+            # not fetched yet, it will be read from the database when it is
+            return
+        file_row = self.get_row(row)
+        for column, key in enumerate(('file_id', 'name', 'status', 'progress', 'message')):
+            if key in kwargs:
+                file_row[column] = kwargs[key]
+        index = self.index(row)
+        self.dataChanged.emit(index, index)
+
+
+class FileListItemDelegate(QStyledItemDelegate):
+
+    delete_requested = pyqtSignal(ULID)
+    prioritized = pyqtSignal(ULID)
+
+    def sizeHint(self, option: QStyleOptionViewItem, index: QModelIndex) -> QSize:
+        return QSize(option.rect.width(), ROW_HEIGHT)
+
+    def layout_rects(self, rect: QRect) -> Tuple[QRect, QRect, QRect, QRect]:
+        rect = rect.adjusted(ROW_MARGIN, ROW_MARGIN, -ROW_MARGIN, -ROW_MARGIN)
+        delete_rect = QRect(rect.right() - DELETE_BUTTON_WIDTH + 1, rect.top(), DELETE_BUTTON_WIDTH, rect.height())
+        top_rect = QRect(delete_rect.left() - ROW_SPACING - TOP_BUTTON_WIDTH, rect.top(), TOP_BUTTON_WIDTH, rect.height())
+        progress_rect = QRect(top_rect.left() - ROW_SPACING - PROGRESS_BAR_WIDTH, rect.top(), PROGRESS_BAR_WIDTH, rect.height())
+        text_rect = QRect(rect.left(), rect.top(), progress_rect.left() - ROW_SPACING - rect.left(), rect.height())
+        return text_rect, progress_rect, top_rect, delete_rect
+
+    def paint(self, painter: QPainter, option: QStyleOptionViewItem, index: QModelIndex):
+        style = option.widget.style() if option.widget else QApplication.style()
+        painter.save()
+        style.drawPrimitive(QStyle.PrimitiveElement.PE_PanelItemViewItem, option, painter, option.widget)
+
+        text_rect, progress_rect, top_rect, delete_rect = self.layout_rects(option.rect)
+        status = index.data(STATUS_ROLE)
+        progress = math.ceil(index.data(PROGRESS_ROLE) or 0)
+
+        name_rect = QRect(text_rect.left(), text_rect.top(), text_rect.width(), text_rect.height() // 2)
+        message_rect = QRect(text_rect.left(), name_rect.bottom(), text_rect.width(), text_rect.height() - name_rect.height())
+        font_metrics = option.fontMetrics
+        painter.drawText(
+            name_rect,
+            Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignVCenter,
+            font_metrics.elidedText(index.data(Qt.ItemDataRole.DisplayRole), Qt.TextElideMode.ElideRight, name_rect.width())
+        )
+        message_font = option.font
+        message_font.setItalic(True)
+        painter.setFont(message_font)
+        painter.setPen(QColor(STATUS_TO_COLOR.get(status, 'gray')))
+        painter.drawText(
+            message_rect,
+            Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignVCenter,
+            font_metrics.elidedText(index.data(MESSAGE_ROLE), Qt.TextElideMode.ElideRight, message_rect.width())
+        )
+        painter.restore()
+
+        progress_option = QStyleOptionProgressBar()
+        progress_option.rect = progress_rect
+        progress_option.state = QStyle.StateFlag.State_Enabled | QStyle.StateFlag.State_Horizontal
+        progress_option.minimum = 0
+        progress_option.maximum = 100
+        progress_option.progress = progress
+        progress_option.text = f'{progress}%'
+        progress_option.textVisible = True
+        style.drawControl(QStyle.ControlElement.CE_ProgressBar, progress_option, painter, option.widget)
+
+        button_list = [(delete_rect, "Delete")]
+        if status != 'finished':
+            button_list.append((top_rect, "Top"))
+        for button_rect, button_text in button_list:
+            button_option = QStyleOptionButton()
+            button_option.rect = button_rect
+            button_option.text = button_text
+            button_option.state = QStyle.StateFlag.State_Enabled | QStyle.StateFlag.State_Raised
+            style.drawControl(QStyle.ControlElement.CE_PushButton, button_option, painter, option.widget)
+
+    def editorEvent(self, event: QEvent, model: FileListModel, option: QStyleOptionViewItem, index: QModelIndex) -> bool:
+        if event.type() != QEvent.Type.MouseButtonRelease or event.button() != Qt.MouseButton.LeftButton:
+            return super().editorEvent(event, model, option, index)
+
+        _, _, top_rect, delete_rect = self.layout_rects(option.rect)
+        position = event.position().toPoint()
+        file_id = index.data(FILE_ID_ROLE)
+        if delete_rect.contains(position):
+            self.delete_requested.emit(file_id)
+            return True
+        if top_rect.contains(position) and index.data(STATUS_ROLE) != 'finished':
+            self.prioritized.emit(file_id)
+            return True
+        return super().editorEvent(event, model, option, index)
+
+
+class FileListWidget(QListView):
+
     deleted = pyqtSignal(ULID)
+    prioritized = pyqtSignal(ULID)
 
-class FileListWidgetItem(QWidget):
-    
-    def __init__(
-        self,
-        file_id: ULID,
-        name: str,
-        status: str = 'pending',
-        progress: int = 0,
-        message: str = "Pending"
-    ):
+    def __init__(self, fetch_page: FetchPage):
         super().__init__()
-        
-        self.file_id = file_id
-        self.signals = FileListWidgetItemSignals()
-
-        item_layout = QHBoxLayout()
-        item_layout.setSpacing(10)
-        
-        name_and_status_layout = QVBoxLayout()
-        name_and_status_layout.setContentsMargins(0, 0, 0, 0)
-        name_and_status_layout.setSpacing(0)
-        self.task_name_label = QLabel(name)
-        status_color = STATUS_TO_COLOR.get(status, 'gray')
-        self.task_status_label = QLabel(f'<span style="color:{status_color}"><i>{message}</i></span>')
-        name_and_status_layout.addWidget(self.task_name_label)
-        name_and_status_layout.addWidget(self.task_status_label)
-        self.name_and_status_widget = QWidget()
-        self.name_and_status_widget.setLayout(name_and_status_layout)
-        item_layout.addWidget(self.name_and_status_widget)
-        
-        self.task_progress_bar = QProgressBar()
-        self.task_progress_bar.setFixedWidth(150)
-        self.task_progress_bar.setValue(progress)
-        item_layout.addWidget(self.task_progress_bar)
-        
-        self.task_delete_button = QPushButton("Delete")
-        self.task_delete_button.clicked.connect(self.delete_item)
-        self.task_delete_button.setFixedWidth(60)
-        item_layout.addWidget(self.task_delete_button)
-        
-        self.setLayout(item_layout)
-
-    @pyqtSlot()
-    def confirm_delete(self):
-        self.signals.deleted.emit(self.file_id)
-        self.deleteLater()
-
-    @pyqtSlot()
-    def delete_item(self):
+
+        self.setVerticalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAsNeeded)
+        self.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
+        self.setUniformItemSizes(True)
+        self.setSelectionMode(QListView.SelectionMode.NoSelection)
+
+        self.file_list_model = FileListModel(fetch_page)
+        self.setModel(self.file_list_model)
+        self.item_delegate = FileListItemDelegate(self)
+        self.item_delegate.delete_requested.connect(self.delete_item)
+        self.item_delegate.prioritized.connect(self.prioritized.emit)
+        self.setItemDelegate(self.item_delegate)
+
+    def add_file(self, file_id: ULID, name: str):
+        self.file_list_model.add_file(file_id, name)
+
+    @pyqtSlot(ULID)
+    def delete_item(self, file_id: ULID):
         msg_box = FileListWidgetDeleteMessageBox()
-        msg_box.accepted.connect(self.confirm_delete)
+        msg_box.accepted.connect(lambda: self.confirm_delete(file_id))
         msg_box.exec()
-        
+
+    def confirm_delete(self, file_id: ULID):
+        self.file_list_model.remove_file(file_id)
+        self.deleted.emit(file_id)
+
     @pyqtSlot(ULID, float, str)
-    def set_progress_message(self, file_id: ULID, progress: float, status: str):
-        self.task_progress_bar.setValue(math.ceil(progress))
-        self.task_status_label.setText(f'<i>{status}</i>')
+    def set_progress_message(self, file_id: ULID, progress: float, message: str):
+        self.file_list_model.update_file(file_id, progress=progress, message=message)
 
     @pyqtSlot(ULID, str)
     def set_status(self, file_id: ULID, status: str):
-        status_color = STATUS_TO_COLOR.get(status, 'gray')
-        self.task_status_label.setText(f'<span style="color:{status_color}"><i>{status}</i></span>')
-
-    
-class FileListWidget(QListWidget):
-    def __init__(self):
-        super().__init__()
-        
-        self.setVerticalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
-        self.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
-
-    def update_items(self, item_list: list[FileListWidgetItem]):
-        self.clear()
-        for item in item_list:
-            self.add_item(item)
-    
-    def add_item(self, widget_item: FileListWidgetItem):
-        item = QListWidgetItem()
-        item.setSizeHint(widget_item.sizeHint())
-        self.insertItem(0, item)
-        self.setItemWidget(item, widget_item)
-        
-        widget_item.signals.deleted.connect(lambda _: self.takeItem(self.row(item)))
\ No newline at end of file
+        self.file_list_model.update_file(file_id, status=status)
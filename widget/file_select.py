@@ -7,12 +7,13 @@ from PyQt6.QtWidgets import (
     QLabel, QPushButton, QLineEdit, QScrollArea, QWidget
 )
 
-from PyQt6.QtGui import QPixmap
-from PyQt6.QtCore import Qt, pyqtSlot, pyqtSignal, QDir
+from PyQt6.QtGui import QPixmap, QImage
+from PyQt6.QtCore import Qt, pyqtSlot, pyqtSignal, QDir, QThreadPool
 
 from ulid import ULID
 
-from ._file_select_const import BLENDER_VERSION_LIST, RENDER_ENGINE_LIST, CATEGORY_DICTIONARY
+from util.catalog import BLENDER_VERSION_LIST, RENDER_ENGINE_LIST, CATEGORY_DICTIONARY
+from ._thumbnail import ThumbnailLoader, THUMBNAIL_HEIGHT
 
 class TooManyImageMessageBox(QMessageBox):
     def __init__(self):
@@ -52,14 +53,17 @@ class ImageItemWidget(QWidget):
         self.file_path = QDir.toNativeSeparators(file_path)
         name = os.path.basename(file_path)
         self.image_id = str(ULID())
+        self.is_deleted = False
 
-        imagePixmap = QPixmap(file_path).scaledToHeight(200, Qt.TransformationMode.SmoothTransformation)
-        imageWidth = imagePixmap.width()
+        # a placeholder tile until the thumbnail is decoded off the GUI thread
+        imageWidth = THUMBNAIL_HEIGHT
         
         self.setFixedHeight(250)
         self.setFixedWidth(imageWidth + 40)
-        self.image = QLabel()
-        self.image.setPixmap(imagePixmap)
+        self.image = QLabel("Loading...")
+        self.image.setFixedSize(imageWidth, THUMBNAIL_HEIGHT)
+        self.image.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        self.image.setStyleSheet("background-color: #303030; color: gray")
 
         self.item_layout.addWidget(self.image)
 
@@ -79,8 +83,27 @@ class ImageItemWidget(QWidget):
         self.item_layout.addLayout(self.image_name_and_btn_layout)
         self.setLayout(self.item_layout)
 
+        thumbnail_loader = ThumbnailLoader(file_path)
+        thumbnail_loader.signals.loaded.connect(self.set_thumbnail)
+        QThreadPool.globalInstance().start(thumbnail_loader)
+
+    @pyqtSlot(QImage)
+    def set_thumbnail(self, image: QImage):
+        if self.is_deleted:
+            return
+        if image.isNull():
+            self.image.setText("No preview")
+            return
+        imageWidth = image.width()
+        self.image.setStyleSheet("")
+        self.image.setFixedSize(imageWidth, image.height())
+        self.image.setPixmap(QPixmap.fromImage(image))
+        self.setFixedWidth(imageWidth + 40)
+        self.image_name.setFixedWidth(imageWidth - 60)
+
     @pyqtSlot()
     def delete_image(self):
+        self.is_deleted = True
         self.image.deleteLater()
         self.image_name_and_btn_layout.deleteLater()
         self.image_name.deleteLater()
@@ -1,4 +1,5 @@
 import urllib.parse
+from typing import TYPE_CHECKING
 
 from PyQt6.QtWidgets import (
     QDialog, QDialogButtonBox,
@@ -7,10 +8,10 @@ from PyQt6.QtWidgets import (
 )
 from PyQt6.QtCore import QObject, pyqtSlot, pyqtSignal
 
-from googleapiclient.errors import HttpError
-from googleapiclient.discovery import build
+from worker import get_google_service
 
-from google.oauth2.credentials import Credentials
+if TYPE_CHECKING:
+    from google.oauth2.credentials import Credentials
 
 class GoogleDriveLinkSignals(QObject):
     error = pyqtSignal(tuple)
@@ -38,11 +39,11 @@ class GoogleDriveLinkPermissionDeniedMessageBox(QMessageBox):
         self.setStandardButtons(QMessageBox.StandardButton.Ok)
 
 class GoogleDriveLinkMessageBox(QDialog):
-    def __init__(self, credentials: Credentials):
+    def __init__(self, credentials: 'Credentials'):
         super().__init__()
         
         self.credentials = credentials
-        self.drive_service = build('drive', 'v3', credentials=self.credentials)
+        self.drive_service = get_google_service('drive', 'v3', self.credentials)
 
         self.setMinimumWidth(300)
         
@@ -69,6 +70,7 @@ class GoogleDriveLinkMessageBox(QDialog):
 
     @pyqtSlot()
     def check_and_accept(self):
+        from googleapiclient.errors import HttpError
         drive_link = self.sheet_link.text()
         if not drive_link:
             print("No link")
@@ -105,7 +107,7 @@ class GoogleDriveLinkMessageBox(QDialog):
                 InvalidGoogleDriveLinkMessageBox().exec()
                 return
             
-            user_info_service = build('oauth2', 'v2', credentials=self.credentials)
+            user_info_service = get_google_service('oauth2', 'v2', self.credentials)
             user_info = user_info_service.userinfo().get().execute()
             user_email = user_info.get("email")
             for permission in permissions:
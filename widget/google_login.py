@@ -4,7 +4,6 @@ import json
 
 from PyQt6.QtWidgets import QMessageBox
 from PyQt6.QtCore import pyqtSlot, QThread, pyqtSignal, QObject, QDeadlineTimer
-from google_auth_oauthlib.flow import InstalledAppFlow
 
 CLIENT_CONFIG = {}
 
@@ -24,6 +23,8 @@ class GoogleLoginWorkerSignals(QObject):
 class GoogleLoginWorker(QObject):
     def __init__(self):
         super().__init__()
+        # only needed to log in, not worth importing at every start
+        from google_auth_oauthlib.flow import InstalledAppFlow
         self.signals = GoogleLoginWorkerSignals()
         self.flow = InstalledAppFlow.from_client_config(CLIENT_CONFIG, SCOPES)
 
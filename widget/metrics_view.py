@@ -0,0 +1,121 @@
+import time
+from typing import Callable, List, Optional
+
+from PyQt6.QtWidgets import (
+    QDialog, QFileDialog, QVBoxLayout, QHBoxLayout,
+    QComboBox, QLabel, QPushButton, QWidget,
+    QTableWidget, QTableWidgetItem, QHeaderView
+)
+from PyQt6.QtCore import Qt, pyqtSlot
+
+from util.metrics import (
+    Span, summarize_spans, write_metrics,
+    ALL_STAGE, PROMETHEUS_EXTENSION, JSON_EXTENSION
+)
+
+MIB = 1024 * 1024
+# (label, seconds back from now), None covers every retained span
+WINDOW_LIST = [
+    ("Last hour", 3600),
+    ("Last 24 hours", 24 * 3600),
+    ("Last 7 days", 7 * 24 * 3600),
+    ("All", None)
+]
+COLUMN_LIST = [
+    "Backend", "Stage", "Count", "Errors", "Retries",
+    "MiB", "MiB/s", "p50", "p95", "p99", "Max"
+]
+
+
+def format_seconds(value: Optional[float]) -> str:
+    return '-' if value is None else f"{value:.1f}s"
+
+
+class MetricsDialog(QDialog):
+    def __init__(self, list_task_spans: Callable[[Optional[float]], List[Span]], backend_label_dict: dict):
+        super().__init__()
+        self.list_task_spans = list_task_spans
+        self.backend_label_dict = backend_label_dict
+
+        self.setWindowTitle("Upload Stats")
+        self.setMinimumSize(820, 360)
+        main_layout = QVBoxLayout()
+
+        control_layout = QHBoxLayout()
+        control_layout.setContentsMargins(0, 0, 0, 0)
+        self.window_drop_down = QComboBox()
+        for label, _ in WINDOW_LIST:
+            self.window_drop_down.addItem(label)
+        self.window_drop_down.setCurrentIndex(1)
+        self.window_drop_down.currentIndexChanged.connect(self.refresh)
+        # every span of the window is read and summarized on the GUI thread,
+        # that only happens when the user asks for it
+        refresh_button = QPushButton("Refresh")
+        refresh_button.clicked.connect(self.refresh)
+        export_prometheus_button = QPushButton("Export Prometheus")
+        export_prometheus_button.clicked.connect(lambda: self.export("Prometheus text (*.prom)", PROMETHEUS_EXTENSION))
+        export_json_button = QPushButton("Export JSON")
+        export_json_button.clicked.connect(lambda: self.export("JSON (*.json)", JSON_EXTENSION))
+        control_layout.addWidget(QLabel("Window"))
+        control_layout.addWidget(self.window_drop_down)
+        control_layout.addWidget(refresh_button)
+        control_layout.addStretch()
+        control_layout.addWidget(export_prometheus_button)
+        control_layout.addWidget(export_json_button)
+        control_widget = QWidget()
+        control_widget.setLayout(control_layout)
+        main_layout.addWidget(control_widget)
+
+        self.table = QTableWidget(0, len(COLUMN_LIST))
+        self.table.setHorizontalHeaderLabels(COLUMN_LIST)
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.ResizeToContents)
+        self.table.verticalHeader().setVisible(False)
+        self.table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+        main_layout.addWidget(self.table)
+
+        main_layout.addWidget(QLabel(
+            f'Durations are per stage, "{ALL_STAGE}" is a whole task on the backend. '
+            "MiB/s only counts time spent in the stage."
+        ))
+        self.setLayout(main_layout)
+
+        self.refresh()
+
+    def get_since(self) -> Optional[float]:
+        _, seconds = WINDOW_LIST[self.window_drop_down.currentIndex()]
+        return None if seconds is None else time.time() - seconds
+
+    @pyqtSlot()
+    def refresh(self):
+        summary_list = summarize_spans(self.list_task_spans(self.get_since()))
+        self.table.setRowCount(len(summary_list))
+        for row, summary in enumerate(summary_list):
+            quantile_dict = summary['duration_quantile_dict']
+            throughput = summary['throughput']
+            value_list = [
+                self.backend_label_dict.get(summary['backend'], summary['backend']),
+                summary['stage'],
+                str(summary['count']),
+                str(summary['error_count']),
+                str(summary['retry_count']),
+                f"{summary['byte_count'] / MIB:.1f}",
+                '-' if throughput is None else f"{throughput / MIB:.2f}",
+                format_seconds(quantile_dict['0.5']),
+                format_seconds(quantile_dict['0.95']),
+                format_seconds(quantile_dict['0.99']),
+                format_seconds(summary['duration_max'])
+            ]
+            for column, value in enumerate(value_list):
+                item = QTableWidgetItem(value)
+                if column > 1:
+                    item.setTextAlignment(Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter)
+                self.table.setItem(row, column, item)
+
+    def export(self, file_filter: str, extension: str):
+        path, _ = QFileDialog.getSaveFileName(self, "Export Stats", f"uploader-metrics{extension}", file_filter)
+        if not path:
+            return
+        if not path.lower().endswith(extension):
+            path += extension
+        since = self.get_since()
+        write_metrics(path, self.list_task_spans(since), since)
@@ -1,4 +1,15 @@
-from .google_drive_upload import GoogleDriveUploadWorker
-from .s3_upload import S3UploadWorker
+from .google_drive_upload import GoogleDriveUploadWorker, GOOGLE_DRIVE_BACKEND
+from .s3_upload import S3UploadWorker, S3_BACKEND
 from .upload_waiter import UploadWaiterWorker
-from .api_update import APIUpdateWorker
\ No newline at end of file
+from .api_update import APIOutbox, API_COMMIT_STAGE, API_BACKEND
+from ._google_drive_folder import GoogleDriveFolderResolver, GoogleDriveFolderPrefetcher
+from ._s3_transfer import configure_s3_transfer_engine, shutdown_s3_transfer_engine
+from ._google_service import get_google_service
+from .upload_scheduler import UploadScheduler
+from ._bandwidth import configure_bandwidth_limiter
+from .progress_aggregator import ProgressAggregator
+from ._content_index import ContentIndex
+from ._image_preprocess import ImagePreprocessor
+from ._retry import configure_retry, TaskCancelledError
+from ._upload_base import SPAN_OK, SPAN_ERROR, shutdown_image_executors
+from ._google_credentials import GoogleCredentialsLoader, create_google_credentials, create_google_credential_manager
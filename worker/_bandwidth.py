@@ -0,0 +1,139 @@
+import io
+import time
+import datetime
+from threading import Event, Lock
+from typing import Dict, List, Optional
+
+from ._retry import TaskCancelledError
+
+# seconds of traffic a bucket may send in one go after being idle
+BURST_SECONDS = 1.0
+SCHEDULE_CHECK_INTERVAL = 30
+LIMIT_KEY_LIST = ['limit', 's3_limit', 'google_drive_limit']
+
+
+class TokenBucket:
+    def __init__(self, rate: float = 0):
+        self.lock = Lock()
+        self.rate = 0.0
+        self.tokens = 0.0
+        self.updated_at = time.monotonic()
+        self.set_rate(rate)
+
+    def set_rate(self, rate: float):
+        with self.lock:
+            self.rate = max(float(rate or 0), 0.0)
+            self.tokens = min(self.tokens, self.rate * BURST_SECONDS)
+            self.updated_at = time.monotonic()
+
+    def consume(self, size: int, cancel_event: Optional[Event] = None):
+        with self.lock:
+            if not self.rate:
+                return
+            now = time.monotonic()
+            self.tokens = min(
+                self.tokens + (now - self.updated_at) * self.rate,
+                self.rate * BURST_SECONDS
+            )
+            self.updated_at = now
+            # going into debt lets every caller take its turn, the sleep
+            # pays the debt back at the configured rate
+            self.tokens -= size
+            wait_time = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait_time and cancel_event:
+            cancel_event.wait(wait_time)
+        elif wait_time:
+            time.sleep(wait_time)
+
+
+def _parse_time(value: str) -> datetime.time:
+    hour, minute = value.split(':')
+    return datetime.time(int(hour), int(minute))
+
+
+def _is_time_in_window(now: datetime.time, start: datetime.time, end: datetime.time) -> bool:
+    if start <= end:
+        return start <= now < end
+    # windows such as 22:00-07:00 wrap around midnight
+    return now >= start or now < end
+
+
+class BandwidthLimiter:
+    def __init__(self, bandwidth_config: Optional[dict] = None):
+        self.lock = Lock()
+        self.bandwidth_config = {}
+        self.bucket = TokenBucket()
+        self.backend_bucket_dict: Dict[str, TokenBucket] = {
+            's3': TokenBucket(),
+            'google_drive': TokenBucket()
+        }
+        self.next_schedule_check = 0.0
+        self.configure(bandwidth_config or {})
+
+    def configure(self, bandwidth_config: dict):
+        with self.lock:
+            self.bandwidth_config = dict(bandwidth_config)
+            self.next_schedule_check = 0.0
+        self.apply_schedule()
+
+    def get_active_limit_dict(self, now: Optional[datetime.time] = None) -> dict:
+        now = now or datetime.datetime.now().time()
+        limit_dict = {x: self.bandwidth_config.get(x, 0) for x in LIMIT_KEY_LIST}
+        schedule_list: List[dict] = self.bandwidth_config.get('schedule', [])
+        for schedule in schedule_list:
+            if _is_time_in_window(now, _parse_time(schedule['start']), _parse_time(schedule['end'])):
+                limit_dict.update({x: schedule[x] for x in LIMIT_KEY_LIST if x in schedule})
+                break
+        return limit_dict
+
+    def apply_schedule(self):
+        with self.lock:
+            if time.monotonic() < self.next_schedule_check:
+                return
+            self.next_schedule_check = time.monotonic() + SCHEDULE_CHECK_INTERVAL
+            limit_dict = self.get_active_limit_dict()
+        self.bucket.set_rate(limit_dict['limit'])
+        self.backend_bucket_dict['s3'].set_rate(limit_dict['s3_limit'])
+        self.backend_bucket_dict['google_drive'].set_rate(limit_dict['google_drive_limit'])
+
+    def throttle(self, backend: str, size: int, cancel_event: Optional[Event] = None):
+        if size <= 0:
+            return
+        self.apply_schedule()
+        backend_bucket = self.backend_bucket_dict.get(backend)
+        if backend_bucket:
+            backend_bucket.consume(size, cancel_event)
+        self.bucket.consume(size, cancel_event)
+        # a cancelled transfer stops at its next read instead of paying its
+        # debt back first
+        if cancel_event and cancel_event.is_set():
+            raise TaskCancelledError(f"{backend} transfer was cancelled")
+
+
+class ThrottledBody(io.BytesIO):
+    def __init__(self, data: bytes, limiter: BandwidthLimiter, backend: str, cancel_event: Optional[Event] = None):
+        super().__init__(data)
+        self.limiter = limiter
+        self.backend = backend
+        self.cancel_event = cancel_event
+
+    def read(self, size: int = -1) -> bytes:
+        data = super().read(size)
+        self.limiter.throttle(self.backend, len(data), self.cancel_event)
+        return data
+
+
+_limiter: Optional[BandwidthLimiter] = None
+_limiter_lock = Lock()
+
+
+def get_bandwidth_limiter() -> BandwidthLimiter:
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = BandwidthLimiter()
+        return _limiter
+
+
+def configure_bandwidth_limiter(bandwidth_config: dict):
+    get_bandwidth_limiter().configure(bandwidth_config or {})
@@ -0,0 +1,64 @@
+import re
+import base64
+import hashlib
+from typing import List, Optional
+
+MULTIPART_ETAG_REGEX = re.compile(r'^"?([0-9a-f]{32})-(\d+)"?$')
+MD5_ETAG_REGEX = re.compile(r'^"?([0-9a-f]{32})"?$')
+
+
+class ChecksumMismatchError(Exception):
+    pass
+
+
+def content_md5(digest: bytes) -> str:
+    return base64.b64encode(digest).decode()
+
+
+def parse_md5_etag(etag: str) -> bytes:
+    match = MD5_ETAG_REGEX.match(etag or '')
+    return bytes.fromhex(match.group(1)) if match else None
+
+
+def get_multipart_etag(part_digest_list: List[bytes]) -> Optional[str]:
+    # S3 style multipart ETags are the MD5 of the part MD5s
+    if None in part_digest_list:
+        return None
+    return f'{hashlib.md5(b"".join(part_digest_list)).hexdigest()}-{len(part_digest_list)}'
+
+
+def is_multipart_etag_of(etag: str, part_digest_list: List[bytes]) -> bool:
+    expected = get_multipart_etag(part_digest_list)
+    return expected is not None and (etag or '').strip('"') == expected
+
+
+def verify_multipart_etag(etag: str, part_digest_list: List[bytes]):
+    # anything but an S3 style multipart ETag (e.g. of an encrypted object)
+    # cannot be checked this way
+    expected = get_multipart_etag(part_digest_list)
+    if not MULTIPART_ETAG_REGEX.match(etag or '') or expected is None:
+        return
+    if etag.strip('"') != expected:
+        raise ChecksumMismatchError(f"Multipart ETag {etag} does not match the uploaded parts ({expected})")
+
+
+class HashingStream:
+    def __init__(self, stream, digest):
+        self.stream = stream
+        self.digest = digest
+        self.hashed_size = 0
+
+    def seek(self, offset: int, whence: int = 0):
+        return self.stream.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self.stream.tell()
+
+    def read(self, size: int = -1) -> bytes:
+        position = self.stream.tell()
+        data = self.stream.read(size)
+        # a chunk sent again after an error is not hashed twice
+        if position == self.hashed_size:
+            self.digest.update(data)
+            self.hashed_size += len(data)
+        return data
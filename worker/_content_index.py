@@ -0,0 +1,116 @@
+import os
+import hashlib
+from concurrent.futures import Future
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+from PyQt6.QtCore import QObject, pyqtSignal
+
+HASH_CHUNK_SIZE = 8 * 1024 * 1024
+
+# (file_path, file_size, file_mtime)
+FileStatKey = Tuple[str, int, int]
+
+
+def get_file_stat_key(file_path: str) -> FileStatKey:
+    file_stat = os.stat(file_path)
+    return (os.path.abspath(file_path), file_stat.st_size, file_stat.st_mtime_ns)
+
+
+class ContentIndexSignals(QObject):
+    # sha256, backend, remote_id
+    saved = pyqtSignal(str, str, str)
+    invalidated = pyqtSignal(str, str, str)
+
+
+class ContentIndex:
+    def __init__(self, remote_object_list: Optional[List[Tuple[str, str, str]]] = None):
+        self.lock = Lock()
+        self.signals = ContentIndexSignals()
+        # (backend, sha256) -> remote ids holding that content
+        self.remote_object_dict: Dict[Tuple[str, str], List[str]] = {}
+        # (backend, remote_id) -> sha256 of what it holds, a key written again
+        # finds its old mapping without a scan. A remote id saved under several
+        # sha256 by an older version keeps the last one
+        self.remote_sha256_dict: Dict[Tuple[str, str], str] = {}
+        for sha256, backend, remote_id in remote_object_list or []:
+            self.map_remote_object(backend, sha256, remote_id)
+        # (sha256, md5) of local files, computed in the same read
+        self.hash_dict: Dict[FileStatKey, Tuple[str, str]] = {}
+        self.inflight_dict: Dict[FileStatKey, Future] = {}
+
+    def get_cached_md5(self, file_path: str) -> Optional[str]:
+        with self.lock:
+            digest_tuple = self.hash_dict.get(get_file_stat_key(file_path))
+        return digest_tuple[1] if digest_tuple else None
+
+    def hash_file(self, file_path: str) -> str:
+        stat_key = get_file_stat_key(file_path)
+        with self.lock:
+            digest_tuple = self.hash_dict.get(stat_key)
+            if digest_tuple:
+                return digest_tuple[0]
+            future = self.inflight_dict.get(stat_key)
+            is_owner = future is None
+            if is_owner:
+                future = Future()
+                self.inflight_dict[stat_key] = future
+
+        # the S3 and Drive workers of a task hash the same file, only one
+        # of them reads it
+        if not is_owner:
+            return future.result()[0]
+
+        try:
+            sha256_digest = hashlib.sha256()
+            md5_digest = hashlib.md5()
+            with open(file_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                    sha256_digest.update(chunk)
+                    md5_digest.update(chunk)
+            digest_tuple = (sha256_digest.hexdigest(), md5_digest.hexdigest())
+        except BaseException as error:
+            with self.lock:
+                self.inflight_dict.pop(stat_key, None)
+            future.set_exception(error)
+            raise
+
+        with self.lock:
+            self.hash_dict[stat_key] = digest_tuple
+            self.inflight_dict.pop(stat_key, None)
+        future.set_result(digest_tuple)
+        return digest_tuple[0]
+
+    def lookup(self, backend: str, sha256: str) -> List[str]:
+        with self.lock:
+            return list(self.remote_object_dict.get((backend, sha256), []))
+
+    def map_remote_object(self, backend: str, sha256: str, remote_id: str) -> Tuple[bool, Optional[str]]:
+        # called with the lock held, returns whether the mapping is new and
+        # the sha256 the remote id held before
+        stale_sha256 = self.remote_sha256_dict.get((backend, remote_id))
+        if stale_sha256 == sha256:
+            return False, None
+        if stale_sha256 is not None:
+            self.remote_object_dict[(backend, stale_sha256)].remove(remote_id)
+        self.remote_sha256_dict[(backend, remote_id)] = sha256
+        self.remote_object_dict.setdefault((backend, sha256), []).append(remote_id)
+        return True, stale_sha256
+
+    def add(self, backend: str, sha256: str, remote_id: str):
+        # a key written again holds the new content only, whatever it was
+        # mapped to before must not be reused
+        with self.lock:
+            is_new, stale_sha256 = self.map_remote_object(backend, sha256, remote_id)
+        if stale_sha256 is not None:
+            self.signals.invalidated.emit(stale_sha256, backend, remote_id)
+        if is_new:
+            self.signals.saved.emit(sha256, backend, remote_id)
+
+    def remove(self, backend: str, sha256: str, remote_id: str):
+        with self.lock:
+            if self.remote_sha256_dict.get((backend, remote_id)) != sha256:
+                return
+            del self.remote_sha256_dict[(backend, remote_id)]
+            self.remote_object_dict[(backend, sha256)].remove(remote_id)
+        self.signals.invalidated.emit(sha256, backend, remote_id)
@@ -0,0 +1,117 @@
+import json
+import datetime
+import threading
+import traceback
+from typing import Callable, Optional
+
+from PyQt6.QtCore import QObject, pyqtSignal
+
+from google.oauth2.credentials import Credentials
+from google.auth.transport.requests import Request
+from google.auth.exceptions import RefreshError
+
+# a token is replaced this long before it expires, an upload never starts a
+# request with a token about to run out
+DEFAULT_REFRESH_MARGIN = 600
+DEFAULT_CHECK_INTERVAL = 60
+REFRESH_RETRY_INTERVAL = 15
+
+
+class SharedCredentials(Credentials):
+    # every Drive service of every thread holds this one object. A refresh
+    # from the timer, from a request with an expired token or from a 401 goes
+    # through one lock, the threads that waited for it reuse its token
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.refresh_lock = threading.Lock()
+        self.on_refresh: Callable[['SharedCredentials'], None] = lambda _: None
+
+    @classmethod
+    def from_token(cls, google_oauth_token: dict) -> 'SharedCredentials':
+        credentials = Credentials.from_authorized_user_info(google_oauth_token)
+        return cls(
+            credentials.token,
+            refresh_token=credentials.refresh_token,
+            id_token=credentials.id_token,
+            token_uri=credentials.token_uri,
+            client_id=credentials.client_id,
+            client_secret=credentials.client_secret,
+            scopes=credentials.scopes,
+            expiry=credentials.expiry
+        )
+
+    def refresh(self, request):
+        token = self.token
+        with self.refresh_lock:
+            if self.token != token and self.valid:
+                return
+            super().refresh(request)
+        self.on_refresh(self)
+
+    def to_token(self) -> dict:
+        return json.loads(self.to_json())
+
+
+class GoogleCredentialManagerSignals(QObject):
+    # the token after each refresh, to be stored in place of the old one
+    refreshed = pyqtSignal(dict)
+
+
+class GoogleCredentialManager(threading.Thread):
+    def __init__(
+            self,
+            credentials: SharedCredentials,
+            refresh_margin: float = DEFAULT_REFRESH_MARGIN,
+            check_interval: float = DEFAULT_CHECK_INTERVAL
+        ):
+        super().__init__(name='google-credentials', daemon=True)
+        self.credentials = credentials
+        self.refresh_margin = datetime.timedelta(seconds=refresh_margin)
+        self.check_interval = check_interval
+        self.signals = GoogleCredentialManagerSignals()
+        self.stop_event = threading.Event()
+        # google turned the refresh token down (e.g. it was revoked), only a
+        # new login helps
+        self.is_refresh_rejected = False
+        self.credentials.on_refresh = lambda x: self.signals.refreshed.emit(x.to_token())
+
+    def is_valid(self) -> bool:
+        return self.credentials.valid
+
+    def needs_refresh(self) -> bool:
+        if not self.credentials.refresh_token or self.is_refresh_rejected:
+            return False
+        if not self.credentials.valid:
+            return True
+        if self.credentials.expiry is None:
+            return False
+        # google-auth keeps the expiry as a naive UTC datetime
+        now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        return self.credentials.expiry - now < self.refresh_margin
+
+    def refresh(self) -> bool:
+        try:
+            self.credentials.refresh(Request())
+        except RefreshError as error:
+            traceback.print_exc()
+            self.is_refresh_rejected = not error.retryable
+            return False
+        except Exception:
+            traceback.print_exc()
+            return False
+        print(f"Google token refreshed, valid until {self.credentials.expiry} UTC")
+        return True
+
+    def stop(self, timeout: Optional[float] = None):
+        self.stop_event.set()
+        if self.is_alive():
+            self.join(timeout)
+
+    def run(self):
+        delay = 0
+        while not self.stop_event.wait(delay):
+            delay = self.check_interval
+            # a failed refresh is tried again soon, the token may still have
+            # a few minutes left
+            if self.needs_refresh() and not self.refresh():
+                delay = REFRESH_RETRY_INTERVAL
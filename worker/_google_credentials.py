@@ -0,0 +1,44 @@
+import traceback
+from typing import Optional
+
+from PyQt6.QtCore import QObject, QRunnable, pyqtSignal, pyqtSlot
+
+
+def create_google_credentials(google_oauth_token: dict):
+    # google-auth pulls in requests and cryptography, it is imported here
+    # instead of at the start of the app
+    from worker._google_credential_manager import SharedCredentials
+    return SharedCredentials.from_token(google_oauth_token)
+
+
+def create_google_credential_manager(google_oauth_token: dict):
+    from worker._google_credential_manager import GoogleCredentialManager
+    return GoogleCredentialManager(create_google_credentials(google_oauth_token))
+
+
+class GoogleCredentialsLoaderSignals(QObject):
+    # the credential manager, None when no token is stored or it cannot be read
+    loaded = pyqtSignal(object)
+
+
+class GoogleCredentialsLoader(QRunnable):
+    # builds the stored credentials and refreshes an expired token on a pool
+    # thread, a slow network no longer holds back the window
+    def __init__(self, google_oauth_token: Optional[dict]):
+        super().__init__()
+        self.google_oauth_token = google_oauth_token
+        self.signals = GoogleCredentialsLoaderSignals()
+
+    @pyqtSlot()
+    def run(self):
+        manager = None
+        try:
+            if self.google_oauth_token:
+                manager = create_google_credential_manager(self.google_oauth_token)
+                if not manager.is_valid() and manager.credentials.refresh_token:
+                    manager.refresh()
+        except Exception:
+            # an expired token that could not be refreshed leaves the login
+            # invalid, the user is asked to log in again
+            traceback.print_exc()
+        self.signals.loaded.emit(manager)
@@ -0,0 +1,47 @@
+from typing import Dict, Hashable, Tuple
+
+from ._retry import Retrier
+
+# drive takes at most 100 calls in one batch request
+MAX_BATCH_SIZE = 100
+
+
+def execute_batch(
+        drive_service,
+        request_dict: Dict[Hashable, object],
+        retrier: Retrier,
+        description: str,
+        is_idempotent: bool = True
+    ) -> Tuple[Dict[Hashable, dict], Dict[Hashable, Exception]]:
+    # sends the metadata calls of many tasks in a few round trips. A call is
+    # not repeated here when it fails on its own, the caller falls back to
+    # sending it alone through its usual retries
+    result_dict: Dict[Hashable, dict] = {}
+    error_dict: Dict[Hashable, Exception] = {}
+    key_list = list(request_dict)
+    for start in range(0, len(key_list), MAX_BATCH_SIZE):
+        chunk_key_list = key_list[start:start + MAX_BATCH_SIZE]
+
+        def handle_response(request_id: str, response: dict, error: Exception, chunk_key_list=chunk_key_list):
+            key = chunk_key_list[int(request_id)]
+            if error is None:
+                result_dict[key] = response
+            else:
+                error_dict[key] = error
+
+        batch = drive_service.new_batch_http_request(callback=handle_response)
+        for i, key in enumerate(chunk_key_list):
+            batch.add(request_dict[key], request_id=str(i))
+        try:
+            # the responses only arrive once the whole batch is answered, a
+            # batch that broke is sent again as a whole
+            retrier.call(
+                batch.execute,
+                description=f"{description} ({len(chunk_key_list)} calls)",
+                is_idempotent=is_idempotent
+            )
+        except Exception as error:
+            for key in chunk_key_list:
+                if key not in result_dict:
+                    error_dict[key] = error
+    return result_dict, error_dict
@@ -0,0 +1,303 @@
+import traceback
+from concurrent.futures import Future
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+from PyQt6.QtCore import QObject, QRunnable, pyqtSignal, pyqtSlot
+
+from ._retry import Retrier
+from ._google_service import get_google_service
+from ._google_drive_batch import execute_batch
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+
+# (drive_id, parent_id, name)
+FolderKey = Tuple[str, str, str]
+
+
+class GoogleDriveFolderSignals(QObject):
+    # drive_id, parent_id, name, folder_id
+    saved = pyqtSignal(str, str, str, str)
+    # drive_id, parent_id, name
+    invalidated = pyqtSignal(str, str, str)
+
+
+class GoogleDriveFolderResolver:
+    def __init__(self, folder_dict: Optional[Dict[FolderKey, str]] = None):
+        self.folder_dict: Dict[FolderKey, str] = dict(folder_dict or {})
+        self.inflight_dict: Dict[FolderKey, Future] = {}
+        self.lock = Lock()
+        self.signals = GoogleDriveFolderSignals()
+
+    def create_list_request(self, drive_service, drive_id: Optional[str], parent_id: Optional[str], name: str):
+        conditions = [
+            f"name='{name}'",
+            f"mimeType='{FOLDER_MIME_TYPE}'",
+            "trashed=false"
+        ]
+        if parent_id:
+            conditions.append(f"'{parent_id}' in parents")
+
+        list_params = {
+            'q': " and ".join(conditions),
+            'supportsAllDrives': True,
+            'fields': 'files(id, name, parents)'
+        }
+        if drive_id:
+            list_params['includeItemsFromAllDrives'] = True
+            list_params['driveId'] = drive_id
+            list_params['corpora'] = 'drive'
+        return drive_service.files().list(**list_params)
+
+    def create_create_request(self, drive_service, parent_id: Optional[str], name: str):
+        folder_metadata = {
+            'name': name,
+            'mimeType': FOLDER_MIME_TYPE
+        }
+        if parent_id:
+            folder_metadata['parents'] = [parent_id]
+        return drive_service.files().create(
+            body=folder_metadata,
+            supportsAllDrives=True,
+            fields='id'
+        )
+
+    def find_or_create_folder(
+            self,
+            drive_service,
+            drive_id: Optional[str],
+            parent_id: Optional[str],
+            name: str,
+            retrier: Retrier
+        ) -> str:
+        results = retrier.call(
+            self.create_list_request(drive_service, drive_id, parent_id, name).execute,
+            description=f"Looking up folder {name}"
+        )
+        items = results.get('files', [])
+        if items:
+            return items[0]['id']
+
+        # a create that may have reached drive is not sent again, it would
+        # leave a duplicate folder
+        folder = retrier.call(
+            self.create_create_request(drive_service, parent_id, name).execute,
+            description=f"Creating folder {name}",
+            is_idempotent=False
+        )
+        return folder.get('id')
+
+    def find_or_create_folders(
+            self,
+            drive_service,
+            key_list: List[FolderKey],
+            retrier: Retrier
+        ) -> Tuple[Dict[FolderKey, str], Dict[FolderKey, Exception]]:
+        # one batch looks up every folder, a second one creates the missing
+        result_dict, error_dict = execute_batch(
+            drive_service,
+            {x: self.create_list_request(drive_service, x[0] or None, x[1] or None, x[2]) for x in key_list},
+            retrier, "Looking up folders"
+        )
+        folder_id_dict = {x: y['files'][0]['id'] for x, y in result_dict.items() if y.get('files')}
+        missing_key_list = [x for x in key_list if x in result_dict and x not in folder_id_dict]
+        if missing_key_list:
+            result_dict, create_error_dict = execute_batch(
+                drive_service,
+                {x: self.create_create_request(drive_service, x[1] or None, x[2]) for x in missing_key_list},
+                retrier, "Creating folders",
+                is_idempotent=False
+            )
+            folder_id_dict.update({x: y['id'] for x, y in result_dict.items()})
+            error_dict.update(create_error_dict)
+
+        # a folder the batch could not settle is looked up again on its own,
+        # a create that reached drive is found instead of made twice
+        for key in key_list:
+            if key in folder_id_dict:
+                continue
+            print(f"Folder {key[2]} was not resolved in a batch: {error_dict.get(key)}")
+            try:
+                folder_id_dict[key] = self.find_or_create_folder(drive_service, key[0] or None, key[1] or None, key[2], retrier)
+            except Exception as error:
+                error_dict[key] = error
+        return folder_id_dict, error_dict
+
+    def resolve_folder(
+            self,
+            drive_service,
+            drive_id: Optional[str],
+            parent_id: Optional[str],
+            name: str,
+            retrier: Optional[Retrier] = None
+        ) -> str:
+        key = (drive_id or '', parent_id or '', name)
+        while True:
+            with self.lock:
+                folder_id = self.folder_dict.get(key)
+                if folder_id:
+                    return folder_id
+                future = self.inflight_dict.get(key)
+                is_owner = future is None
+                if is_owner:
+                    future = Future()
+                    self.inflight_dict[key] = future
+            if is_owner:
+                break
+
+            # only one thread looks up (and maybe creates) a folder, the others
+            # wait for its answer so no duplicate folder is created. A failure
+            # belongs to the owner, the folder is then resolved here with this
+            # task's own retries
+            try:
+                return future.result()
+            except Exception as error:
+                print(f"Resolving folder {name} elsewhere failed ({error}), resolving it here")
+
+        try:
+            folder_id = self.find_or_create_folder(
+                drive_service, drive_id, parent_id, name,
+                retrier or Retrier('google_drive')
+            )
+        except BaseException as error:
+            with self.lock:
+                self.inflight_dict.pop(key, None)
+            future.set_exception(error)
+            raise
+
+        with self.lock:
+            self.folder_dict[key] = folder_id
+            self.inflight_dict.pop(key, None)
+        future.set_result(folder_id)
+        self.signals.saved.emit(*key, folder_id)
+        return folder_id
+
+    def resolve(
+            self,
+            drive_service,
+            drive_id: Optional[str],
+            root_id: Optional[str],
+            name_list: List[str],
+            retrier: Optional[Retrier] = None
+        ) -> str:
+        parent_id = root_id
+        for name in name_list:
+            parent_id = self.resolve_folder(drive_service, drive_id, parent_id, name, retrier)
+        return parent_id
+
+    def prefetch(
+            self,
+            drive_service,
+            drive_id: Optional[str],
+            root_id: Optional[str],
+            name_list_list: List[List[str]],
+            retrier: Optional[Retrier] = None
+        ):
+        # resolves the folders of many tasks one depth at a time, a whole
+        # ingest batch takes two batch requests per depth instead of a lookup
+        # per folder. Nothing is raised, a task resolves what is left itself
+        retrier = retrier or Retrier('google_drive')
+        parent_dict = {tuple(x): root_id for x in name_list_list}
+        depth = 0
+        while parent_dict:
+            path_dict: Dict[FolderKey, List[Tuple[str, ...]]] = {}
+            for path, parent_id in parent_dict.items():
+                if depth < len(path):
+                    path_dict.setdefault((drive_id or '', parent_id or '', path[depth]), []).append(path)
+
+            folder_id_dict: Dict[FolderKey, str] = {}
+            owned_key_list = []
+            waiting_dict: Dict[FolderKey, Future] = {}
+            with self.lock:
+                for key in path_dict:
+                    if key in self.folder_dict:
+                        folder_id_dict[key] = self.folder_dict[key]
+                    elif key in self.inflight_dict:
+                        waiting_dict[key] = self.inflight_dict[key]
+                    else:
+                        self.inflight_dict[key] = Future()
+                        owned_key_list.append(key)
+
+            try:
+                resolved_dict, error_dict = self.find_or_create_folders(drive_service, owned_key_list, retrier)
+            except Exception as error:
+                resolved_dict, error_dict = {}, {x: error for x in owned_key_list}
+            for key in owned_key_list:
+                with self.lock:
+                    future = self.inflight_dict.pop(key)
+                    if key in resolved_dict:
+                        self.folder_dict[key] = resolved_dict[key]
+                if key in resolved_dict:
+                    folder_id_dict[key] = resolved_dict[key]
+                    future.set_result(resolved_dict[key])
+                    self.signals.saved.emit(*key, resolved_dict[key])
+                else:
+                    future.set_exception(error_dict[key])
+            # a task already resolving one of them is waited for
+            for key, future in waiting_dict.items():
+                try:
+                    folder_id_dict[key] = future.result()
+                except Exception:
+                    pass
+
+            parent_dict = {
+                path: folder_id_dict[key]
+                for key, path_list in path_dict.items() if key in folder_id_dict
+                for path in path_list
+            }
+            depth += 1
+
+    def is_cached(
+            self,
+            drive_id: Optional[str],
+            root_id: Optional[str],
+            name_list: List[str]
+        ) -> bool:
+        parent_id = root_id
+        with self.lock:
+            for name in name_list:
+                parent_id = self.folder_dict.get((drive_id or '', parent_id or '', name))
+                if not parent_id:
+                    return False
+        return True
+
+    def invalidate(
+            self,
+            drive_id: Optional[str],
+            root_id: Optional[str],
+            name_list: List[str]
+        ):
+        parent_id = root_id
+        with self.lock:
+            key_list = []
+            for name in name_list:
+                key = (drive_id or '', parent_id or '', name)
+                parent_id = self.folder_dict.pop(key, None)
+                key_list.append(key)
+                if not parent_id:
+                    break
+        for key in key_list:
+            self.signals.invalidated.emit(*key)
+
+
+class GoogleDriveFolderPrefetcher(QRunnable):
+    # resolves the folders of the tasks queued together on a pool thread,
+    # their workers find them cached or wait for the batch
+    def __init__(self, credentials, folder_resolver: GoogleDriveFolderResolver, folder_config: Optional[dict], name_list_list: List[List[str]]):
+        super().__init__()
+        self.credentials = credentials
+        self.folder_resolver = folder_resolver
+        self.folder_config = folder_config or {}
+        self.name_list_list = name_list_list
+
+    @pyqtSlot()
+    def run(self):
+        try:
+            self.folder_resolver.prefetch(
+                get_google_service('drive', 'v3', self.credentials),
+                self.folder_config.get('drive_id'),
+                self.folder_config.get('id'),
+                self.name_list_list
+            )
+        except Exception:
+            traceback.print_exc()
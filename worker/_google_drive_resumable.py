@@ -0,0 +1,149 @@
+import os
+import hashlib
+import mimetypes
+from typing import Callable, Optional
+
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaFileUpload
+
+from ._bandwidth import get_bandwidth_limiter
+from ._checksum import ChecksumMismatchError, HashingStream
+from ._retry import Retrier
+
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+CHUNK_SIZE_ALIGNMENT = 256 * 1024
+
+
+class HashingMediaFileUpload(MediaFileUpload):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.md5 = hashlib.md5()
+        self.hashing_stream = HashingStream(super().stream(), self.md5)
+
+    def stream(self):
+        return self.hashing_stream
+
+    def getbytes(self, begin: int, length: int) -> bytes:
+        self.hashing_stream.seek(begin)
+        return self.hashing_stream.read(length)
+
+    @property
+    def hashed_size(self) -> int:
+        return self.hashing_stream.hashed_size
+
+
+class GoogleDriveResumableUpload:
+    def __init__(
+            self,
+            drive_service,
+            file_path: str,
+            file_metadata: dict,
+            chunk_size: int = DEFAULT_CHUNK_SIZE,
+            session: Optional[dict] = None,
+            on_checkpoint: Optional[Callable[[dict], None]] = None,
+            on_progress: Optional[Callable[[int, int], None]] = None,
+            expected_md5: Optional[str] = None,
+            retrier: Optional[Retrier] = None
+        ):
+        self.drive_service = drive_service
+        self.file_path = file_path
+        self.file_metadata = file_metadata
+        # drive only accepts chunks in multiples of 256 KiB
+        self.chunk_size = max(chunk_size // CHUNK_SIZE_ALIGNMENT, 1) * CHUNK_SIZE_ALIGNMENT
+        self.session = session or {}
+        self.on_checkpoint = on_checkpoint or (lambda _: None)
+        self.on_progress = on_progress or (lambda *_: None)
+        self.expected_md5 = expected_md5
+        self.retrier = retrier or Retrier('google_drive')
+
+        file_stat = os.stat(self.file_path)
+        self.file_size = file_stat.st_size
+        self.file_mtime = file_stat.st_mtime_ns
+        self.request = None
+        self.media = None
+
+    def to_session(self) -> dict:
+        return {
+            'file_path': self.file_path,
+            'file_size': self.file_size,
+            'file_mtime': self.file_mtime,
+            'resumable_uri': self.request.resumable_uri,
+            'resumable_progress': self.request.resumable_progress
+        }
+
+    def is_session_resumable(self) -> bool:
+        return bool(self.session.get('resumable_uri')) \
+            and self.session.get('file_size') == self.file_size \
+            and self.session.get('file_mtime') == self.file_mtime
+
+    def create_request(self):
+        mime_type, _ = mimetypes.guess_type(self.file_path)
+        # chunks are hashed as they are sent, the file is not read again
+        self.media = HashingMediaFileUpload(
+            self.file_path,
+            mimetype=mime_type,
+            chunksize=self.chunk_size,
+            resumable=True
+        )
+        return self.drive_service.files() \
+            .create(
+                body=self.file_metadata,
+                media_body=self.media,
+                supportsAllDrives=True,
+                fields="id, md5Checksum"
+            )
+
+    def verify(self, response: dict):
+        # a resumed upload only streamed the tail of the file, the digest of
+        # the content hash pass stands in for it then
+        if self.media.hashed_size == self.file_size:
+            expected_md5 = self.media.md5.hexdigest()
+        else:
+            expected_md5 = self.expected_md5
+        remote_md5 = response.get('md5Checksum')
+        if not expected_md5 or not remote_md5:
+            return
+        if remote_md5 != expected_md5:
+            raise ChecksumMismatchError(f"Google Drive file {response.get('id')} has md5 {remote_md5}, expected {expected_md5}")
+
+    def upload(self) -> dict:
+        self.request = self.create_request()
+        response = None
+        if self.is_session_resumable():
+            self.request.resumable_uri = self.session['resumable_uri']
+            # an error state makes the next chunk ask the server for the
+            # committed offset before sending anything
+            self.request._in_error_state = True
+            try:
+                status, response = self.retrier.call(
+                    self.request.next_chunk,
+                    description=f"Resuming Google Drive upload of {self.file_path}"
+                )
+                print(f"Resuming Google Drive upload of {self.file_path} from {self.request.resumable_progress}")
+            except HttpError as error:
+                if error.resp.status not in (404, 410):
+                    raise
+                print(f"Google Drive upload session of {self.file_path} expired, restarting")
+                self.request = self.create_request()
+
+        self.on_progress(self.request.resumable_progress, self.file_size)
+        limiter = get_bandwidth_limiter()
+        while response is None:
+            limiter.throttle(
+                'google_drive',
+                min(self.chunk_size, self.file_size - self.request.resumable_progress),
+                self.retrier.cancel_event
+            )
+            # a failed chunk leaves the request in an error state, the retry
+            # asks for the committed offset and goes on from there
+            status, response = self.retrier.call(
+                self.request.next_chunk,
+                description=f"Google Drive chunk at {self.request.resumable_progress} of {self.file_path}"
+            )
+            if status:
+                self.on_checkpoint(self.to_session())
+                self.on_progress(status.resumable_progress, self.file_size)
+
+        self.verify(response)
+        self.on_progress(self.file_size, self.file_size)
+        return response
@@ -0,0 +1,52 @@
+import copy
+import json
+import threading
+from typing import TYPE_CHECKING, Dict, Tuple
+
+if TYPE_CHECKING:
+    from google.oauth2.credentials import Credentials
+
+_discovery_dict: Dict[Tuple[str, str], dict] = {}
+_discovery_lock = threading.Lock()
+_thread_local = threading.local()
+
+
+def get_discovery_document(service_name: str, version: str) -> dict:
+    from googleapiclient.discovery_cache import get_static_doc
+    with _discovery_lock:
+        key = (service_name, version)
+        if key not in _discovery_dict:
+            document = get_static_doc(service_name, version)
+            _discovery_dict[key] = json.loads(document) if document else None
+        return _discovery_dict[key]
+
+
+def get_google_service(service_name: str, version: str, credentials: 'Credentials'):
+    # services wrap an httplib2 connection which must not be shared between
+    # threads, so each thread keeps its own and reuses it across tasks
+    service_dict = getattr(_thread_local, 'service_dict', None)
+    if service_dict is None:
+        service_dict = _thread_local.service_dict = {}
+
+    key = (service_name, version, id(credentials))
+    cached = service_dict.get(key)
+    if cached and cached[0] is credentials:
+        return cached[1]
+
+    # googleapiclient is imported by the first Drive call, not by the start
+    # of the app
+    from google_auth_httplib2 import AuthorizedHttp
+    from googleapiclient.discovery import build, build_from_document
+    from googleapiclient.http import build_http
+
+    # build_http leaves 308 alone, a resumable upload answers every chunk with
+    # it and httplib2 would take it for a redirect
+    http = AuthorizedHttp(credentials, http=build_http())
+    document = get_discovery_document(service_name, version)
+    if document:
+        # building fills in the document, keep the cached copy untouched
+        service = build_from_document(copy.deepcopy(document), http=http)
+    else:
+        service = build(service_name, version, http=http)
+    service_dict[key] = (credentials, service)
+    return service
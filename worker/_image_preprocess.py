@@ -0,0 +1,116 @@
+import os
+import json
+import hashlib
+import importlib.util
+from concurrent.futures import Future, ProcessPoolExecutor
+from threading import Lock
+from typing import Dict, List, Optional
+
+IMAGE_CACHE_DIR = "image_cache"
+DEFAULT_MAX_DIMENSION = 2048
+DEFAULT_FORMAT = 'webp'
+DEFAULT_QUALITY = 85
+FORMAT_EXTENSION_DICT = {
+    'webp': '.webp',
+    'jpeg': '.jpg',
+    'png': '.png'
+}
+
+
+def preprocess_image(image_path: str, output_path: str, max_dimension: int, image_format: str, quality: int) -> str:
+    # runs in a pool process, decoding and encoding large renders never
+    # holds the GIL of the app
+    from PIL import Image, ImageOps
+
+    with Image.open(image_path) as source_image:
+        image = ImageOps.exif_transpose(source_image)
+    image.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
+    if image_format == 'jpeg' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    # EXIF, ICC and text chunks are not written out
+    image.info = {}
+
+    tmp_path = f'{output_path}.{os.getpid()}.tmp'
+    image.save(tmp_path, format=image_format.upper(), quality=quality, optimize=True)
+    os.replace(tmp_path, output_path)
+    return output_path
+
+
+class ImagePreprocessor:
+    def __init__(self, preprocess_config: Optional[dict] = None, cache_dir: str = IMAGE_CACHE_DIR):
+        preprocess_config = preprocess_config or {}
+        self.is_enabled = preprocess_config.get('enabled', False)
+        self.max_dimension = preprocess_config.get('max_dimension', DEFAULT_MAX_DIMENSION)
+        self.image_format = preprocess_config.get('format', DEFAULT_FORMAT)
+        self.quality = preprocess_config.get('quality', DEFAULT_QUALITY)
+        self.max_workers = preprocess_config.get('max_workers')
+        self.cache_dir = cache_dir
+
+        if self.image_format not in FORMAT_EXTENSION_DICT:
+            print(f"Unknown image format {self.image_format}, using {DEFAULT_FORMAT}")
+            self.image_format = DEFAULT_FORMAT
+
+        # Pillow is only imported by the pool processes, here it is looked up
+        if self.is_enabled and importlib.util.find_spec('PIL') is None:
+            print("Pillow is not installed, preview images are uploaded as they are")
+            self.is_enabled = False
+
+        self.lock = Lock()
+        self.executor: Optional[ProcessPoolExecutor] = None
+        self.inflight_dict: Dict[str, Future] = {}
+
+    def get_cache_path(self, image_path: str) -> str:
+        file_stat = os.stat(image_path)
+        cache_key = json.dumps([
+            os.path.abspath(image_path), file_stat.st_size, file_stat.st_mtime_ns,
+            self.max_dimension, self.image_format, self.quality
+        ])
+        file_name = hashlib.sha256(cache_key.encode()).hexdigest()
+        return os.path.join(self.cache_dir, f'{file_name}{FORMAT_EXTENSION_DICT[self.image_format]}')
+
+    def submit(self, image_path: str) -> Future:
+        cache_path = self.get_cache_path(image_path)
+        with self.lock:
+            future = self.inflight_dict.get(cache_path)
+            if future:
+                return future
+            if os.path.exists(cache_path):
+                future = Future()
+                future.set_result(cache_path)
+                return future
+
+            if self.executor is None:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            future = self.executor.submit(
+                preprocess_image, image_path, cache_path,
+                self.max_dimension, self.image_format, self.quality
+            )
+            self.inflight_dict[cache_path] = future
+        future.add_done_callback(lambda _: self.discard(cache_path))
+        return future
+
+    def discard(self, cache_path: str):
+        with self.lock:
+            self.inflight_dict.pop(cache_path, None)
+
+    def prefetch(self, image_path_list: List[str]):
+        if not self.is_enabled:
+            return
+        for image_path in image_path_list:
+            self.submit(image_path)
+
+    def preprocess(self, image_path: str) -> str:
+        if not self.is_enabled:
+            return image_path
+        try:
+            return self.submit(image_path).result()
+        except Exception as error:
+            print(f"Failed to preprocess {image_path}, uploading it as it is: {error}")
+            return image_path
+
+    def shutdown(self):
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,278 @@
+import ssl
+import json
+import random
+import socket
+import datetime
+import http.client
+from email.utils import parsedate_to_datetime
+from threading import Event, Lock
+from typing import Callable, Optional, Set, Tuple
+
+from ._checksum import ChecksumMismatchError
+
+FATAL = 'fatal'
+RETRYABLE = 'retryable'
+THROTTLED = 'throttled'
+KIND_LABEL_DICT = {
+    RETRYABLE: 'failed',
+    THROTTLED: 'was throttled'
+}
+
+DEFAULT_MAX_ATTEMPTS = 6
+DEFAULT_BASE_DELAY = 1.0
+# the server asked us to slow down, coming back quickly only makes it worse
+DEFAULT_THROTTLE_BASE_DELAY = 5.0
+DEFAULT_MAX_DELAY = 120.0
+# retries and seconds of backoff a single worker of a task may spend
+DEFAULT_TASK_RETRY_BUDGET = 50
+DEFAULT_TASK_WAIT_BUDGET = 1800.0
+
+RETRY_STATUS_SET = {408, 425, 500, 502, 503, 504}
+THROTTLE_STATUS_SET = {429}
+S3_THROTTLE_CODE_SET = {
+    'SlowDown', 'Throttling', 'ThrottlingException', 'RequestLimitExceeded',
+    'TooManyRequests', 'TooManyRequestsException', 'RequestThrottled'
+}
+S3_RETRY_CODE_SET = {
+    'RequestTimeout', 'RequestTimeoutException', 'InternalError',
+    'ServiceUnavailable', 'BadDigest', 'IncompleteBody'
+}
+GOOGLE_DRIVE_THROTTLE_REASON_SET = {
+    'userRateLimitExceeded', 'rateLimitExceeded', 'sharingRateLimitExceeded'
+}
+GOOGLE_DRIVE_RETRY_REASON_SET = {'backendError', 'internalError', 'transientError'}
+
+_network_error_tuple: Optional[tuple] = None
+
+
+class TaskCancelledError(Exception):
+    pass
+
+
+def get_network_error_tuple() -> tuple:
+    # the connection broke, the request may or may not have reached the
+    # server. The backend libraries are only imported once an error has to be
+    # told apart, by then the backend that raised it is loaded anyway
+    global _network_error_tuple
+    if _network_error_tuple is None:
+        import httplib2
+        import requests
+        from botocore.exceptions import ConnectionError as BotoConnectionError, HTTPClientError
+        from google.auth.exceptions import TransportError
+        _network_error_tuple = (
+            ConnectionError, TimeoutError, socket.gaierror, ssl.SSLError,
+            http.client.HTTPException, httplib2.HttpLib2Error, TransportError,
+            BotoConnectionError, HTTPClientError,
+            requests.ConnectionError, requests.Timeout
+        )
+    return _network_error_tuple
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max((retry_at - datetime.datetime.now(datetime.timezone.utc)).total_seconds(), 0.0)
+
+
+def classify_status(status: int) -> str:
+    if status in THROTTLE_STATUS_SET:
+        return THROTTLED
+    if status in RETRY_STATUS_SET or status >= 500:
+        return RETRYABLE
+    return FATAL
+
+
+def get_google_error_reason_set(error: Exception) -> Set[str]:
+    reason_set = set()
+    for detail in getattr(error, 'error_details', None) or []:
+        if isinstance(detail, dict) and detail.get('reason'):
+            reason_set.add(detail['reason'])
+    try:
+        content = json.loads(error.content)
+        for item in content.get('error', {}).get('errors', []):
+            if item.get('reason'):
+                reason_set.add(item['reason'])
+    except (TypeError, ValueError, AttributeError):
+        pass
+    return reason_set
+
+
+def classify_s3_error(error: Exception) -> Tuple[str, Optional[float]]:
+    from botocore.exceptions import ClientError
+    if isinstance(error, ClientError):
+        code = error.response.get('Error', {}).get('Code')
+        metadata = error.response.get('ResponseMetadata', {})
+        retry_after = parse_retry_after(metadata.get('HTTPHeaders', {}).get('retry-after'))
+        if code in S3_THROTTLE_CODE_SET:
+            return THROTTLED, retry_after
+        if code in S3_RETRY_CODE_SET:
+            return RETRYABLE, retry_after
+        return classify_status(metadata.get('HTTPStatusCode', 0)), retry_after
+    # a part or object that arrived corrupted is sent again
+    if isinstance(error, ChecksumMismatchError):
+        return RETRYABLE, None
+    if isinstance(error, get_network_error_tuple()):
+        return RETRYABLE, None
+    return FATAL, None
+
+
+def classify_google_drive_error(error: Exception) -> Tuple[str, Optional[float]]:
+    from googleapiclient.errors import HttpError
+    if isinstance(error, HttpError):
+        retry_after = parse_retry_after(error.resp.get('retry-after'))
+        reason_set = get_google_error_reason_set(error)
+        # drive reports rate limits as 403 next to real permission errors
+        if reason_set & GOOGLE_DRIVE_THROTTLE_REASON_SET:
+            return THROTTLED, retry_after
+        if reason_set & GOOGLE_DRIVE_RETRY_REASON_SET:
+            return RETRYABLE, retry_after
+        return classify_status(error.resp.status), retry_after
+    if isinstance(error, get_network_error_tuple()):
+        return RETRYABLE, None
+    return FATAL, None
+
+
+def classify_api_error(error: Exception) -> Tuple[str, Optional[float]]:
+    import requests
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return classify_status(error.response.status_code), parse_retry_after(error.response.headers.get('Retry-After'))
+    if isinstance(error, get_network_error_tuple()):
+        return RETRYABLE, None
+    return FATAL, None
+
+
+CLASSIFIER_DICT = {
+    's3': classify_s3_error,
+    'google_drive': classify_google_drive_error,
+    'api': classify_api_error
+}
+
+
+def classify_error(backend: str, error: Exception) -> Tuple[str, Optional[float]]:
+    return CLASSIFIER_DICT[backend](error)
+
+
+_retry_config: dict = {}
+_retry_config_lock = Lock()
+
+
+def configure_retry(retry_config: Optional[dict]):
+    # {"max_attempts": 6, ..., "s3": {"max_attempts": 10}}, a backend entry
+    # overrides the shared values
+    global _retry_config
+    with _retry_config_lock:
+        _retry_config = dict(retry_config or {})
+
+
+def get_retry_config(backend: str) -> dict:
+    with _retry_config_lock:
+        return {**_retry_config, **_retry_config.get(backend, {})}
+
+
+def get_backoff_delay(
+        kind: str,
+        attempt: int,
+        retry_after: Optional[float] = None,
+        base_delay: float = DEFAULT_BASE_DELAY,
+        throttle_base_delay: float = DEFAULT_THROTTLE_BASE_DELAY,
+        max_delay: float = DEFAULT_MAX_DELAY
+    ) -> float:
+    if retry_after is not None:
+        return min(retry_after, max_delay)
+    cap = min((throttle_base_delay if kind == THROTTLED else base_delay) * 2 ** attempt, max_delay)
+    # half of the delay is jitter, calls that failed together spread out
+    return random.uniform(cap / 2, cap)
+
+
+class RetryBudget:
+    def __init__(self, max_retry_count: int = DEFAULT_TASK_RETRY_BUDGET, max_wait: float = DEFAULT_TASK_WAIT_BUDGET):
+        self.max_retry_count = max_retry_count
+        self.max_wait = max_wait
+        self.retry_count = 0
+        self.wait_total = 0.0
+        self.lock = Lock()
+
+    def consume(self, delay: float) -> Optional[int]:
+        with self.lock:
+            if self.retry_count >= self.max_retry_count or self.wait_total + delay > self.max_wait:
+                return None
+            self.retry_count += 1
+            self.wait_total += delay
+            return self.retry_count
+
+
+class Retrier:
+    def __init__(
+            self,
+            backend: str,
+            on_retry: Optional[Callable[[int, str], None]] = None,
+            cancel_event: Optional[Event] = None
+        ):
+        retry_config = get_retry_config(backend)
+        self.backend = backend
+        self.max_attempts = max(retry_config.get('max_attempts', DEFAULT_MAX_ATTEMPTS), 1)
+        self.base_delay = retry_config.get('base_delay', DEFAULT_BASE_DELAY)
+        self.throttle_base_delay = retry_config.get('throttle_base_delay', DEFAULT_THROTTLE_BASE_DELAY)
+        self.max_delay = retry_config.get('max_delay', DEFAULT_MAX_DELAY)
+        self.budget = RetryBudget(
+            retry_config.get('task_retry_budget', DEFAULT_TASK_RETRY_BUDGET),
+            retry_config.get('task_wait_budget', DEFAULT_TASK_WAIT_BUDGET)
+        )
+        self.on_retry = on_retry or (lambda *_: None)
+        # a backoff ends early once the task is cancelled
+        self.cancel_event = cancel_event or Event()
+
+    @property
+    def retry_count(self) -> int:
+        return self.budget.retry_count
+
+    def check_cancelled(self, description: str = ''):
+        if self.cancel_event.is_set():
+            raise TaskCancelledError(f"{description or 'Task'} was cancelled")
+
+    def sleep(self, delay: float, description: str = ''):
+        self.cancel_event.wait(delay)
+        self.check_cancelled(description)
+
+    def get_retry_delay(self, error: Exception, attempt: int, description: str = '', is_idempotent: bool = True) -> Optional[float]:
+        # the backoff before the next attempt, None when the call is given up.
+        # A call that is not idempotent is only repeated when the server
+        # turned it away, a broken connection may hide a success
+        kind, retry_after = classify_error(self.backend, error)
+        if kind == FATAL or (kind != THROTTLED and not is_idempotent):
+            return None
+        if attempt + 1 >= self.max_attempts:
+            print(f"{description} failed {self.max_attempts} times, giving up")
+            return None
+        delay = get_backoff_delay(
+            kind, attempt, retry_after,
+            self.base_delay, self.throttle_base_delay, self.max_delay
+        )
+        retry_count = self.budget.consume(delay)
+        if retry_count is None:
+            print(f"{description} failed, the retry budget of this task is used up")
+            return None
+        message = f"{description} {KIND_LABEL_DICT[kind]} ({type(error).__name__}), retry {attempt + 1} in {delay:.0f}s"
+        print(f"{message}: {error}")
+        self.on_retry(retry_count, message)
+        return delay
+
+    def call(self, fn: Callable, *args, description: str = '', is_idempotent: bool = True, **kwargs):
+        attempt = 0
+        while True:
+            try:
+                return fn(*args, **kwargs)
+            except Exception as error:
+                delay = self.get_retry_delay(error, attempt, description, is_idempotent)
+                if delay is None:
+                    raise
+                attempt += 1
+                self.sleep(delay, description)
@@ -0,0 +1,251 @@
+import os
+import math
+import time
+import heapq
+import hashlib
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+from threading import Lock
+from typing import Callable, Dict, List, Optional, Tuple
+
+from ._s3_transfer import S3TransferEngine
+from ._bandwidth import get_bandwidth_limiter, ThrottledBody
+from ._checksum import ChecksumMismatchError, content_md5, parse_md5_etag, is_multipart_etag_of, verify_multipart_etag
+from ._retry import Retrier
+
+DEFAULT_PART_SIZE = 16 * 1024 * 1024
+MIN_PART_SIZE = 5 * 1024 * 1024
+MAX_PART_COUNT = 10000
+DEFAULT_PART_CONCURRENCY = 4
+
+
+class S3MultipartUpload:
+    def __init__(
+            self,
+            engine: S3TransferEngine,
+            bucket: str,
+            key: str,
+            file_path: str,
+            part_size: int = DEFAULT_PART_SIZE,
+            max_concurrency: int = DEFAULT_PART_CONCURRENCY,
+            session: Optional[dict] = None,
+            on_checkpoint: Optional[Callable[[dict], None]] = None,
+            on_progress: Optional[Callable[[int, int], None]] = None,
+            retrier: Optional[Retrier] = None,
+            metadata: Optional[dict] = None
+        ):
+        self.engine = engine
+        self.s3_client = engine.client
+        self.bucket = bucket
+        self.key = key
+        self.file_path = file_path
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.max_concurrency = max(max_concurrency, 1)
+        self.session = session or {}
+        self.on_checkpoint = on_checkpoint or (lambda _: None)
+        self.on_progress = on_progress or (lambda *_: None)
+        self.retrier = retrier or Retrier('s3')
+        self.metadata = metadata or {}
+
+        self.upload_id = None
+        self.part_dict: Dict[int, str] = {}
+        self.part_digest_dict: Dict[int, Optional[bytes]] = {}
+        self.lock = Lock()
+
+        file_stat = os.stat(self.file_path)
+        self.file_size = file_stat.st_size
+        self.file_mtime = file_stat.st_mtime_ns
+
+    def to_session(self) -> dict:
+        return {
+            'bucket': self.bucket,
+            'key': self.key,
+            'file_path': self.file_path,
+            'file_size': self.file_size,
+            'file_mtime': self.file_mtime,
+            'upload_id': self.upload_id,
+            'part_size': self.part_size,
+            'part_list': sorted(self.part_dict.items())
+        }
+
+    def is_session_resumable(self) -> bool:
+        return bool(self.session.get('upload_id')) \
+            and self.session.get('bucket') == self.bucket \
+            and self.session.get('key') == self.key \
+            and self.session.get('file_size') == self.file_size \
+            and self.session.get('file_mtime') == self.file_mtime
+
+    def part_range(self, part_number: int):
+        offset = (part_number - 1) * self.part_size
+        return offset, min(self.part_size, self.file_size - offset)
+
+    def list_uploaded_parts(self) -> Dict[int, str]:
+        # the server part list is authoritative, the saved ETags only tell us
+        # which upload we were in the middle of
+        from botocore.exceptions import ClientError
+        part_dict = {}
+        paginator = self.s3_client.get_paginator('list_parts')
+        try:
+            for page in paginator.paginate(
+                Bucket=self.bucket,
+                Key=self.key,
+                UploadId=self.upload_id
+            ):
+                for part in page.get('Parts', []):
+                    part_number = part['PartNumber']
+                    _, expected_size = self.part_range(part_number)
+                    if part['Size'] == expected_size:
+                        part_dict[part_number] = part['ETag']
+        except ClientError as error:
+            if error.response.get('Error', {}).get('Code') in ('NoSuchUpload', '404'):
+                return None
+            raise
+        return part_dict
+
+    def start(self):
+        if self.is_session_resumable():
+            self.upload_id = self.session['upload_id']
+            self.part_size = self.session['part_size']
+            part_dict = self.retrier.call(
+                self.list_uploaded_parts,
+                description=f"Listing uploaded parts of {self.key}"
+            )
+            if part_dict is not None:
+                print(f"Resuming multipart upload {self.upload_id} of {self.key} with {len(part_dict)} uploaded parts")
+                self.part_dict = part_dict
+                self.part_digest_dict = {x: parse_md5_etag(etag) for x, etag in part_dict.items()}
+                return
+
+        # keep under the S3 part count limit for very large files
+        self.part_size = max(self.part_size, math.ceil(self.file_size / MAX_PART_COUNT))
+        resp = self.retrier.call(
+            self.s3_client.create_multipart_upload,
+            Bucket=self.bucket,
+            Key=self.key,
+            Metadata=self.metadata,
+            description=f"Starting multipart upload of {self.key}"
+        )
+        self.upload_id = resp['UploadId']
+        self.part_dict = {}
+        self.part_digest_dict = {}
+        self.on_checkpoint(self.to_session())
+
+    def upload_part(self, part_number: int) -> Tuple[str, bytes]:
+        offset, size = self.part_range(part_number)
+        with open(self.file_path, 'rb') as f:
+            f.seek(offset)
+            body = f.read(size)
+        # the part is already in memory, the server rejects it with BadDigest
+        # if it does not arrive intact
+        digest = hashlib.md5(body).digest()
+        resp = self.s3_client.upload_part(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            PartNumber=part_number,
+            ContentMD5=content_md5(digest),
+            Body=ThrottledBody(body, get_bandwidth_limiter(), 's3', self.retrier.cancel_event)
+        )
+        etag_digest = parse_md5_etag(resp['ETag'])
+        if etag_digest is not None and etag_digest != digest:
+            raise ChecksumMismatchError(f"Part {part_number} of {self.key} has ETag {resp['ETag']}, expected {digest.hex()}")
+        return resp['ETag'], digest
+
+    def complete(self) -> dict:
+        from botocore.exceptions import ClientError
+        part_list = [
+            {'PartNumber': part_number, 'ETag': etag}
+            for part_number, etag in sorted(self.part_dict.items())
+        ]
+        part_digest_list = [self.part_digest_dict.get(x) for x in sorted(self.part_dict)]
+        try:
+            return self.s3_client.complete_multipart_upload(
+                Bucket=self.bucket,
+                Key=self.key,
+                UploadId=self.upload_id,
+                MultipartUpload={'Parts': part_list}
+            )
+        except ClientError as error:
+            if error.response.get('Error', {}).get('Code') != 'NoSuchUpload':
+                raise
+            # an earlier attempt may have completed the upload and lost the
+            # answer, the object is only taken if it was built from our parts
+            head = self.engine.head_object(self.bucket, self.key)
+            if head is None or not is_multipart_etag_of(head.get('ETag'), part_digest_list):
+                raise
+            print(f"Multipart upload {self.upload_id} of {self.key} was already completed")
+            return head
+
+    def upload(self):
+        self.start()
+
+        part_count = max(math.ceil(self.file_size / self.part_size), 1)
+        missing_part_list = [
+            x for x in range(1, part_count + 1)
+            if x not in self.part_dict
+        ]
+        uploaded_size = sum(
+            self.part_range(x)[1]
+            for x in self.part_dict
+        )
+        self.on_progress(uploaded_size, self.file_size)
+
+        def upload_and_checkpoint(part_number: int):
+            nonlocal uploaded_size
+            etag, digest = self.upload_part(part_number)
+            with self.lock:
+                self.part_dict[part_number] = etag
+                self.part_digest_dict[part_number] = digest
+                uploaded_size += self.part_range(part_number)[1]
+                self.on_checkpoint(self.to_session())
+                self.on_progress(uploaded_size, self.file_size)
+
+        # parts run on the shared engine threads, the window only keeps this
+        # task from taking more than its share of them. A failed part waits
+        # out its backoff here, never on an engine thread other tasks need,
+        # and only that part is sent again, never the whole file
+        # (ready_at, part_number, attempt)
+        waiting_list: List[Tuple[float, int, int]] = [(0.0, x, 0) for x in missing_part_list]
+        running_dict: Dict[Future, Tuple[int, int]] = {}
+        error_list = []
+        try:
+            while running_dict or (waiting_list and not error_list):
+                self.retrier.check_cancelled(f"Upload of {self.key}")
+                now = time.time()
+                while waiting_list and not error_list and len(running_dict) < self.max_concurrency and waiting_list[0][0] <= now:
+                    _, part_number, attempt = heapq.heappop(waiting_list)
+                    running_dict[self.engine.submit(upload_and_checkpoint, part_number)] = (part_number, attempt)
+
+                timeout = None
+                if waiting_list and not error_list and len(running_dict) < self.max_concurrency:
+                    timeout = max(waiting_list[0][0] - now, 0.0)
+                if not running_dict:
+                    # every part left waits out its backoff, nothing to
+                    # wait for but the clock or a cancel
+                    self.retrier.sleep(timeout, f"Upload of {self.key}")
+                    continue
+                done_set, _ = wait(running_dict, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done_set:
+                    part_number, attempt = running_dict.pop(future)
+                    error = future.exception()
+                    if error is None:
+                        continue
+                    delay = None
+                    if not error_list:
+                        delay = self.retrier.get_retry_delay(error, attempt, f"Part {part_number} of {self.key}")
+                    if delay is None:
+                        error_list.append(error)
+                    else:
+                        heapq.heappush(waiting_list, (time.time() + delay, part_number, attempt + 1))
+        finally:
+            wait(running_dict)
+        if error_list:
+            raise error_list[0]
+
+        resp = self.retrier.call(
+            self.complete,
+            description=f"Completing multipart upload of {self.key}"
+        )
+        verify_multipart_etag(
+            resp.get('ETag'),
+            [self.part_digest_dict.get(x) for x in sorted(self.part_dict)]
+        )
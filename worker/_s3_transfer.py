@@ -0,0 +1,135 @@
+import hashlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Event, Lock
+from typing import Callable, Optional
+
+from ._bandwidth import get_bandwidth_limiter, ThrottledBody
+from ._checksum import ChecksumMismatchError, content_md5, parse_md5_etag
+
+DEFAULT_MAX_CONCURRENCY = 8
+# room for the create/list/complete calls next to the part uploads
+EXTRA_POOL_CONNECTIONS = 2
+
+
+class S3TransferEngine:
+    def __init__(self, max_concurrency: int = DEFAULT_MAX_CONCURRENCY):
+        # boto3 takes a good part of a second to import, it waits for the
+        # first S3 upload instead of the start of the app
+        import boto3
+        from botocore.config import Config
+        from boto3.s3.transfer import TransferConfig
+
+        self.max_concurrency = max(max_concurrency, 1)
+        self.client = boto3.client(
+            "s3",
+            config=Config(
+                max_pool_connections=self.max_concurrency + EXTRA_POOL_CONNECTIONS,
+                tcp_keepalive=True,
+                # retries are done by the workers, which count them per task
+                retries={'total_max_attempts': 1}
+            )
+        )
+        # every part and image upload of every task runs on these threads,
+        # which caps the process-wide number of concurrent S3 requests
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.max_concurrency,
+            thread_name_prefix='s3-transfer'
+        )
+        # upload_file runs inline on an executor thread instead of spawning
+        # its own transfer threads
+        self.transfer_config = TransferConfig(use_threads=False)
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        return self.executor.submit(fn, *args, **kwargs)
+
+    def upload_file(self, file_path: str, bucket: str, key: str, callback: Optional[Callable[[int], None]] = None):
+        limiter = get_bandwidth_limiter()
+
+        # the callback runs on the thread doing the transfer, sleeping in it
+        # paces the upload
+        def throttled_callback(transferred: int):
+            limiter.throttle('s3', transferred)
+            if callback:
+                callback(transferred)
+
+        return self.submit(
+            self.client.upload_file,
+            Filename=file_path,
+            Bucket=bucket,
+            Key=key,
+            Callback=throttled_callback,
+            Config=self.transfer_config
+        ).result()
+
+    def put_file(self, file_path: str, bucket: str, key: str, metadata: Optional[dict] = None, cancel_event: Optional[Event] = None):
+        # small files are sent in one request, hashing the bytes already read
+        # lets the server reject them if they arrive corrupted
+        def put():
+            with open(file_path, 'rb') as f:
+                body = f.read()
+            digest = hashlib.md5(body).digest()
+            resp = self.client.put_object(
+                Bucket=bucket,
+                Key=key,
+                ContentMD5=content_md5(digest),
+                Metadata=metadata or {},
+                Body=ThrottledBody(body, get_bandwidth_limiter(), 's3', cancel_event)
+            )
+            etag_digest = parse_md5_etag(resp.get('ETag'))
+            if etag_digest is not None and etag_digest != digest:
+                raise ChecksumMismatchError(f"{key} has ETag {resp.get('ETag')}, expected {digest.hex()}")
+            return resp
+
+        return self.submit(put).result()
+
+    def head_object(self, bucket: str, key: str) -> Optional[dict]:
+        from botocore.exceptions import ClientError
+        try:
+            return self.client.head_object(Bucket=bucket, Key=key)
+        except ClientError as error:
+            if error.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+
+    def copy_object(self, source_bucket: str, source_key: str, bucket: str, key: str):
+        # a managed copy switches to a multipart copy for large objects,
+        # the bytes never leave the bucket either way
+        return self.submit(
+            self.client.copy,
+            CopySource={'Bucket': source_bucket, 'Key': source_key},
+            Bucket=bucket,
+            Key=key,
+            Config=self.transfer_config
+        ).result()
+
+
+_engine: Optional[S3TransferEngine] = None
+_engine_max_concurrency = DEFAULT_MAX_CONCURRENCY
+_engine_lock = Lock()
+
+
+def configure_s3_transfer_engine(upload_config: dict):
+    global _engine, _engine_max_concurrency
+    max_concurrency = upload_config.get('max_concurrency', DEFAULT_MAX_CONCURRENCY)
+    with _engine_lock:
+        _engine_max_concurrency = max_concurrency
+        if _engine and _engine.max_concurrency != max(max_concurrency, 1):
+            # running uploads keep the old engine until they finish
+            _engine = None
+
+
+def get_s3_transfer_engine() -> S3TransferEngine:
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = S3TransferEngine(_engine_max_concurrency)
+        return _engine
+
+
+def shutdown_s3_transfer_engine():
+    global _engine
+    with _engine_lock:
+        engine, _engine = _engine, None
+    if engine:
+        # parts not started yet are dropped, the session resumes them
+        engine.executor.shutdown(wait=False, cancel_futures=True)
@@ -5,4 +5,13 @@ class WorkerSignals(QObject):
     finished = pyqtSignal()
     error = pyqtSignal(ULID, tuple)
     progress_message = pyqtSignal(ULID, float, str)
-    result = pyqtSignal(ULID, tuple)
\ No newline at end of file
+    result = pyqtSignal(ULID, tuple)
+    # (file_id, backend, session_key, session), an empty session means the upload is done
+    upload_session = pyqtSignal(ULID, str, str, dict)
+    # (file_id, stage, result) once a stage is done for good, a resumed task skips it
+    stage = pyqtSignal(ULID, str, dict)
+    # (file_id, backend, retry_count, message) each time a remote call is retried
+    retry = pyqtSignal(ULID, str, int, str)
+    # (file_id, backend, stage, started_at, ended_at, byte_count, retry_count, status)
+    # once a stage of the task ran, whether it succeeded or not
+    span = pyqtSignal(ULID, str, str, float, float, int, int, str)
@@ -1,18 +1,57 @@
+import os
 import re
-from typing import List
+import time
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from threading import Event, Lock
+from typing import Callable, Dict, Iterator, List, Optional
 
 from PyQt6.QtCore import QRunnable
 from ulid import ULID
 
 from ._signal import WorkerSignals
+from ._image_preprocess import ImagePreprocessor
+from ._retry import Retrier
 
 FILE_NAME_REGEX = r'[^\w_. -]'
 MODEL_FILE_UPLOAD_PROGRESS_RATIO = 0.7
 FULL_3D_MODEL_PROGRESS = 100 * MODEL_FILE_UPLOAD_PROGRESS_RATIO
 UPLOADED_MODELS_BUCKET_NAME = 'uploaded-models'
+IMAGE_UPLOAD_PROGRESS = 29
+DEFAULT_IMAGE_CONCURRENCY = 3
+# image threads of a backend, shared by every task so the Drive service and
+# the connection each thread keeps survive from one task to the next
+IMAGE_POOL_SIZE = 8
+SPAN_OK = 'ok'
+SPAN_ERROR = 'error'
+
+
+_image_executor_dict: Dict[str, ThreadPoolExecutor] = {}
+_image_executor_lock = Lock()
+
+
+def get_image_executor(backend: str) -> ThreadPoolExecutor:
+    with _image_executor_lock:
+        executor = _image_executor_dict.get(backend)
+        if executor is None:
+            executor = _image_executor_dict[backend] = ThreadPoolExecutor(
+                max_workers=IMAGE_POOL_SIZE,
+                thread_name_prefix=f'{backend}-image'
+            )
+        return executor
+
+
+def shutdown_image_executors():
+    with _image_executor_lock:
+        executor_list = list(_image_executor_dict.values())
+        _image_executor_dict.clear()
+    for executor in executor_list:
+        executor.shutdown(wait=False, cancel_futures=True)
 
 
 class _BaseUploadWorker(QRunnable):
+    backend: str = None
+
     def __init__(
             self,
             file_id: ULID,
@@ -21,7 +60,9 @@ class _BaseUploadWorker(QRunnable):
             category_list: List[str],
             blender_version: str,
             render_engine: str,
-            image_path_list: List[str]
+            image_path_list: List[str],
+            image_preprocessor: Optional[ImagePreprocessor] = None,
+            stage_dict: Optional[Dict[str, dict]] = None
         ):
         super().__init__()
         
@@ -32,5 +73,108 @@ class _BaseUploadWorker(QRunnable):
         self.blender_version = blender_version
         self.render_engine = render_engine
         self.image_path_list = image_path_list
+        self.image_preprocessor = image_preprocessor
+        self.stage_dict = dict(stage_dict or {})
+
+        self.signals = WorkerSignals()
+        self.cancel_event = Event()
+        # every remote call of the task draws on one retry budget
+        self.retrier = Retrier(
+            self.backend,
+            lambda retry_count, message: self.signals.retry.emit(self.file_id, self.backend, retry_count, message),
+            self.cancel_event
+        )
+
+    def cancel(self):
+        # a running task stops at its next remote call or progress update
+        self.cancel_event.set()
+
+    def check_cancelled(self):
+        self.retrier.check_cancelled(f"Task {self.file_id}")
+
+    def retry(self, fn: Callable, *args, **kwargs):
+        self.check_cancelled()
+        return self.retrier.call(fn, *args, **kwargs)
+
+    def get_stage(self, stage: str) -> Optional[dict]:
+        return self.stage_dict.get(stage)
+
+    def complete_stage(self, stage: str, result: dict):
+        self.stage_dict[stage] = result
+        self.signals.stage.emit(self.file_id, stage, result)
+
+    @contextmanager
+    def measure_stage(self, stage: str) -> Iterator[dict]:
+        # the stage adds what it actually sent to span['byte_count'], a copy
+        # or a skipped upload sends nothing
+        self.check_cancelled()
+        span = {'byte_count': 0}
+        started_at = time.time()
+        retry_count = self.retrier.retry_count
+        status = SPAN_ERROR
+        try:
+            yield span
+            status = SPAN_OK
+        finally:
+            self.signals.span.emit(
+                self.file_id, self.backend, stage,
+                started_at, time.time(),
+                span['byte_count'],
+                self.retrier.retry_count - retry_count,
+                status
+            )
+
+    def upload_images(
+            self,
+            upload_image: Callable[[int, str], str],
+            backend_label: str,
+            image_concurrency: int = DEFAULT_IMAGE_CONCURRENCY
+        ) -> List[str]:
+        image_count = len(self.image_path_list)
+        if not image_count:
+            return []
+        uploaded_count = 0
+        lock = Lock()
+
+        self.signals.progress_message.emit(
+            self.file_id,
+            FULL_3D_MODEL_PROGRESS,
+            f"Uploading {image_count} images to {backend_label}"
+        )
+
+        def upload(i: int, image_path: str) -> str:
+            nonlocal uploaded_count
+            self.check_cancelled()
+            # both backends upload the same processed copy, whichever asks
+            # first waits for the pool and the other one reuses it
+            if self.image_preprocessor:
+                image_path = self.image_preprocessor.preprocess(image_path)
+            result = upload_image(i, image_path)
+            with lock:
+                uploaded_count += 1
+                self.signals.progress_message.emit(
+                    self.file_id,
+                    FULL_3D_MODEL_PROGRESS + (uploaded_count * IMAGE_UPLOAD_PROGRESS / image_count),
+                    f"Uploaded image {os.path.basename(image_path)} to {backend_label} - {uploaded_count}/{image_count}"
+                )
+            return result
 
-        self.signals = WorkerSignals()
\ No newline at end of file
+        # at most image_concurrency images of this task are in the shared
+        # pool at once, the results keep the original image order
+        executor = get_image_executor(self.backend)
+        concurrency = max(min(image_concurrency, image_count), 1)
+        future_list = []
+        running_set = set()
+        try:
+            for i, image_path in enumerate(self.image_path_list):
+                if len(running_set) >= concurrency:
+                    done_set, running_set = wait(running_set, return_when=FIRST_COMPLETED)
+                    for future in done_set:
+                        future.result()
+                future = executor.submit(upload, i, image_path)
+                future_list.append(future)
+                running_set.add(future)
+        finally:
+            # an image that failed stops the task only once the others are done
+            wait(running_set)
+        return [x.result() for x in future_list]
@@ -1,67 +1,252 @@
-from typing import List
-import sys
-import traceback
+import time
+import json
+import threading
+from typing import Dict, List, Optional, Tuple
 
-from PyQt6.QtCore import QRunnable, pyqtSlot
+from PyQt6.QtCore import QObject, pyqtSignal
 
 import requests
+from requests.adapters import HTTPAdapter
 from ulid import ULID
 
-from ._signal import WorkerSignals
-
-class APIUpdateWorker(QRunnable):
-    def __init__(
-            self,
-            file_id: ULID,
-            name: str,
-            category_list: List[str],
-            r2_model_path: str,
-            r2_image_path_list: List[str],
-            google_drive_model_path: str,
-            google_drive_image_path_list: List[str],
-            blender_version: str,
-            render_engine: str
-        ):
-        super().__init__()
-        
+from ._retry import (
+    FATAL, RETRYABLE,
+    classify_status, parse_retry_after, get_backoff_delay
+)
+from ._upload_base import SPAN_OK, SPAN_ERROR
+
+API_BACKEND = 'api'
+API_COMMIT_STAGE = 'api_commit'
+
+DEFAULT_API_URL = 'https://uploader-api.wild-field-e58d.workers.dev/model'
+DEFAULT_TIMEOUT = 10
+DEFAULT_BATCH_SIZE = 20
+DEFAULT_POOL_SIZE = 4
+# a commit is never given up on for being slow, only the wait is capped
+BACKOFF_MAX = 300.0
+
+
+class APICommitError(Exception):
+    def __init__(self, message: str, kind: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.kind = kind
+        self.retry_after = retry_after
+
+    @property
+    def is_retriable(self) -> bool:
+        return self.kind != FATAL
+
+
+def check_response(resp: requests.Response):
+    if resp.ok:
+        return
+    raise APICommitError(
+        f"{resp.status_code} {resp.reason}: {resp.text[:200]}",
+        classify_status(resp.status_code),
+        parse_retry_after(resp.headers.get('Retry-After'))
+    )
+
+
+class _OutboxEntry:
+    def __init__(self, file_id: ULID, payload: dict, attempt_count: int, next_attempt_at: float):
         self.file_id = file_id
-        self.name = name
-        self.category_list = category_list
-        self.r2_model_path = r2_model_path
-        self.r2_image_path_list = r2_image_path_list
-        self.google_drive_model_path = google_drive_model_path
-        self.google_drive_image_path_list = google_drive_image_path_list
-        self.blender_version = blender_version
-        self.render_engine = render_engine
-        self.signals = WorkerSignals()
-        
-    @pyqtSlot()
-    def run(self):
-        print(f"sending {self.file_id} result to server")
+        self.payload = payload
+        self.attempt_count = attempt_count
+        self.next_attempt_at = next_attempt_at
+
+
+class APIOutboxSignals(QObject):
+    # file_id, model id
+    committed = pyqtSignal(ULID, str)
+    # file_id, error, the commit was rejected and is not retried
+    failed = pyqtSignal(ULID, str)
+    # file_id, attempt_count, next_attempt_at, error
+    retried = pyqtSignal(ULID, int, float, str)
+    # file_id, backend, stage, started_at, ended_at, byte_count, retry_count, status
+    # once per attempt, the same as WorkerSignals.span
+    span = pyqtSignal(ULID, str, str, float, float, int, int, str)
+
+
+class APIOutbox(threading.Thread):
+    # commits are persisted by the caller before put(), this thread only
+    # sends them, so a commit that was never acknowledged is sent again after
+    # a restart with the same idempotency key
+    def __init__(self, api_config: Optional[dict] = None):
+        super().__init__(name='api-outbox', daemon=True)
+        api_config = api_config or {}
+        self.url = api_config.get('url', DEFAULT_API_URL)
+        # POST {"models": [...]} -> {"results": [{"idempotency_key", "id"} | {"idempotency_key", "error"}]}
+        self.batch_url: Optional[str] = api_config.get('batch_url')
+        self.batch_size = api_config.get('batch_size', DEFAULT_BATCH_SIZE)
+        self.timeout = api_config.get('timeout', DEFAULT_TIMEOUT)
+        self.signals = APIOutboxSignals()
+
+        # one keep-alive connection pool for every commit
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=api_config.get('pool_size', DEFAULT_POOL_SIZE))
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self.condition = threading.Condition()
+        self.entry_dict: Dict[ULID, _OutboxEntry] = {}
+        self.sending_set = set()
+        # commits deleted while they were being sent, their answer is dropped
+        self.discarded_set = set()
+        self.is_stopping = False
+
+    def put(self, file_id: ULID, payload: dict, attempt_count: int = 0, next_attempt_at: float = 0.0):
+        with self.condition:
+            self.entry_dict[file_id] = _OutboxEntry(file_id, payload, attempt_count, next_attempt_at)
+            self.discarded_set.discard(file_id)
+            self.condition.notify()
+
+    def discard(self, file_id: ULID):
+        with self.condition:
+            self.entry_dict.pop(file_id, None)
+            if file_id in self.sending_set:
+                self.discarded_set.add(file_id)
+
+    def is_pending(self, file_id: ULID) -> bool:
+        with self.condition:
+            return file_id in self.entry_dict or file_id in self.sending_set
+
+    def pending_count(self) -> int:
+        with self.condition:
+            return len(self.entry_dict) + len(self.sending_set)
+
+    def stop(self, timeout: Optional[float] = None):
+        with self.condition:
+            self.is_stopping = True
+            self.condition.notify()
+        if self.is_alive():
+            self.join(timeout)
+        self.session.close()
+
+    def take_due_entries(self) -> Optional[List[_OutboxEntry]]:
+        with self.condition:
+            while not self.is_stopping:
+                now = time.time()
+                due_list = sorted(
+                    (x for x in self.entry_dict.values() if x.next_attempt_at <= now),
+                    key=lambda x: x.next_attempt_at
+                )[:self.batch_size if self.batch_url else 1]
+                if due_list:
+                    for entry in due_list:
+                        self.entry_dict.pop(entry.file_id)
+                        self.sending_set.add(entry.file_id)
+                    return due_list
+                next_attempt_at = min((x.next_attempt_at for x in self.entry_dict.values()), default=None)
+                self.condition.wait(None if next_attempt_at is None else next_attempt_at - now)
+        return None
+
+    def send_one(self, entry: _OutboxEntry) -> str:
+        resp = self.session.post(
+            self.url,
+            json=entry.payload,
+            headers={'Idempotency-Key': str(entry.file_id)},
+            timeout=self.timeout
+        )
+        check_response(resp)
+        return str(resp.json()['id'])
+
+    def send_batch(self, entry_list: List[_OutboxEntry]) -> Dict[ULID, Tuple[Optional[str], Optional[APICommitError]]]:
+        resp = self.session.post(
+            self.batch_url,
+            json={'models': [{**x.payload, 'idempotency_key': str(x.file_id)} for x in entry_list]},
+            timeout=self.timeout
+        )
+        if resp.status_code in (404, 405, 501):
+            print(f"{self.batch_url} does not accept batches ({resp.status_code}), commits are sent one by one")
+            self.batch_url = None
+            return {x.file_id: self.send_entry(x) for x in entry_list}
+        check_response(resp)
+
+        result_dict = {}
+        for item in resp.json()['results']:
+            file_id = ULID.from_str(item['idempotency_key'])
+            if 'id' in item:
+                result_dict[file_id] = (str(item['id']), None)
+            else:
+                result_dict[file_id] = (None, APICommitError(str(item.get('error')), RETRYABLE if item.get('retriable') else FATAL))
+        # an entry the server did not answer for is tried again
+        for entry in entry_list:
+            result_dict.setdefault(entry.file_id, (None, APICommitError("missing from the batch response", RETRYABLE)))
+        return result_dict
+
+    def send_entry(self, entry: _OutboxEntry) -> Tuple[Optional[str], Optional[APICommitError]]:
+        try:
+            return self.send_one(entry), None
+        except APICommitError as error:
+            return None, error
+        except (requests.ConnectionError, requests.Timeout) as error:
+            return None, APICommitError(str(error), RETRYABLE)
+        except (requests.RequestException, ValueError, KeyError) as error:
+            return None, APICommitError(f"unexpected response: {error}", FATAL)
+
+    def send(self, entry_list: List[_OutboxEntry]) -> Dict[ULID, Tuple[Optional[str], Optional[APICommitError]]]:
+        if len(entry_list) == 1 and not self.batch_url:
+            return {entry_list[0].file_id: self.send_entry(entry_list[0])}
         try:
-            print("sending result to server")
-            resp = requests.post(
-                'https://uploader-api.wild-field-e58d.workers.dev/model',
-                json={
-                    'name': self.name,
-                    'category_list': self.category_list,
-                    'r2_model_path': self.r2_model_path,
-                    'r2_image_path_list': self.r2_image_path_list,
-                    'google_drive_model_path': self.google_drive_model_path,
-                    'google_drive_image_path_list': self.google_drive_image_path_list,
-                    'blender_version': self.blender_version,
-                    'render_engine': self.render_engine
-                },
-                timeout=10
-            )
-            resp.raise_for_status()
-            resp_json = resp.json()
-            print("new model id: ", resp_json['id'])
-        except:
-            traceback.print_exc()
-            exctype, value = sys.exc_info()[:2]
-            self.signals.error.emit(self.file_id, (exctype, value, traceback.format_exc()))
-        else:
-            self.signals.result.emit(self.file_id, (resp_json['id'],))
-        finally:
-            self.signals.finished.emit()
\ No newline at end of file
+            return self.send_batch(entry_list)
+        except APICommitError as error:
+            # a rejected batch says nothing about each commit, they go one by one
+            if not error.is_retriable:
+                return {x.file_id: self.send_entry(x) for x in entry_list}
+            return {x.file_id: (None, error) for x in entry_list}
+        except (requests.ConnectionError, requests.Timeout) as error:
+            return {x.file_id: (None, APICommitError(str(error), RETRYABLE)) for x in entry_list}
+        except (requests.RequestException, ValueError, KeyError) as error:
+            return {x.file_id: (None, APICommitError(f"unexpected response: {error}", RETRYABLE)) for x in entry_list}
+
+    def run(self):
+        while True:
+            entry_list = self.take_due_entries()
+            if entry_list is None:
+                return
+            print(f"Sending {len(entry_list)} API commit(s)")
+            started_at = time.time()
+            result_dict = self.send(entry_list)
+            ended_at = time.time()
+
+            for entry in entry_list:
+                model_id, error = result_dict[entry.file_id]
+                is_retried = error is not None and error.is_retriable
+                if is_retried:
+                    attempt_count = entry.attempt_count + 1
+                    next_attempt_at = time.time() + get_backoff_delay(
+                        error.kind, entry.attempt_count, error.retry_after, max_delay=BACKOFF_MAX
+                    )
+                # the answer is settled under the lock, a discard() in between
+                # would otherwise miss the commit and it would be queued again
+                with self.condition:
+                    self.sending_set.discard(entry.file_id)
+                    is_discarded = entry.file_id in self.discarded_set
+                    self.discarded_set.discard(entry.file_id)
+                    # put() while sending replaced the commit, it is sent again
+                    is_replaced = entry.file_id in self.entry_dict
+                    if is_discarded:
+                        pass
+                    elif not is_retried and is_replaced:
+                        self.entry_dict.pop(entry.file_id)
+                    elif is_retried and not is_replaced:
+                        self.put(entry.file_id, entry.payload, attempt_count, next_attempt_at)
+                if is_discarded:
+                    print(f"{entry.file_id} was deleted while its API commit was sent, dropping the answer")
+                    continue
+
+                self.signals.span.emit(
+                    entry.file_id, API_BACKEND, API_COMMIT_STAGE,
+                    started_at, ended_at,
+                    len(json.dumps(entry.payload)),
+                    1 if entry.attempt_count else 0,
+                    SPAN_OK if error is None else SPAN_ERROR
+                )
+                if error is None:
+                    print(f"{entry.file_id} committed as model {model_id}")
+                    self.signals.committed.emit(entry.file_id, model_id)
+                elif not is_retried:
+                    print(f"API rejected the commit of {entry.file_id}: {error}")
+                    self.signals.failed.emit(entry.file_id, str(error))
+                elif not is_replaced:
+                    print(f"API commit of {entry.file_id} failed ({error}), attempt {attempt_count}, retrying at {time.ctime(next_attempt_at)}")
+                    self.signals.retried.emit(entry.file_id, attempt_count, next_attempt_at, str(error))
@@ -2,22 +2,36 @@ import os
 import traceback
 import sys
 import mimetypes
-from typing import List
+from typing import TYPE_CHECKING, List, Dict, Optional
 
 from PyQt6.QtCore import pyqtSlot
 
 from ulid import ULID
 
-from googleapiclient.discovery import build
-from google.oauth2.credentials import Credentials
-from googleapiclient.http import MediaFileUpload
-
 from ._upload_base import (
     _BaseUploadWorker,
-    FULL_3D_MODEL_PROGRESS
+    FULL_3D_MODEL_PROGRESS,
+    DEFAULT_IMAGE_CONCURRENCY
 )
+from ._google_service import get_google_service
+from ._bandwidth import get_bandwidth_limiter
+from ._google_drive_folder import GoogleDriveFolderResolver
+from ._content_index import ContentIndex
+from ._image_preprocess import ImagePreprocessor
+from ._checksum import ChecksumMismatchError
+
+if TYPE_CHECKING:
+    from google.oauth2.credentials import Credentials
+
+GOOGLE_DRIVE_BACKEND = 'google_drive'
+GOOGLE_DRIVE_FOLDER_STAGE = 'google_drive_folder'
+GOOGLE_DRIVE_MODEL_STAGE = 'google_drive_model'
+GOOGLE_DRIVE_IMAGES_STAGE = 'google_drive_images'
+MODEL_START_PROGRESS = 20
 
 class GoogleDriveUploadWorker(_BaseUploadWorker):
+    backend = GOOGLE_DRIVE_BACKEND
+
     def __init__(
             self,
             file_id: ULID,
@@ -27,138 +41,244 @@ class GoogleDriveUploadWorker(_BaseUploadWorker):
             blender_version: str,
             render_engine: str,
             image_path_list: List[str],
-            credentials: Credentials,
-            folder_config: dict = {}
+            credentials: 'Credentials',
+            folder_resolver: GoogleDriveFolderResolver,
+            content_index: ContentIndex,
+            folder_config: dict = {},
+            upload_config: dict = {},
+            upload_session_dict: Dict[str, dict] = {},
+            image_preprocessor: Optional[ImagePreprocessor] = None,
+            stage_dict: Optional[Dict[str, dict]] = None
         ):
         super().__init__(
             file_id, file_path, file_name,
             category_list,
             blender_version, render_engine,
-            image_path_list
+            image_path_list,
+            image_preprocessor,
+            stage_dict
         )
         self.credentials = credentials
+        self.folder_resolver = folder_resolver
+        self.content_index = content_index
         self.folder_config = folder_config or {}
-        self.drive_service = build('drive', 'v3', credentials=self.credentials)
+        self.upload_config = upload_config or {}
+        self.upload_session_dict = upload_session_dict or {}
+        self.drive_service = None
 
-    @pyqtSlot()
-    def run(self):
-        try:
-            self.signals.progress_message.emit(self.file_id, 1, "Preparing for uploading to Google Drive")
+    def resolve_parent_folder(self, refresh: bool = False) -> str:
+        root_folder_id = self.folder_config.get("id")
+        drive_id = self.folder_config.get("drive_id")
+        folder_path = '/'.join(self.category_list)
+        if refresh:
+            self.folder_resolver.invalidate(drive_id, root_folder_id, self.category_list)
 
-            self.signals.progress_message.emit(self.file_id, 3, "Checking for existing folders")
-            parent_folder_id = self.folder_config.get("id")
-            drive_id = self.folder_config.get("drive_id")
-            folder_metadata = {
-                'mimeType': 'application/vnd.google-apps.folder'
-            }
-            current_folder_path = ''
-            folder_checking_progress = 10
-            for category in self.category_list:
-                folder_metadata['name'] = category
-                current_folder_path += f'{category}/'
-                self.signals.progress_message.emit(self.file_id, folder_checking_progress, f"Checking folder {current_folder_path}")
-                conditions = [
-                    f"name='{category}'",
-                    "mimeType='application/vnd.google-apps.folder'",
-                    "trashed=false"
-                ]
-                if parent_folder_id:
-                    conditions.append(f"'{parent_folder_id}' in parents")
-                    folder_metadata['parents'] = [parent_folder_id]
-                
-                query = " and ".join(conditions)
-                list_params = {
-                    'q': query,
-                    'supportsAllDrives': True,
-                    'fields': 'files(id, name, parents)'
-                }
-                if drive_id:
-                    list_params['supportsAllDrives'] = True
-                    list_params['includeItemsFromAllDrives'] = True
-                    list_params['driveId'] = drive_id
-                    list_params['corpora'] = 'drive'
-                    
-                results = self.drive_service.files().list(**list_params).execute()
-                
-                items = results.get('files', [])
-                if items:
-                    self.signals.progress_message.emit(self.file_id, folder_checking_progress + 10, f"Folder {current_folder_path} already existed")
-                    parent_folder_id = items[0]['id']
-                else:
-                    self.signals.progress_message.emit(self.file_id, folder_checking_progress + 5, f"Folder {current_folder_path} does not exist, creating")
-                    folder = self.drive_service.files().create(
-                        body=folder_metadata,
+        if self.folder_resolver.is_cached(drive_id, root_folder_id, self.category_list):
+            self.signals.progress_message.emit(self.file_id, 10, f"Folder {folder_path}/ already known")
+        else:
+            self.signals.progress_message.emit(self.file_id, 10, f"Checking folder {folder_path}/")
+
+        parent_folder_id = self.folder_resolver.resolve(
+            self.drive_service, drive_id,
+            root_folder_id, self.category_list,
+            self.retrier
+        )
+        self.signals.progress_message.emit(self.file_id, 15, f"Folder {folder_path}/ is ready")
+        return parent_folder_id
+
+    def find_existing_file(self, drive_service, sha256: str, file_path: str) -> Optional[dict]:
+        from googleapiclient.errors import HttpError
+        for remote_file_id in self.content_index.lookup(GOOGLE_DRIVE_BACKEND, sha256):
+            try:
+                remote_file = self.retry(
+                    drive_service.files().get(
+                        fileId=remote_file_id,
                         supportsAllDrives=True,
-                        fields='id'
-                    ).execute()
-                    self.signals.progress_message.emit(self.file_id, folder_checking_progress + 5, f"Folder {current_folder_path} created")
-                    parent_folder_id = folder.get('id')
-
-            _, ext = os.path.splitext(self.file_path)
-            file_name = f'{self.file_name}{ext}'
-            
-            file_metadata = {
-                'name': file_name,
-                'parents': [parent_folder_id]
-            }
-
-            mime_type, _ = mimetypes.guess_type(self.file_path)
-            media = MediaFileUpload(self.file_path, mimetype=mime_type)
-            
+                        fields='id, name, parents, trashed, md5Checksum'
+                    ).execute,
+                    description=f"Checking {remote_file_id} on Google Drive"
+                )
+            except HttpError as error:
+                if error.resp.status != 404:
+                    raise
+                remote_file = None
+            # a file given new content since it was indexed is not reused
+            md5 = self.content_index.get_cached_md5(file_path)
+            if remote_file and not remote_file.get('trashed') \
+                and remote_file.get('md5Checksum') in (None, md5):
+                return remote_file
+            self.content_index.remove(GOOGLE_DRIVE_BACKEND, sha256, remote_file_id)
+        return None
+
+    def upload_model(self, parent_folder_id: str, span: dict) -> str:
+        from ._google_drive_resumable import GoogleDriveResumableUpload, DEFAULT_CHUNK_SIZE
+        _, ext = os.path.splitext(self.file_path)
+        file_name = f'{self.file_name}{ext}'
+        
+        file_metadata = {
+            'name': file_name,
+            'parents': [parent_folder_id]
+        }
+
+        model_sha256 = self.content_index.hash_file(self.file_path)
+        existing_file = self.find_existing_file(self.drive_service, model_sha256, self.file_path)
+        if existing_file and existing_file.get('name') == file_name \
+            and parent_folder_id in existing_file.get('parents', []):
+            print(f"{file_name} already exists in folder {parent_folder_id}, skipping upload")
+            return existing_file['id']
+        if existing_file:
             self.signals.progress_message.emit(
                 self.file_id,
-                folder_checking_progress + 5,
-                "Uploading model to Google Drive"
+                MODEL_START_PROGRESS,
+                f"Copying existing model {existing_file['name']} on Google Drive"
             )
-
-            file = self.drive_service.files() \
-                .create(
+            copied_file = self.retry(
+                self.drive_service.files().copy(
+                    fileId=existing_file['id'],
                     body=file_metadata,
-                    media_body=media,
                     supportsAllDrives=True,
-                    fields="id") \
-                .execute()
-            model_file_id = file.get("id")
-            print(f'File ID: {model_file_id}')
+                    fields='id'
+                ).execute,
+                description=f"Copying {existing_file['name']} on Google Drive",
+                is_idempotent=False
+            )
+            self.content_index.add(GOOGLE_DRIVE_BACKEND, model_sha256, copied_file['id'])
+            return copied_file['id']
 
+        self.signals.progress_message.emit(
+            self.file_id,
+            MODEL_START_PROGRESS,
+            "Uploading model to Google Drive"
+        )
+
+        def upload_progress(transfered, file_size):
+            self.check_cancelled()
+            # chunks sent before a restart are not counted again
+            span.setdefault('resumed_size', transfered)
+            span['byte_count'] = transfered - span['resumed_size']
+            progress = int(transfered / file_size * 100) if file_size else 100
             self.signals.progress_message.emit(
                 self.file_id,
-                FULL_3D_MODEL_PROGRESS,
-                "Uploaded images to Google Drive"
+                MODEL_START_PROGRESS + progress * (FULL_3D_MODEL_PROGRESS - MODEL_START_PROGRESS) / 100,
+                f"Uploading {file_name} to Google Drive: {progress}%"
             )
-            image_file_id_list = []
-            image_count = len(self.image_path_list)
-            for i, image_path in enumerate(self.image_path_list):
+
+        session_key = f'{parent_folder_id}/{file_name}'
+        resumable_upload = GoogleDriveResumableUpload(
+            self.drive_service,
+            self.file_path,
+            file_metadata,
+            chunk_size=self.upload_config.get('chunk_size', DEFAULT_CHUNK_SIZE),
+            session=self.upload_session_dict.get(session_key),
+            on_checkpoint=lambda session: self.signals.upload_session.emit(
+                self.file_id, GOOGLE_DRIVE_BACKEND, session_key, session
+            ),
+            on_progress=upload_progress,
+            expected_md5=self.content_index.get_cached_md5(self.file_path),
+            retrier=self.retrier
+        )
+        try:
+            file = resumable_upload.upload()
+        except ChecksumMismatchError:
+            # the session points at a finished but corrupted upload, a retry
+            # has to start over
+            self.signals.upload_session.emit(self.file_id, GOOGLE_DRIVE_BACKEND, session_key, {})
+            raise
+        # the upload is complete, nothing left to resume
+        self.signals.upload_session.emit(self.file_id, GOOGLE_DRIVE_BACKEND, session_key, {})
+        self.content_index.add(GOOGLE_DRIVE_BACKEND, model_sha256, file.get("id"))
+        return file.get("id")
+
+    @pyqtSlot()
+    def run(self):
+        # googleapiclient loads with the first Drive task, the window does not
+        # wait for it
+        from googleapiclient.http import MediaFileUpload
+        from googleapiclient.errors import HttpError
+        try:
+            self.signals.progress_message.emit(self.file_id, 1, "Preparing for uploading to Google Drive")
+            self.drive_service = get_google_service('drive', 'v3', self.credentials)
+
+            folder_stage = self.get_stage(GOOGLE_DRIVE_FOLDER_STAGE)
+            if folder_stage:
+                parent_folder_id = folder_stage['folder_id']
+            else:
+                self.signals.progress_message.emit(self.file_id, 3, "Checking for existing folders")
+                with self.measure_stage(GOOGLE_DRIVE_FOLDER_STAGE):
+                    parent_folder_id = self.resolve_parent_folder()
+                self.complete_stage(GOOGLE_DRIVE_FOLDER_STAGE, {'folder_id': parent_folder_id})
+
+            model_stage = self.get_stage(GOOGLE_DRIVE_MODEL_STAGE)
+            if model_stage:
+                model_file_id = model_stage['file_id']
+                print(f"{model_file_id} was uploaded before the restart, skipping upload")
+            else:
+                with self.measure_stage(GOOGLE_DRIVE_MODEL_STAGE) as span:
+                    try:
+                        model_file_id = self.upload_model(parent_folder_id, span)
+                    except HttpError as error:
+                        # a cached folder may have been deleted on Drive since we saw it
+                        if error.resp.status != 404:
+                            raise
+                        print(f"Folder {parent_folder_id} not found, resolving again")
+                        parent_folder_id = self.resolve_parent_folder(refresh=True)
+                        self.complete_stage(GOOGLE_DRIVE_FOLDER_STAGE, {'folder_id': parent_folder_id})
+                        model_file_id = self.upload_model(parent_folder_id, span)
+                self.complete_stage(GOOGLE_DRIVE_MODEL_STAGE, {'file_id': model_file_id})
+            print(f'File ID: {model_file_id}')
+
+            # sizes of the images actually sent, appended from the image threads
+            image_size_list = []
+
+            def upload_image(i: int, image_path: str) -> str:
+                drive_service = get_google_service('drive', 'v3', self.credentials)
+                # identical previews are shared between models instead of stored again
+                image_sha256 = self.content_index.hash_file(image_path)
+                existing_image_file = self.find_existing_file(drive_service, image_sha256, image_path)
+                if existing_image_file:
+                    print(f"Image {image_path} already stored as {existing_image_file['id']}")
+                    return existing_image_file['id']
+
                 fs_image_file_name = os.path.basename(image_path)
                 image_file_name = f'{self.file_name}-preview-{i + 1}{os.path.splitext(fs_image_file_name)[1]}'
-                
-                self.signals.progress_message.emit(
-                    self.file_id,
-                    FULL_3D_MODEL_PROGRESS + (i * 29 / image_count),
-                    f"Uploading image {image_file_name} to Google Drive - {i + 1}/{image_count}"
-                )
-                
                 file_metadata = {
                     'name': image_file_name,
                     'parents': [parent_folder_id]
                 }
                 image_mime_type, _ = mimetypes.guess_type(image_path)
                 media = MediaFileUpload(image_path, mimetype=image_mime_type)
-                image_file = self.drive_service.files() \
-                    .create(
+                get_bandwidth_limiter().throttle(GOOGLE_DRIVE_BACKEND, os.path.getsize(image_path), self.cancel_event)
+                image_file = self.retry(
+                    drive_service.files().create(
                         body=file_metadata,
                         media_body=media,
                         supportsAllDrives=True,
-                        fields="id"
-                    ) \
-                    .execute()
-                image_file_id_list.append(image_file.get("id"))
-                print(f'Image File ID: {image_file.get("id")}')
-                self.signals.progress_message.emit(
-                    self.file_id,
-                    FULL_3D_MODEL_PROGRESS + ((i + 1) * 29 / image_count),
-                    f"Uploaded image {fs_image_file_name} as {image_file_name}"
+                        fields="id, md5Checksum"
+                    ).execute,
+                    description=f"Uploading image {fs_image_file_name} to Google Drive",
+                    is_idempotent=False
                 )
+                image_md5 = self.content_index.get_cached_md5(image_path)
+                if image_md5 and image_file.get("md5Checksum") not in (None, image_md5):
+                    raise ChecksumMismatchError(
+                        f'Google Drive file {image_file.get("id")} has md5 {image_file.get("md5Checksum")}, expected {image_md5}'
+                    )
+                image_size_list.append(os.path.getsize(image_path))
+                self.content_index.add(GOOGLE_DRIVE_BACKEND, image_sha256, image_file.get("id"))
+                print(f'Image File ID: {image_file.get("id")}')
+                return image_file.get("id")
+
+            image_stage = self.get_stage(GOOGLE_DRIVE_IMAGES_STAGE)
+            if image_stage:
+                image_file_id_list = image_stage['file_id_list']
+            else:
+                with self.measure_stage(GOOGLE_DRIVE_IMAGES_STAGE) as span:
+                    image_file_id_list = self.upload_images(
+                        upload_image, "Google Drive",
+                        self.upload_config.get('image_concurrency', DEFAULT_IMAGE_CONCURRENCY)
+                    )
+                    span['byte_count'] = sum(image_size_list)
+                self.complete_stage(GOOGLE_DRIVE_IMAGES_STAGE, {'file_id_list': image_file_id_list})
         except:
             traceback.print_exc()
             exctype, value = sys.exc_info()[:2]
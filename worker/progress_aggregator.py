@@ -0,0 +1,67 @@
+from typing import Dict, Tuple
+
+from PyQt6.QtCore import QObject, QTimer, pyqtSignal, pyqtSlot
+from ulid import ULID
+
+UI_INTERVAL_MS = 100
+DB_INTERVAL_MS = 1000
+
+
+class ProgressAggregatorSignals(QObject):
+    ui_progress_message = pyqtSignal(ULID, float, str)
+    db_progress_message = pyqtSignal(ULID, float, str)
+
+
+class ProgressAggregator(QObject):
+    def __init__(self, ui_interval: int = UI_INTERVAL_MS, db_interval: int = DB_INTERVAL_MS):
+        super().__init__()
+        self.signals = ProgressAggregatorSignals()
+        # only the latest update of each task is kept until the next tick
+        self.ui_pending_dict: Dict[ULID, Tuple[float, str]] = {}
+        self.db_pending_dict: Dict[ULID, Tuple[float, str]] = {}
+
+        self.ui_timer = QTimer(self)
+        self.ui_timer.setInterval(ui_interval)
+        self.ui_timer.timeout.connect(self.flush_ui)
+        self.db_timer = QTimer(self)
+        self.db_timer.setInterval(db_interval)
+        self.db_timer.timeout.connect(self.flush_db)
+
+    @pyqtSlot(ULID, float, str)
+    def update(self, file_id: ULID, progress: float, message: str):
+        self.ui_pending_dict[file_id] = (progress, message)
+        self.db_pending_dict[file_id] = (progress, message)
+        if not self.ui_timer.isActive():
+            self.ui_timer.start()
+        if not self.db_timer.isActive():
+            self.db_timer.start()
+
+    @pyqtSlot()
+    def flush_ui(self):
+        pending_dict, self.ui_pending_dict = self.ui_pending_dict, {}
+        for file_id, (progress, message) in pending_dict.items():
+            self.signals.ui_progress_message.emit(file_id, progress, message)
+        if not self.ui_pending_dict:
+            self.ui_timer.stop()
+
+    @pyqtSlot()
+    def flush_db(self):
+        pending_dict, self.db_pending_dict = self.db_pending_dict, {}
+        for file_id, (progress, message) in pending_dict.items():
+            self.signals.db_progress_message.emit(file_id, progress, message)
+        if not self.db_pending_dict:
+            self.db_timer.stop()
+
+    @pyqtSlot(ULID)
+    def flush(self, file_id: ULID):
+        ui_pending = self.ui_pending_dict.pop(file_id, None)
+        if ui_pending:
+            self.signals.ui_progress_message.emit(file_id, *ui_pending)
+        db_pending = self.db_pending_dict.pop(file_id, None)
+        if db_pending:
+            self.signals.db_progress_message.emit(file_id, *db_pending)
+
+    @pyqtSlot()
+    def flush_all(self):
+        self.flush_ui()
+        self.flush_db()
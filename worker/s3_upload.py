@@ -1,9 +1,7 @@
 import os
 import traceback
 import sys
-from typing import List
-
-import boto3
+from typing import List, Dict, Optional
 
 from PyQt6.QtCore import pyqtSlot
 
@@ -11,16 +9,29 @@ from ulid import ULID
 
 from ._upload_base import (
     _BaseUploadWorker,
-    FULL_3D_MODEL_PROGRESS,
     MODEL_FILE_UPLOAD_PROGRESS_RATIO,
-    UPLOADED_MODELS_BUCKET_NAME
+    UPLOADED_MODELS_BUCKET_NAME,
+    DEFAULT_IMAGE_CONCURRENCY
 )
-
-s3_client = boto3.client(
-    "s3",
+from ._s3_transfer import S3TransferEngine, get_s3_transfer_engine
+from ._content_index import ContentIndex
+from ._image_preprocess import ImagePreprocessor
+from ._checksum import parse_md5_etag
+from ._s3_multipart import (
+    S3MultipartUpload,
+    DEFAULT_PART_SIZE,
+    DEFAULT_PART_CONCURRENCY
 )
 
+S3_BACKEND = 's3'
+S3_MODEL_STAGE = 's3_model'
+S3_IMAGES_STAGE = 's3_images'
+# x-amz-meta-sha256, what a key holds is checked before it is reused
+SHA256_METADATA_KEY = 'sha256'
+
 class S3UploadWorker(_BaseUploadWorker):
+    backend = S3_BACKEND
+
     def __init__(
             self,
             file_id: ULID,
@@ -30,75 +41,162 @@ class S3UploadWorker(_BaseUploadWorker):
             blender_version: str,
             render_engine: str,
             image_path_list: List[str],
+            content_index: ContentIndex,
+            upload_config: dict = {},
+            upload_session_dict: Dict[str, dict] = {},
+            image_preprocessor: Optional[ImagePreprocessor] = None,
+            stage_dict: Optional[Dict[str, dict]] = None
         ):
         super().__init__(
             file_id, file_path, file_name,
             category_list,
             blender_version, render_engine,
-            image_path_list
+            image_path_list,
+            image_preprocessor,
+            stage_dict
         )
         _, ext = os.path.splitext(self.file_path)
         self.model_file_name = f'{os.path.basename(self.file_path)}{ext}'
         self.category_path = os.path.join(*self.category_list)
+        self.content_index = content_index
+        self.upload_config = upload_config or {}
+        self.upload_session_dict = upload_session_dict or {}
     
+    def upload_model(self, engine: S3TransferEngine, model_key: str, model_sha256: str, span: dict):
+        def upload_progress(transfered, file_size):
+            self.check_cancelled()
+            # parts sent before a restart are not counted again
+            span.setdefault('resumed_size', transfered)
+            span['byte_count'] = transfered - span['resumed_size']
+            progress = int(transfered / file_size * 100) if file_size else 100
+            self.signals.progress_message.emit(
+                self.file_id,
+                progress * MODEL_FILE_UPLOAD_PROGRESS_RATIO,
+                f"Uploading {self.model_file_name}: {progress}%"
+            )
+
+        session_key = f'{UPLOADED_MODELS_BUCKET_NAME}/{model_key}'
+        multipart_upload = S3MultipartUpload(
+            engine,
+            UPLOADED_MODELS_BUCKET_NAME,
+            model_key,
+            self.file_path,
+            part_size=self.upload_config.get('multipart_part_size', DEFAULT_PART_SIZE),
+            max_concurrency=self.upload_config.get('multipart_concurrency', DEFAULT_PART_CONCURRENCY),
+            session=self.upload_session_dict.get(session_key),
+            on_checkpoint=lambda session: self.signals.upload_session.emit(
+                self.file_id, S3_BACKEND, session_key, session
+            ),
+            on_progress=upload_progress,
+            retrier=self.retrier,
+            metadata={SHA256_METADATA_KEY: model_sha256}
+        )
+        multipart_upload.upload()
+        # the upload is complete, nothing left to resume
+        self.signals.upload_session.emit(self.file_id, S3_BACKEND, session_key, {})
+
+    def is_same_content(self, head: dict, sha256: str, file_path: str) -> bool:
+        if head.get('ContentLength') != os.path.getsize(file_path):
+            return False
+        stored_sha256 = head.get('Metadata', {}).get(SHA256_METADATA_KEY)
+        if stored_sha256:
+            return stored_sha256 == sha256
+        # a multipart ETag without the metadata cannot be checked, the key is
+        # not trusted
+        etag_digest = parse_md5_etag(head.get('ETag'))
+        md5 = self.content_index.get_cached_md5(file_path)
+        return etag_digest is not None and etag_digest.hex() == md5
+
+    def find_existing_object(self, engine: S3TransferEngine, sha256: str, file_path: str) -> Optional[str]:
+        # a key may have been written again with other bytes since it was
+        # indexed, only one still holding this content is reused
+        for key in self.content_index.lookup(S3_BACKEND, sha256):
+            head = self.retry(
+                engine.head_object, UPLOADED_MODELS_BUCKET_NAME, key,
+                description=f"Checking {key} on S3"
+            )
+            if head is not None and self.is_same_content(head, sha256, file_path):
+                return key
+            self.content_index.remove(S3_BACKEND, sha256, key)
+        return None
+
     @pyqtSlot()
     def run(self):
         try:
             self.signals.progress_message.emit(self.file_id, 10, "Uploading to S3")
-            
-            file_size = os.path.getsize(self.file_path)
-            
-            def upload_progress(transfered):
-                progress = int(transfered / file_size * 100)
-                self.signals.progress_message.emit(
-                    self.file_id,
-                    progress * MODEL_FILE_UPLOAD_PROGRESS_RATIO,
-                    f"Uploading {self.model_file_name}: {progress}%"
-                )
+            engine = get_s3_transfer_engine()
 
-            model_key = os.path.join(
-                self.category_path,
-                self.model_file_name
-            )
-            
-            s3_client.upload_file(
-                Filename=self.file_path,
-                Bucket=UPLOADED_MODELS_BUCKET_NAME,
-                Key=model_key,
-                Callback=upload_progress
-            )
+            model_stage = self.get_stage(S3_MODEL_STAGE)
+            if model_stage:
+                model_key = model_stage['key']
+                print(f"{model_key} was uploaded before the restart, skipping upload")
+            else:
+                with self.measure_stage(S3_MODEL_STAGE) as span:
+                    model_key = os.path.join(
+                        self.category_path,
+                        self.model_file_name
+                    )
+
+                    self.signals.progress_message.emit(self.file_id, 10, "Looking for an existing copy on S3")
+                    model_sha256 = self.content_index.hash_file(self.file_path)
+                    existing_model_key = self.find_existing_object(engine, model_sha256, self.file_path)
+                    if existing_model_key == model_key:
+                        print(f"{model_key} already holds this model, skipping upload")
+                    elif existing_model_key:
+                        self.signals.progress_message.emit(self.file_id, 10, f"Copying existing model {existing_model_key} on S3")
+                        self.retry(
+                            engine.copy_object,
+                            UPLOADED_MODELS_BUCKET_NAME, existing_model_key,
+                            UPLOADED_MODELS_BUCKET_NAME, model_key,
+                            description=f"Copying {existing_model_key} on S3"
+                        )
+                    else:
+                        self.upload_model(engine, model_key, model_sha256, span)
+                    self.content_index.add(S3_BACKEND, model_sha256, model_key)
+                    self.complete_stage(S3_MODEL_STAGE, {'key': model_key})
             
-            self.signals.progress_message.emit(
-                self.file_id,
-                FULL_3D_MODEL_PROGRESS,
-                "Uploaded images to S3"
-            )
-            image_key_list = []
-            image_count = len(self.image_path_list)
-            for i, image_path in enumerate(self.image_path_list):
+            # sizes of the images actually sent, appended from the image threads
+            image_size_list = []
+
+            def upload_image(i: int, image_path: str) -> str:
+                # identical previews are shared between models instead of stored again
+                image_sha256 = self.content_index.hash_file(image_path)
+                existing_image_key = self.find_existing_object(engine, image_sha256, image_path)
+                if existing_image_key:
+                    print(f"Image {image_path} already stored as {existing_image_key}")
+                    return existing_image_key
+
                 fs_image_file_name = os.path.basename(image_path)
                 image_file_name = f'{self.file_name}-preview-{i}{os.path.splitext(fs_image_file_name)[1]}'
-                
-                self.signals.progress_message.emit(
-                    self.file_id,
-                    FULL_3D_MODEL_PROGRESS + (i * 29 / image_count),
-                    f"Uploading image {image_file_name} to S3 - {i + 1}/{image_count}"
-                )
                 image_key = os.path.join(
                     self.category_path,
                     image_file_name
                 )
-                s3_client.upload_file(
-                    Filename=image_path,
-                    Bucket=UPLOADED_MODELS_BUCKET_NAME,
-                    Key=image_key
-                )
-                image_key_list.append(image_key)
-                self.signals.progress_message.emit(
-                    self.file_id,
-                    FULL_3D_MODEL_PROGRESS + ((i + 1) * 29 / image_count),
-                    f"Uploaded image {fs_image_file_name} as {image_file_name}"
+                self.retry(
+                    engine.put_file,
+                    image_path,
+                    UPLOADED_MODELS_BUCKET_NAME,
+                    image_key,
+                    {SHA256_METADATA_KEY: image_sha256},
+                    self.cancel_event,
+                    description=f"Uploading image {fs_image_file_name} to S3"
                 )
+                image_size_list.append(os.path.getsize(image_path))
+                self.content_index.add(S3_BACKEND, image_sha256, image_key)
+                print(f"Uploaded image {fs_image_file_name} as {image_key}")
+                return image_key
+
+            image_stage = self.get_stage(S3_IMAGES_STAGE)
+            if image_stage:
+                image_key_list = image_stage['key_list']
+            else:
+                with self.measure_stage(S3_IMAGES_STAGE) as span:
+                    image_key_list = self.upload_images(
+                        upload_image, "S3",
+                        self.upload_config.get('image_concurrency', DEFAULT_IMAGE_CONCURRENCY)
+                    )
+                    span['byte_count'] = sum(image_size_list)
+                self.complete_stage(S3_IMAGES_STAGE, {'key_list': image_key_list})
             
         except:
             traceback.print_exc()
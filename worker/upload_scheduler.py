@@ -0,0 +1,143 @@
+import time
+import itertools
+from threading import Lock
+from typing import Dict, List, Optional
+
+from PyQt6.QtCore import QRunnable, QThreadPool
+from ulid import ULID
+
+FIFO_POLICY = 'fifo'
+SMALL_FIRST_POLICY = 'small_first'
+
+DEFAULT_BACKEND_LIMIT_DICT = {
+    's3': 3,
+    'google_drive': 3
+}
+# recent admissions kept to compute the average wait of a backend
+WAIT_HISTORY_SIZE = 50
+# seconds after which a queued entry is admitted in arrival order, a steady
+# stream of small files cannot hold a large one back for longer
+DEFAULT_MAX_WAIT = 600
+
+
+class _QueueEntry:
+    def __init__(
+            self,
+            backend: str,
+            file_id: ULID,
+            runnable: QRunnable,
+            size: int,
+            priority: int,
+            seq: int
+        ):
+        self.backend = backend
+        self.file_id = file_id
+        self.runnable = runnable
+        self.size = size
+        self.priority = priority
+        self.seq = seq
+        self.enqueued_at = time.monotonic()
+        self.is_started = False
+
+
+class UploadScheduler:
+    def __init__(self, scheduler_config: Optional[dict] = None):
+        scheduler_config = scheduler_config or {}
+        self.policy = scheduler_config.get('policy', SMALL_FIRST_POLICY)
+        self.max_wait = scheduler_config.get('max_wait', DEFAULT_MAX_WAIT)
+        self.limit_dict: Dict[str, int] = {
+            **DEFAULT_BACKEND_LIMIT_DICT,
+            **scheduler_config.get('limits', {})
+        }
+        self.queue_dict: Dict[str, List[_QueueEntry]] = {x: [] for x in self.limit_dict}
+        self.running_dict: Dict[str, int] = {x: 0 for x in self.limit_dict}
+        self.wait_history_dict: Dict[str, List[float]] = {x: [] for x in self.limit_dict}
+        self.priority_dict: Dict[ULID, int] = {}
+        self.seq = itertools.count()
+        self.lock = Lock()
+
+        self.threadpool = QThreadPool()
+        self.threadpool.setMaxThreadCount(sum(self.limit_dict.values()))
+
+    def sort_key(self, entry: _QueueEntry, now: float):
+        is_overdue = now - entry.enqueued_at >= self.max_wait
+        size = entry.size if self.policy == SMALL_FIRST_POLICY and not is_overdue else 0
+        return (-entry.priority, not is_overdue, size, entry.seq)
+
+    def submit(self, backend: str, file_id: ULID, runnable: QRunnable, size: int = 0):
+        with self.lock:
+            if backend not in self.limit_dict:
+                raise ValueError(f"Unknown backend {backend}")
+            entry = _QueueEntry(
+                backend, file_id, runnable, size,
+                self.priority_dict.get(file_id, 0),
+                next(self.seq)
+            )
+            self.queue_dict[backend].append(entry)
+            runnable.signals.finished.connect(lambda: self.release(entry))
+        self.dispatch(backend)
+
+    def release(self, entry: _QueueEntry):
+        # a cancelled runnable that never started held no slot
+        with self.lock:
+            if not entry.is_started:
+                return
+            entry.is_started = False
+            self.running_dict[entry.backend] -= 1
+        self.dispatch(entry.backend)
+
+    def dispatch(self, backend: str):
+        start_list = []
+        with self.lock:
+            queue = self.queue_dict[backend]
+            now = time.monotonic()
+            while queue and self.running_dict[backend] < self.limit_dict[backend]:
+                entry = min(queue, key=lambda x: self.sort_key(x, now))
+                queue.remove(entry)
+                self.running_dict[backend] += 1
+                entry.is_started = True
+                wait_history = self.wait_history_dict[backend]
+                wait_history.append(now - entry.enqueued_at)
+                del wait_history[:-WAIT_HISTORY_SIZE]
+                start_list.append(entry)
+        for entry in start_list:
+            self.threadpool.start(entry.runnable)
+
+    def set_priority(self, file_id: ULID, priority: int):
+        with self.lock:
+            self.priority_dict[file_id] = priority
+            for queue in self.queue_dict.values():
+                for entry in queue:
+                    if entry.file_id == file_id:
+                        entry.priority = priority
+
+    def move_to_top(self, file_id: ULID):
+        with self.lock:
+            top_priority = max(self.priority_dict.values(), default=0)
+        self.set_priority(file_id, top_priority + 1)
+
+    def cancel(self, file_id: ULID) -> List[QRunnable]:
+        cancelled_list = []
+        with self.lock:
+            self.priority_dict.pop(file_id, None)
+            for backend, queue in self.queue_dict.items():
+                cancelled_list += [x.runnable for x in queue if x.file_id == file_id]
+                self.queue_dict[backend] = [x for x in queue if x.file_id != file_id]
+        return cancelled_list
+
+    def get_stats(self) -> Dict[str, dict]:
+        now = time.monotonic()
+        with self.lock:
+            return {
+                backend: {
+                    'limit': self.limit_dict[backend],
+                    'running': self.running_dict[backend],
+                    'queued': len(queue),
+                    'oldest_wait': max((now - x.enqueued_at for x in queue), default=0.0),
+                    'average_wait': (
+                        sum(self.wait_history_dict[backend]) / len(self.wait_history_dict[backend])
+                        if self.wait_history_dict[backend] else 0.0
+                    )
+                }
+                for backend, queue in self.queue_dict.items()
+            }
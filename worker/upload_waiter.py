@@ -27,10 +27,12 @@ class UploadWaiterWorker(QObject):
         self.render_engine = render_engine
         
         self.count = 0
+        self.finished_count = 0
         self.signals = WorkerSignals()
         self.worker_dict = {}
         self.progress_dict = {}
         self.result_dict = {}
+        self.error_dict = {}
     
     def add_upload_worker(self, slot_id: str, worker: UploadWorker):
         if worker.file_id != self.file_id:
@@ -41,6 +43,7 @@ class UploadWaiterWorker(QObject):
         worker.signals.progress_message.connect(lambda x, y, z: self.receive_progress_message(slot_id, x, y, z))
         worker.signals.result.connect(lambda x, y: self.receive_result(slot_id, x, y))
         worker.signals.error.connect(lambda x, y: self.receive_error(slot_id, x, y))
+        worker.signals.retry.connect(lambda x, y, z, w: self.receive_retry(slot_id, x, y, z, w))
         worker.signals.finished.connect(self.receive_finished)
     
     @pyqtSlot(str, ULID, tuple)
@@ -52,11 +55,14 @@ class UploadWaiterWorker(QObject):
         if self.count > 0:
             print(f'Waiting for {self.count} upload event')
             return
+        if self.error_dict:
+            # a failed or unverified backend must never reach the API commit
+            print(f"Not committing {file_id}, {', '.join(self.error_dict)} failed")
+            return
         self.signals.result.emit(file_id, (self.result_dict,))
     
     @pyqtSlot(str, ULID, float, str)
     def receive_progress_message(self, slot_id: str, file_id: ULID, progress: float, message: str):
-        print(f"Received upload progress of {slot_id} for {file_id}: {progress:.2f}% - {message}")
         self.progress_dict[slot_id] = progress
         self.signals.progress_message.emit(
             self.file_id,
@@ -64,15 +70,29 @@ class UploadWaiterWorker(QObject):
             message
         )
     
+    @pyqtSlot(str, ULID, str, int, str)
+    def receive_retry(self, slot_id: str, file_id: ULID, backend: str, retry_count: int, message: str):
+        # the task keeps its progress, only the message tells about the retry
+        self.signals.progress_message.emit(
+            self.file_id,
+            math.ceil(sum(self.progress_dict.values()) / len(self.progress_dict)) if self.progress_dict else 0,
+            message
+        )
+        self.signals.retry.emit(file_id, backend, retry_count, message)
+    
     @pyqtSlot(str, ULID, tuple)
     def receive_error(self, slot_id: str, file_id: ULID, err_tuple: tuple):
         print(f"Slot {slot_id} caused error: {err_tuple[0]}")
         self.count -= 1
+        self.error_dict[slot_id] = err_tuple
         self.signals.error.emit(file_id, err_tuple)
     
     @pyqtSlot()
     def receive_finished(self):
-        if self.count > 0:
-            print(f'Waiting for remaining {self.count} finish event')
+        # counted apart from the results, two workers failing together
+        # would otherwise both see a count of zero
+        self.finished_count += 1
+        if self.finished_count < len(self.worker_dict):
+            print(f'Waiting for remaining {len(self.worker_dict) - self.finished_count} finish event')
             return
         self.signals.finished.emit()
\ No newline at end of file